@@ -1,18 +1,27 @@
 import argparse
+from functools import partial
+import os
 
 import napari
 
 from .calcium_curator import CalciumCurator
-from .io.caiman.caiman_reader import caiman_reader
-from .io.s2p.s2p_reader import s2p_reader
-
-
-READER_FUNCS = {"s2p": s2p_reader, "caiman": caiman_reader}
+from .images.proxy import load_temporal_proxy, temporal_proxy_path
+from .images.summary import load_summary_images
+from .io.pipeline import Stage
+from .io.readers import open_dataset, reader_names
+from .io.server import DEFAULT_HOST, DEFAULT_PORT, connect
+from .io.utils.cache import sidecar_path
+from .memory import set_memory_budget
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description="CalciumCurator")
-    parser.add_argument("--pipeline", default="", type=str, help="options")
+    parser.add_argument(
+        "--pipeline",
+        default="",
+        type=str,
+        help=f"the pipeline reader: {', '.join(reader_names())}",
+    )
     parser.add_argument(
         "--pipeline-params", default="", type=str, help="options"
     )
@@ -22,6 +31,65 @@ def parse_args():
     parser.add_argument("--cell", default="", type=str, help="options")
     parser.add_argument("--spikes", default="", type=str, help="options")
     parser.add_argument("--output", default=".", type=str, help="options")
+    parser.add_argument(
+        "--server",
+        action="store_true",
+        help="load the data in a separate data server process",
+    )
+    parser.add_argument(
+        "--server-port", default=DEFAULT_PORT, type=int, help="options"
+    )
+    parser.add_argument(
+        "--mask-display",
+        default="labels",
+        choices=["labels", "vectors"],
+        help="display the cell masks as labels images or contour vectors",
+    )
+    parser.add_argument(
+        "--filled-masks",
+        action="store_true",
+        help="draw the filled cell masks instead of their outlines",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        default=None,
+        type=str,
+        help="memory budget of the caches, e.g. 8G",
+    )
+    parser.add_argument(
+        "--temporal-proxy",
+        default=0,
+        type=int,
+        help=(
+            "display the mean of this many frames while scrubbing "
+            "(0 disables the proxy)"
+        ),
+    )
+    parser.add_argument(
+        "--no-raster",
+        action="store_true",
+        help="do not display the raster of the traces of all cells",
+    )
+    parser.add_argument(
+        "--activity-colors",
+        action="store_true",
+        help="color the cells by their activity at the current frame",
+    )
+    parser.add_argument(
+        "--normalize",
+        default=None,
+        choices=["zscore", "minmax"],
+        help="display the normalized traces, precomputed at load",
+    )
+    parser.add_argument(
+        "--baseline-window",
+        default=None,
+        type=int,
+        help=(
+            "the dF/F baseline window in frames "
+            "(default: 60 s at the frame rate of the data, or 600 frames)"
+        ),
+    )
 
     args = parser.parse_args()
 
@@ -33,6 +101,18 @@ def parse_args():
     cell_path = args.cell
     spikes_path = args.spikes
     output_dir = args.output
+    use_server = args.server
+    server_port = args.server_port
+    mask_display = args.mask_display
+    mask_outlines = not args.filled_masks
+    proxy_bin_size = args.temporal_proxy
+    show_raster = not args.no_raster
+    activity_colors = args.activity_colors
+    trace_normalization = args.normalize
+    baseline_window = args.baseline_window
+    memory_budget = args.memory_budget
+    if memory_budget is not None:
+        set_memory_budget(memory_budget)
 
     return (
         pipeline_name,
@@ -43,6 +123,16 @@ def parse_args():
         cell_path,
         spikes_path,
         output_dir,
+        use_server,
+        server_port,
+        mask_display,
+        mask_outlines,
+        proxy_bin_size,
+        show_raster,
+        activity_colors,
+        trace_normalization,
+        baseline_window,
+        memory_budget,
     )
 
 
@@ -56,40 +146,99 @@ def main():
         cell_path,
         spikes_path,
         output_dir,
+        use_server,
+        server_port,
+        mask_display,
+        mask_outlines,
+        proxy_bin_size,
+        show_raster,
+        activity_colors,
+        trace_normalization,
+        baseline_window,
+        memory_budget,
     ) = parse_args()
 
-    try:
-        reader_func = READER_FUNCS[pipeline_name]
-    except KeyError:
-        raise KeyError("unknown pipline. valid options are s2p and caiman")
+    reader_kwargs = {
+        "pipeline_params": pipeline_params,
+        "image_path": image_path,
+        "snr_path": snr_path,
+        "trace_path": trace_path,
+        "cell_path": cell_path,
+        "spikes_path": spikes_path,
+    }
 
-    (
-        im_registered,
-        data_range,
-        contour_manager,
-        f_traces,
-        snr,
-        snr_mask,
-        spikes,
-        is_cell,
-    ) = reader_func(
-        pipeline_params,
-        image_path,
-        snr_path,
-        trace_path,
-        cell_path,
-        spikes_path,
+    # the suite2p neuropil traces are stored next to the traces, and the
+    # caches of the corrected traces are rebuilt if they change
+    if trace_path:
+        neuropil_path = os.path.join(
+            os.path.dirname(os.path.abspath(trace_path)), "Fneu.npy"
+        )
+    else:
+        neuropil_path = None
+
+    # the summary images are cached next to the movie
+    if image_path == "":
+        source_path = pipeline_params
+    else:
+        source_path = image_path
+    summary_cache_path = sidecar_path(source_path, 'summary', ext='.npz')
+
+    if use_server:
+        # the server process owns the readers and keeps the dataset
+        # loaded between viewer launches
+        client = connect(
+            (DEFAULT_HOST, server_port), memory_budget=memory_budget
+        )
+        dataset = client.open_dataset(pipeline_name, **reader_kwargs)
+        load_summary = client.summary_images
+        load_proxy = client.temporal_proxy
+    else:
+        dataset = open_dataset(pipeline_name, **reader_kwargs)
+        load_summary = load_summary_images
+        load_proxy = load_temporal_proxy
+    dataset.add_stage(
+        "summary_images",
+        Stage(
+            partial(
+                load_summary,
+                cache_path=summary_cache_path,
+                source_paths=[source_path],
+            ),
+            requires=("movie",),
+        ),
     )
 
+    if proxy_bin_size > 1:
+        dataset.add_stage(
+            "temporal_proxy",
+            Stage(
+                partial(
+                    load_proxy,
+                    bin_size=proxy_bin_size,
+                    cache_path=temporal_proxy_path(
+                        source_path, proxy_bin_size
+                    ),
+                    source_paths=[source_path],
+                ),
+                requires=("movie",),
+            ),
+        )
+
     with napari.gui_qt():
-        CalciumCurator(
-            img=im_registered,
-            data_range=data_range,
-            contour_manager=contour_manager,
-            f=f_traces,
-            snr=snr,
-            snr_mask=snr_mask,
-            spikes=spikes,
+        # the viewer opens as soon as the movie is opened and the other
+        # fields are attached as they load
+        CalciumCurator.from_dataset(
+            dataset,
             output=output_dir,
-            cells=is_cell,
+            mask_display=mask_display,
+            mask_outlines=mask_outlines,
+            show_raster=show_raster,
+            activity_colors=activity_colors,
+            trace_normalization=trace_normalization,
+            trace_path=trace_path or pipeline_params or None,
+            neuropil_path=neuropil_path,
+            mask_path=pipeline_params or None,
+            baseline_window=baseline_window,
         )
+    # the files of the movie are closed with the viewer
+    dataset.close()
@@ -0,0 +1,126 @@
+from typing import Optional, Sequence
+
+import numpy as np
+
+from .features import FEATURE_NAMES, feature_matrix
+
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    return 0.5 * (1 + np.tanh(0.5 * x))
+
+
+class CurationClassifier:
+    """Logistic regression of the curation decisions on the cell features
+
+    The features are standardized and the weights are fit with Newton's
+    method (iteratively reweighted least squares) with an L2 penalty,
+    which converges in a few iterations for the handful of features.
+
+    Parameters
+    ----------
+    feature_names : Sequence[str]
+        The names of the features (see FEATURE_DTYPE) used by the
+        classifier. The default value is all the features.
+    l2_penalty : float
+        The L2 penalty of the weights (not of the intercept).
+        The default value is 1.
+    max_iterations : int
+        The maximum number of Newton iterations. The default value is 50.
+    """
+
+    def __init__(
+        self,
+        feature_names: Sequence[str] = FEATURE_NAMES,
+        l2_penalty: float = 1,
+        max_iterations: int = 50,
+    ):
+        self.feature_names = tuple(feature_names)
+        self.l2_penalty = l2_penalty
+        self.max_iterations = max_iterations
+
+        self.mean = None
+        self.scale = None
+        self.weights = None
+
+    @property
+    def is_fit(self) -> bool:
+        return self.weights is not None
+
+    def _design_matrix(self, features: np.ndarray) -> np.ndarray:
+        X = (feature_matrix(features, self.feature_names) - self.mean) / (
+            self.scale
+        )
+        X = np.nan_to_num(X, nan=0, posinf=0, neginf=0)
+        return np.column_stack([np.ones(len(X)), X])
+
+    def fit(
+        self,
+        features: np.ndarray,
+        accepted: np.ndarray,
+        sample_weight: Optional[np.ndarray] = None,
+    ) -> 'CurationClassifier':
+        """Fit the classifier to curation decisions
+
+        Parameters
+        ----------
+        features : np.ndarray
+            (n_samples,) structured array of the features of the curated
+            cells.
+        accepted : np.ndarray
+            (n_samples,) boolean array, True for the accepted cells.
+        sample_weight : Optional[np.ndarray]
+            (n_samples,) array of the weight of each sample.
+            If None, all the samples have a weight of 1.
+
+        Returns
+        -------
+        classifier : CurationClassifier
+            The fitted classifier.
+        """
+        accepted = np.asarray(accepted, dtype=bool)
+        if len(np.unique(accepted)) < 2:
+            raise ValueError(
+                'the curated cells must include accepted and rejected cells'
+            )
+        if sample_weight is None:
+            sample_weight = np.ones(len(accepted))
+
+        raw = feature_matrix(features, self.feature_names)
+        self.mean = np.nanmean(raw, axis=0)
+        self.scale = np.nanstd(raw, axis=0)
+        self.scale[~(self.scale > 0)] = 1
+        X = self._design_matrix(features)
+        y = accepted.astype(np.float64)
+
+        penalty = np.full(X.shape[1], float(self.l2_penalty))
+        penalty[0] = 0
+        weights = np.zeros(X.shape[1])
+        for _ in range(self.max_iterations):
+            p = _sigmoid(X @ weights)
+            gradient = X.T @ (sample_weight * (p - y)) + penalty * weights
+            hessian = (X.T * (sample_weight * p * (1 - p))) @ X
+            hessian[np.diag_indices_from(hessian)] += penalty + 1e-9
+            step = np.linalg.solve(hessian, gradient)
+            weights -= step
+            if np.max(np.abs(step)) < 1e-6:
+                break
+        self.weights = weights
+
+        return self
+
+    def predict_proba(self, features: np.ndarray) -> np.ndarray:
+        """Get the probability that each cell is accepted
+
+        Parameters
+        ----------
+        features : np.ndarray
+            (n_cells,) structured array of the features.
+
+        Returns
+        -------
+        probability : np.ndarray
+            (n_cells,) array of the probability of acceptance.
+        """
+        if not self.is_fit:
+            raise RuntimeError('the classifier is not fit')
+        return _sigmoid(self._design_matrix(features) @ self.weights)
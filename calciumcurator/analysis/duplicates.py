@@ -0,0 +1,231 @@
+import itertools
+from typing import Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+from .footprints import footprint_bboxes
+
+
+DUPLICATE_DTYPE = np.dtype(
+    [
+        ('cell_a', np.int64),
+        ('cell_b', np.int64),
+        ('overlap', np.float32),
+        ('correlation', np.float32),
+        ('score', np.float32),
+    ]
+)
+
+
+def find_neighbor_pairs(
+    bbox_min: np.ndarray, bbox_max: np.ndarray
+) -> np.ndarray:
+    """Find the pairs of cells with intersecting bounding boxes
+
+    Candidate pairs are found with a KD-tree on the bounding box centers
+    and then filtered with the exact intersection test. Two boxes
+    intersect only if their centers are closer than the sum of their
+    extents, so at most twice the larger extent: each cell looks for the
+    smaller cells within twice its own extent. The cost grows with the
+    number of neighbors of each cell, so one large cell does not make
+    every cell a neighbor of every other.
+
+    Parameters
+    ----------
+    bbox_min : np.ndarray
+        (n_cells, n_dims) array of the minimum coordinates of each bbox.
+    bbox_max : np.ndarray
+        (n_cells, n_dims) array of the maximum coordinates of each bbox.
+
+    Returns
+    -------
+    pairs : np.ndarray
+        (n_pairs, 2) array of cell indices with i < j.
+    """
+    valid = np.all(bbox_max >= bbox_min, axis=1)
+    valid_indices = np.flatnonzero(valid)
+    if len(valid_indices) < 2:
+        return np.zeros((0, 2), dtype=np.int64)
+    bbox_min = bbox_min[valid]
+    bbox_max = bbox_max[valid]
+
+    centers = (bbox_min + bbox_max) / 2
+    extents = np.linalg.norm((bbox_max - bbox_min) / 2, axis=1)
+
+    tree = cKDTree(centers)
+    neighbors = tree.query_ball_point(
+        centers, r=np.maximum(2 * extents, 1), return_sorted=False
+    )
+    counts = np.fromiter(map(len, neighbors), dtype=np.int64)
+    first = np.repeat(np.arange(len(centers)), counts)
+    second = np.fromiter(
+        itertools.chain.from_iterable(neighbors),
+        dtype=np.int64,
+        count=int(counts.sum()),
+    )
+    # each pair is kept once, when found by the larger cell
+    is_larger = (extents[first] > extents[second]) | (
+        (extents[first] == extents[second]) & (first < second)
+    )
+    pairs = np.column_stack((first[is_larger], second[is_larger]))
+    if len(pairs) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+
+    intersects = np.all(
+        (bbox_min[pairs[:, 0]] <= bbox_max[pairs[:, 1]])
+        & (bbox_min[pairs[:, 1]] <= bbox_max[pairs[:, 0]]),
+        axis=1,
+    )
+    pairs = valid_indices[pairs[intersects]]
+
+    return np.sort(pairs, axis=1)
+
+
+def pair_overlaps(
+    footprints: sparse.spmatrix, pairs: np.ndarray, block_size: int = 10000
+) -> np.ndarray:
+    """Compute the spatial overlap of pairs of footprints
+
+    The overlap is the number of shared pixels divided by the area of the
+    smaller footprint. Only the entries of the footprint Gram matrix for
+    the given pairs are computed.
+
+    Parameters
+    ----------
+    footprints : sparse.spmatrix
+        (n_cells, n_frame_pixels) matrix whose nonzero entries are the
+        pixels of each cell. These must be the whole filled ROIs (not
+        their outlines, nor masks without the pixels shared by cells).
+    pairs : np.ndarray
+        (n_pairs, 2) array of cell indices.
+    block_size : int
+        The number of pairs processed at once.
+
+    Returns
+    -------
+    overlaps : np.ndarray
+        (n_pairs,) array of overlaps between 0 and 1.
+    """
+    binary = sparse.csr_matrix(footprints, dtype=np.float32, copy=True)
+    binary.data[:] = 1
+    areas = np.asarray(binary.sum(axis=1)).ravel()
+
+    overlaps = np.zeros((len(pairs),), dtype=np.float32)
+    for start in range(0, len(pairs), block_size):
+        block = pairs[start : start + block_size]
+        intersection = np.asarray(
+            binary[block[:, 0]].multiply(binary[block[:, 1]]).sum(axis=1)
+        ).ravel()
+        smaller_area = np.minimum(areas[block[:, 0]], areas[block[:, 1]])
+        np.divide(
+            intersection,
+            smaller_area,
+            out=overlaps[start : start + block_size],
+            where=smaller_area > 0,
+        )
+
+    return overlaps
+
+
+def pair_correlations(
+    traces: np.ndarray, pairs: np.ndarray, block_size: int = 1000
+) -> np.ndarray:
+    """Compute the Pearson correlation of the traces of pairs of cells
+
+    Parameters
+    ----------
+    traces : np.ndarray
+        (n_cells, n_frames) array of traces.
+    pairs : np.ndarray
+        (n_pairs, 2) array of cell indices.
+    block_size : int
+        The number of pairs processed at once.
+
+    Returns
+    -------
+    correlations : np.ndarray
+        (n_pairs,) array of correlations.
+    """
+    correlations = np.zeros((len(pairs),), dtype=np.float32)
+    for start in range(0, len(pairs), block_size):
+        block = pairs[start : start + block_size]
+
+        # z-score the traces of the cells in the block once
+        block_cells, inverse = np.unique(block, return_inverse=True)
+        inverse = inverse.reshape(block.shape)
+        block_traces = np.asarray(traces[block_cells], dtype=np.float32)
+        block_traces = block_traces - block_traces.mean(axis=1, keepdims=True)
+        norms = np.linalg.norm(block_traces, axis=1, keepdims=True)
+        np.divide(block_traces, norms, out=block_traces, where=norms > 0)
+
+        correlations[start : start + block_size] = np.einsum(
+            'ij,ij->i',
+            block_traces[inverse[:, 0]],
+            block_traces[inverse[:, 1]],
+        )
+
+    return correlations
+
+
+def find_duplicates(
+    footprints: sparse.spmatrix,
+    im_shape: Tuple[int, ...],
+    traces: Optional[np.ndarray] = None,
+    min_overlap: float = 0.2,
+    min_correlation: Optional[float] = None,
+) -> np.ndarray:
+    """Find pairs of cells that are likely duplicates or split ROIs
+
+    Pairs of cells with intersecting bounding boxes are found first, then
+    their spatial overlap is computed and only the pairs overlapping by at
+    least min_overlap get their trace correlation computed.
+
+    Parameters
+    ----------
+    footprints : sparse.spmatrix
+        (n_cells, n_frame_pixels) matrix whose nonzero entries are the
+        pixels of the filled ROI of each cell (see pair_overlaps()).
+    im_shape : Tuple[int, ...]
+        The shape of a frame.
+    traces : Optional[np.ndarray]
+        (n_cells, n_frames) array of traces. If None, the candidates are
+        ranked by overlap only.
+    min_overlap : float
+        The minimum overlap of a candidate pair. The default value is 0.2.
+    min_correlation : Optional[float]
+        If provided, pairs with a lower trace correlation are discarded.
+
+    Returns
+    -------
+    duplicates : np.ndarray
+        Structured array with fields 'cell_a', 'cell_b', 'overlap',
+        'correlation' and 'score' (overlap x positive correlation), sorted
+        from the most to the least likely duplicate.
+    """
+    bbox_min, bbox_max = footprint_bboxes(footprints, im_shape)
+    pairs = find_neighbor_pairs(bbox_min, bbox_max)
+
+    overlaps = pair_overlaps(footprints, pairs)
+    candidates = overlaps >= min_overlap
+    pairs = pairs[candidates]
+    overlaps = overlaps[candidates]
+
+    if traces is not None:
+        correlations = pair_correlations(traces, pairs)
+        scores = overlaps * np.maximum(correlations, 0)
+    else:
+        correlations = np.full(overlaps.shape, np.nan, dtype=np.float32)
+        scores = overlaps
+
+    duplicates = np.zeros((len(pairs),), dtype=DUPLICATE_DTYPE)
+    duplicates['cell_a'] = pairs[:, 0]
+    duplicates['cell_b'] = pairs[:, 1]
+    duplicates['overlap'] = overlaps
+    duplicates['correlation'] = correlations
+    duplicates['score'] = scores
+    if min_correlation is not None:
+        duplicates = duplicates[correlations >= min_correlation]
+
+    return duplicates[np.argsort(-duplicates['score'], kind='stable')]
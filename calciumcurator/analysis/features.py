@@ -0,0 +1,296 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+from typing import Callable, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from ..io.utils.cache import is_cache_valid
+from .footprints import footprint_coordinates
+
+
+FEATURE_DTYPE = np.dtype(
+    [
+        ('area', np.float32),
+        ('compactness', np.float32),
+        ('eccentricity', np.float32),
+        ('skewness', np.float32),
+        ('peak_dff', np.float32),
+        ('event_rate', np.float32),
+    ]
+)
+FEATURE_NAMES = FEATURE_DTYPE.names
+
+# the default number of cells whose traces are processed per task
+DEFAULT_CHUNK_CELLS = 512
+
+
+def shape_features(
+    footprints: sparse.spmatrix, im_shape: Tuple[int, ...]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Compute the area, compactness and eccentricity of every footprint
+
+    All cells are processed at once from the packed footprint pixels.
+    The shape is measured in the plane of the last two dimensions.
+
+    Parameters
+    ----------
+    footprints : sparse.spmatrix
+        (n_cells, n_frame_pixels) matrix of the pixel weights of each cell.
+    im_shape : Tuple[int, ...]
+        The shape of a frame.
+
+    Returns
+    -------
+    area : np.ndarray
+        (n_cells,) array of the number of pixels of each footprint.
+    compactness : np.ndarray
+        (n_cells,) array of 4 pi area / perimeter ** 2, where the
+        perimeter is the number of pixel edges on the footprint boundary.
+        It is highest for round footprints and 0 for empty ones.
+    eccentricity : np.ndarray
+        (n_cells,) array of the eccentricity of the ellipse with the same
+        second moments as each footprint, from 0 (round) to 1 (a line).
+    """
+    footprints = sparse.csr_matrix(footprints)
+    n_cells = footprints.shape[0]
+    cell_ids, coordinates = footprint_coordinates(footprints, im_shape)
+    rows = coordinates[:, -2].astype(np.float64)
+    cols = coordinates[:, -1].astype(np.float64)
+
+    area = np.bincount(cell_ids, minlength=n_cells).astype(np.float64)
+    n_pixels = np.maximum(area, 1)
+
+    def _cell_mean(values):
+        return np.bincount(cell_ids, weights=values, minlength=n_cells) / (
+            n_pixels
+        )
+
+    row_mean = _cell_mean(rows)
+    col_mean = _cell_mean(cols)
+    row_var = _cell_mean(rows ** 2) - row_mean ** 2
+    col_var = _cell_mean(cols ** 2) - col_mean ** 2
+    covariance = _cell_mean(rows * cols) - row_mean * col_mean
+
+    # eigenvalues of the 2 x 2 covariance of each cell
+    half_trace = (row_var + col_var) / 2
+    root = np.sqrt(
+        np.maximum(half_trace ** 2 - (row_var * col_var - covariance ** 2), 0)
+    )
+    major = half_trace + root
+    minor = np.maximum(half_trace - root, 0)
+    eccentricity = np.zeros(n_cells)
+    np.sqrt(
+        1 - minor / np.maximum(major, 1e-12), out=eccentricity, where=major > 0
+    )
+
+    # the boundary edges are the pixel edges whose neighbor is not in the
+    # same cell. the pixels of each cell are keyed by (cell, pixel index),
+    # which are already sorted if the column indices are.
+    keys = np.sort(
+        cell_ids.astype(np.int64) * footprints.shape[1] + footprints.indices
+    )
+    n_rows, n_cols = im_shape[-2:]
+    perimeter = np.zeros(n_cells)
+    for row_shift, col_shift in ((0, 1), (0, -1), (1, 0), (-1, 0)):
+        neighbor_rows = coordinates[:, -2] + row_shift
+        neighbor_cols = coordinates[:, -1] + col_shift
+        in_frame = (
+            (neighbor_rows >= 0)
+            & (neighbor_rows < n_rows)
+            & (neighbor_cols >= 0)
+            & (neighbor_cols < n_cols)
+        )
+        neighbor_keys = (
+            cell_ids.astype(np.int64) * footprints.shape[1]
+            + footprints.indices
+            + row_shift * n_cols
+            + col_shift
+        )
+        positions = np.searchsorted(keys, neighbor_keys)
+        positions = np.minimum(positions, len(keys) - 1)
+        is_inside = in_frame & (keys[positions] == neighbor_keys)
+        perimeter += np.bincount(
+            cell_ids, weights=~is_inside, minlength=n_cells
+        )
+
+    compactness = np.zeros(n_cells)
+    np.divide(
+        4 * np.pi * area, perimeter ** 2, out=compactness, where=perimeter > 0,
+    )
+
+    return area, compactness, eccentricity
+
+
+def trace_features(
+    dff: np.ndarray, traces: np.ndarray, event_threshold: float = 3
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Compute the skewness, peak dF/F and event rate of traces
+
+    Parameters
+    ----------
+    dff : np.ndarray
+        (n_cells, n_frames) array of dF/F traces.
+    traces : np.ndarray
+        (n_cells, n_frames) array of the traces the skewness is computed
+        on, e.g., the neuropil corrected traces.
+    event_threshold : float
+        The events are the upward crossings of this many robust standard
+        deviations (1.4826 times the median absolute deviation) above the
+        median of the dF/F trace. The default value is 3.
+
+    Returns
+    -------
+    skewness : np.ndarray
+        (n_cells,) array of the skewness of each trace.
+    peak_dff : np.ndarray
+        (n_cells,) array of the maximum dF/F of each trace.
+    event_rate : np.ndarray
+        (n_cells,) array of the number of events per frame.
+    """
+    traces = np.asarray(traces, dtype=np.float32)
+    centered = traces - traces.mean(axis=1, keepdims=True)
+    # products rather than powers, which are much slower for floats
+    squared = centered * centered
+    variance = squared.mean(axis=1)
+    skewness = np.zeros(len(traces), dtype=np.float32)
+    np.divide(
+        np.mean(squared * centered, axis=1),
+        variance ** 1.5,
+        out=skewness,
+        where=variance > 0,
+    )
+
+    dff = np.asarray(dff, dtype=np.float32)
+    peak_dff = dff.max(axis=1)
+
+    median = np.median(dff, axis=1, keepdims=True)
+    noise = 1.4826 * np.median(np.abs(dff - median), axis=1, keepdims=True)
+    above = dff > median + event_threshold * np.maximum(noise, 1e-12)
+    n_events = np.count_nonzero(above[:, 1:] & ~above[:, :-1], axis=1)
+    n_events += above[:, 0]
+    event_rate = n_events / dff.shape[1]
+
+    return skewness, peak_dff, event_rate
+
+
+def compute_features(
+    footprints: sparse.spmatrix,
+    im_shape: Tuple[int, ...],
+    read_traces: Callable[[np.ndarray, str], np.ndarray],
+    chunk_cells: int = DEFAULT_CHUNK_CELLS,
+    n_workers: Optional[int] = None,
+) -> np.ndarray:
+    """Compute the features of every cell
+
+    The shape features are computed for all cells at once and the trace
+    features in chunks of cells processed in parallel.
+
+    Parameters
+    ----------
+    footprints : sparse.spmatrix
+        (n_cells, n_frame_pixels) matrix of the pixel weights of each cell.
+    im_shape : Tuple[int, ...]
+        The shape of a frame.
+    read_traces : Callable[[np.ndarray, str], np.ndarray]
+        Returns the traces of cells in a trace mode, e.g., the transform()
+        of a TraceTransformer. The 'neuropil' and 'dff' traces are read.
+        It is called from several threads.
+    chunk_cells : int
+        The number of cells whose traces are processed per task.
+        The default value is 512.
+    n_workers : Optional[int]
+        The number of worker threads. If None, the number of CPUs is used.
+
+    Returns
+    -------
+    features : np.ndarray
+        (n_cells,) structured array of the features (see FEATURE_DTYPE).
+    """
+    n_cells = footprints.shape[0]
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    features = np.zeros(n_cells, dtype=FEATURE_DTYPE)
+
+    (
+        features['area'],
+        features['compactness'],
+        features['eccentricity'],
+    ) = shape_features(footprints, im_shape)
+
+    def _chunk_features(start):
+        cell_indices = np.arange(start, min(start + chunk_cells, n_cells))
+        skewness, peak_dff, event_rate = trace_features(
+            read_traces(cell_indices, 'dff'),
+            read_traces(cell_indices, 'neuropil'),
+        )
+        features['skewness'][cell_indices] = skewness
+        features['peak_dff'][cell_indices] = peak_dff
+        features['event_rate'][cell_indices] = event_rate
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        for _ in executor.map(_chunk_features, range(0, n_cells, chunk_cells)):
+            pass
+
+    return features
+
+
+def load_features(
+    footprints: sparse.spmatrix,
+    im_shape: Tuple[int, ...],
+    read_traces: Callable[[np.ndarray, str], np.ndarray],
+    cache_path: Optional[str] = None,
+    source_paths: Sequence[str] = (),
+    n_workers: Optional[int] = None,
+) -> np.ndarray:
+    """Load the features of every cell, computing and caching them if needed
+
+    Parameters
+    ----------
+    footprints : sparse.spmatrix
+        (n_cells, n_frame_pixels) matrix of the pixel weights of each cell.
+    im_shape : Tuple[int, ...]
+        The shape of a frame.
+    read_traces : Callable[[np.ndarray, str], np.ndarray]
+        Returns the traces of cells in a trace mode.
+    cache_path : Optional[str]
+        The path to the .npy file the features are cached in.
+        If None, the features are not cached.
+    source_paths : Sequence[str]
+        The paths to the files the masks and traces are loaded from. The
+        cache is recomputed if any of them is newer than the cache.
+    n_workers : Optional[int]
+        The number of worker threads.
+
+    Returns
+    -------
+    features : np.ndarray
+        (n_cells,) structured array of the features (see FEATURE_DTYPE).
+    """
+    if cache_path is not None and is_cache_valid(cache_path, source_paths):
+        features = np.load(cache_path)
+        if features.dtype == FEATURE_DTYPE and len(features) == (
+            footprints.shape[0]
+        ):
+            return features
+
+    features = compute_features(
+        footprints, im_shape, read_traces, n_workers=n_workers
+    )
+    if cache_path is not None:
+        try:
+            np.save(cache_path, features)
+        except OSError:
+            # the output directory may be read only
+            pass
+
+    return features
+
+
+def feature_matrix(
+    features: np.ndarray, names: Sequence[str] = FEATURE_NAMES
+) -> np.ndarray:
+    """Stack features into a (n_cells, n_features) float64 matrix"""
+    return np.column_stack(
+        [features[name].astype(np.float64) for name in names]
+    )
@@ -0,0 +1,105 @@
+from typing import Tuple
+
+import numpy as np
+from scipy import sparse
+
+
+def footprint_coordinates(
+    footprints: sparse.spmatrix, im_shape: Tuple[int, ...]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Get the cell index and frame coordinates of every footprint pixel
+
+    Parameters
+    ----------
+    footprints : sparse.spmatrix
+        (n_cells, n_frame_pixels) matrix of the pixel weights of each cell.
+    im_shape : Tuple[int, ...]
+        The shape of a frame.
+
+    Returns
+    -------
+    cell_ids : np.ndarray
+        The index of the cell each pixel belongs to.
+    coordinates : np.ndarray
+        (n_pixels, len(im_shape)) array of pixel coordinates.
+    """
+    footprints = sparse.csr_matrix(footprints)
+    cell_ids = np.repeat(
+        np.arange(footprints.shape[0]), np.diff(footprints.indptr)
+    )
+    coordinates = np.column_stack(
+        np.unravel_index(footprints.indices, im_shape)
+    )
+
+    return cell_ids, coordinates
+
+
+def footprint_bboxes(
+    footprints: sparse.spmatrix, im_shape: Tuple[int, ...]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Get the bounding box of every footprint
+
+    Parameters
+    ----------
+    footprints : sparse.spmatrix
+        (n_cells, n_frame_pixels) matrix of the pixel weights of each cell.
+    im_shape : Tuple[int, ...]
+        The shape of a frame.
+
+    Returns
+    -------
+    bbox_min : np.ndarray
+        (n_cells, len(im_shape)) array of the minimum coordinates of each
+        footprint. Empty footprints have a minimum of 0.
+    bbox_max : np.ndarray
+        (n_cells, len(im_shape)) array of the maximum coordinates of each
+        footprint (inclusive). Empty footprints have a maximum of -1.
+    """
+    n_cells = footprints.shape[0]
+    cell_ids, coordinates = footprint_coordinates(footprints, im_shape)
+
+    bbox_min = np.full((n_cells, len(im_shape)), np.iinfo(np.int64).max)
+    bbox_max = np.full((n_cells, len(im_shape)), -1, dtype=np.int64)
+    for dim in range(len(im_shape)):
+        np.minimum.at(bbox_min[:, dim], cell_ids, coordinates[:, dim])
+        np.maximum.at(bbox_max[:, dim], cell_ids, coordinates[:, dim])
+    bbox_min[bbox_max < 0] = 0
+
+    return bbox_min, bbox_max
+
+
+def footprint_centroids(
+    footprints: sparse.spmatrix, im_shape: Tuple[int, ...]
+) -> np.ndarray:
+    """Get the centroid of every footprint
+
+    Parameters
+    ----------
+    footprints : sparse.spmatrix
+        (n_cells, n_frame_pixels) matrix of the pixel weights of each cell.
+    im_shape : Tuple[int, ...]
+        The shape of a frame.
+
+    Returns
+    -------
+    centroids : np.ndarray
+        (n_cells, len(im_shape)) array of the mean pixel coordinates of
+        each footprint. Empty footprints have a centroid of NaN.
+    """
+    n_cells = footprints.shape[0]
+    cell_ids, coordinates = footprint_coordinates(footprints, im_shape)
+    n_pixels = np.bincount(cell_ids, minlength=n_cells)
+
+    centroids = np.full((n_cells, len(im_shape)), np.nan)
+    for dim in range(len(im_shape)):
+        coordinate_sums = np.bincount(
+            cell_ids, weights=coordinates[:, dim], minlength=n_cells
+        )
+        np.divide(
+            coordinate_sums,
+            n_pixels,
+            out=centroids[:, dim],
+            where=n_pixels > 0,
+        )
+
+    return centroids
@@ -0,0 +1,183 @@
+from typing import Optional
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class CellNeighborIndex:
+    """Spatial index of the cells for navigating between neighbors
+
+    A KD-tree is built once on the cell centroids, so finding the nearest
+    cells to the current one costs O(log n_cells) per query instead of a
+    scan over all cells. The cells also have a sort order (e.g., by SNR)
+    that can be stepped through in O(1).
+
+    Parameters
+    ----------
+    centroids : np.ndarray
+        (n_cells, n_dims) array of the cell centroids. Cells with a NaN
+        centroid (e.g., empty masks) are not indexed.
+    order_values : Optional[np.ndarray]
+        (n_cells,) array of values used to order the cells, e.g., the SNR.
+        If None, the cells are ordered by index.
+    descending : bool
+        If True, the cells are ordered from the highest to the lowest
+        value. The default value is True.
+    """
+
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        order_values: Optional[np.ndarray] = None,
+        descending: bool = True,
+    ):
+        self.centroids = np.asarray(centroids, dtype=float)
+        valid = np.all(np.isfinite(self.centroids), axis=1)
+        self._indexed_cells = np.flatnonzero(valid)
+        self._tree = cKDTree(self.centroids[valid])
+
+        self.reviewed = np.zeros((self.n_cells,), dtype=bool)
+        self.set_order(order_values, descending=descending)
+
+    @property
+    def n_cells(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def n_reviewed(self) -> int:
+        return int(self.reviewed.sum())
+
+    @property
+    def order(self) -> np.ndarray:
+        """The cell indices in navigation order"""
+        return self._order
+
+    def set_order(
+        self,
+        order_values: Optional[np.ndarray],
+        descending: bool = True,
+        included: Optional[np.ndarray] = None,
+    ):
+        """Set the order used by step()
+
+        Parameters
+        ----------
+        order_values : Optional[np.ndarray]
+            (n_cells,) array of values used to order the cells.
+            If None, the cells are ordered by index.
+        descending : bool
+            If True, the cells are ordered from the highest to the lowest
+            value. The default value is True.
+        included : Optional[np.ndarray]
+            (n_cells,) boolean array of the cells in the order, e.g., the
+            cells passing a filter. If None, all cells are included.
+        """
+        if order_values is None:
+            self._order = np.arange(self.n_cells)
+        else:
+            order_values = np.asarray(order_values, dtype=float)
+            if descending:
+                order_values = -order_values
+            self._order = np.argsort(order_values, kind='stable')
+        if included is not None:
+            self._order = self._order[np.asarray(included)[self._order]]
+        # the cells that are not included have no rank
+        self._rank = np.full((self.n_cells,), -1, dtype=int)
+        self._rank[self._order] = np.arange(len(self._order))
+
+    def mark_reviewed(self, cell_indices, reviewed: bool = True):
+        """Mark cells as reviewed or not reviewed"""
+        self.reviewed[np.asarray(cell_indices, dtype=int)] = reviewed
+
+    def nearest_unreviewed(self, cell_index: int, k: int = 8) -> Optional[int]:
+        """Find the nearest cell that has not been reviewed
+
+        The k nearest neighbors are queried first and k is doubled until
+        an unreviewed cell is found, so the search only grows with the
+        number of reviewed cells around the current one.
+
+        Parameters
+        ----------
+        cell_index : int
+            The index of the current cell.
+        k : int
+            The number of neighbors in the first query.
+            The default value is 8.
+
+        Returns
+        -------
+        nearest_cell : Optional[int]
+            The index of the nearest unreviewed cell. None if all other
+            cells have been reviewed.
+        """
+        n_indexed = len(self._indexed_cells)
+        centroid = self.centroids[cell_index]
+        if n_indexed == 0 or not np.all(np.isfinite(centroid)):
+            return self._first_unreviewed(exclude=cell_index)
+
+        k = min(k, n_indexed)
+        while True:
+            _, neighbors = self._tree.query(centroid, k=k)
+            neighbors = self._indexed_cells[np.atleast_1d(neighbors)]
+            candidates = neighbors[
+                np.logical_not(self.reviewed[neighbors])
+                & (neighbors != cell_index)
+            ]
+            if len(candidates) > 0:
+                return int(candidates[0])
+            if k == n_indexed:
+                return None
+            k = min(2 * k, n_indexed)
+
+    def within_radius(self, cell_index: int, radius: float) -> np.ndarray:
+        """Find the cells with a centroid within a radius of a cell
+
+        Parameters
+        ----------
+        cell_index : int
+            The index of the center cell.
+        radius : float
+            The search radius in pixels.
+
+        Returns
+        -------
+        neighbors : np.ndarray
+            The indices of the neighboring cells sorted by distance,
+            excluding cell_index.
+        """
+        centroid = self.centroids[cell_index]
+        if not np.all(np.isfinite(centroid)):
+            return np.zeros((0,), dtype=int)
+        neighbors = np.asarray(
+            self._tree.query_ball_point(centroid, r=radius), dtype=int
+        )
+        neighbors = self._indexed_cells[neighbors]
+        distances = np.linalg.norm(
+            self.centroids[neighbors] - centroid, axis=1
+        )
+        neighbors = neighbors[np.argsort(distances, kind='stable')]
+
+        return neighbors[neighbors != cell_index]
+
+    def step(self, cell_index: int, step: int = 1) -> int:
+        """Get the cell step places after cell_index in the sort order
+
+        The order wraps around at both ends. From a cell that is not in
+        the order, stepping forward gives the first cell and stepping
+        backward the last one.
+        """
+        if len(self._order) == 0:
+            return int(cell_index)
+        rank = self._rank[cell_index]
+        if rank < 0:
+            rank = 0 if step > 0 else len(self._order) - 1
+        else:
+            rank = (rank + step) % len(self._order)
+        return int(self._order[rank])
+
+    def _first_unreviewed(self, exclude: int) -> Optional[int]:
+        unreviewed = np.logical_not(self.reviewed[self._order])
+        unreviewed &= self._order != exclude
+        if not np.any(unreviewed):
+            return None
+        return int(self._order[np.argmax(unreviewed)])
@@ -1,19 +1,64 @@
-from typing import Optional, Union
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+import os
+from typing import Dict, List, Optional, Union
 
 import napari
 from napari._qt.qt_error_notification import NapariNotification
 import numpy as np
+from scipy import sparse
 
-from .extensions import CellMask, LinePlot, ThresholdImage
+from .analysis.classifier import CurationClassifier
+from .analysis.duplicates import find_duplicates
+from .analysis.features import FEATURE_NAMES, load_features
+from .analysis.footprints import footprint_centroids
+from .analysis.neighbors import CellNeighborIndex
+from .extensions import (
+    ActivityColors,
+    CellMask,
+    LinePlot,
+    PopulationRaster,
+    TemporalProxyDisplay,
+    ThresholdImage,
+)
+from .images.crops import (
+    load_cell_movie,
+    load_registered_cell_movie,
+    make_cell_movie,
+)
+from .images.proxy import TemporalProxy
+from .io.dataset import CurationDataset
+from .io.utils.cache import sidecar_path
+from .memory import format_nbytes, get_memory_budget
 from .qt.mode_controls import ModeControls
+from .qt.workers import LatestOnlyWorker, MainThreadDispatcher
+from .traces.dff import TRACE_MODES, TraceTransformer
+from .traces.store import NORMALIZATIONS
+from .traces.extraction import TraceExtractor, footprints_from_contours
+
+
+# the dataset fields loaded by CalciumCurator.attach_dataset()
+DISPLAYED_FIELDS = (
+    'data_range',
+    'summary_images',
+    'snr',
+    'snr_mask',
+    'cell_masks',
+    'initial_state',
+    'traces',
+    'spikes',
+    'neuropil',
+    'frame_rate',
+    'temporal_proxy',
+)
 
 
 class CalciumCurator:
     def __init__(
         self,
         img: np.ndarray,
-        data_range,
-        cell_masks: np.ndarray,
+        data_range=None,
+        cell_masks: Optional[list] = None,
         mip: Optional[np.ndarray] = None,
         initial_cell_masks_state: Union[str, np.ndarray] = 'good',
         f: Optional[np.ndarray] = None,
@@ -22,7 +67,28 @@ class CalciumCurator:
         snr_mask: Optional[np.ndarray] = None,
         cells: Optional[np.ndarray] = None,
         output: str = "iscell_curated.npy",
+        summary_images: Optional[Dict[str, np.ndarray]] = None,
+        f_neu: Optional[np.ndarray] = None,
+        trace_mode: str = 'raw',
+        cell_movie_margin: int = 10,
+        footprints: Optional[sparse.spmatrix] = None,
+        neighbor_radius: float = 20,
+        mask_display: str = 'labels',
+        mask_outlines: bool = True,
+        temporal_proxy: Optional[TemporalProxy] = None,
+        show_raster: bool = True,
+        activity_colors: bool = False,
+        trace_normalization: Optional[str] = None,
+        trace_path: Optional[str] = None,
+        neuropil_path: Optional[str] = None,
+        mask_path: Optional[str] = None,
+        baseline_window: Optional[int] = None,
     ):
+        # the contrast limits are estimated from the first frame
+        # until the data range of the movie is attached
+        if data_range is None:
+            first_frame = np.asarray(img[0])
+            data_range = [first_frame.min(), max(first_frame.max(), 1)]
         self.viewer = napari.view_image(
             img,
             multiscale=False,
@@ -30,63 +96,81 @@ class CalciumCurator:
             visible=True,
             name='movie',
         )
-        if mip is not None:
-            self.mip = self.viewer.add_image(
-                mip, name='MIP', colormap='viridis', visible=False
-            )
-        else:
-            self.mip = None
+        self.mip = None
+        self.summary_layers = {}
+        self.attach_summary_images(summary_images, mip=mip)
+
         # todo: add this to snr extension
-        self.snr = snr
-        self.f = f
+        self.snr = None
+        self.f = None
         self.save_path = output
 
         self.movie = self.viewer.layers['movie']
 
-        # add the SNR widgets
-        if (snr_mask is not None) and (snr is not None):
-            self.snr_extension = ThresholdImage(
-                image=snr_mask,
-                viewer=self.viewer,
-                xlabel='SNR',
-                ylabel='counts',
-                image_layer_name='SNR mask',
-                name='SNR histogram',
-            )
-
-        # # Add the cell labels
-        self.cell_masks = CellMask(
-            viewer=self.viewer,
-            im_shape=img.shape[-2::],
-            cell_masks=cell_masks,
-            initial_state=initial_cell_masks_state,
-        )
+        # the masks, SNR and traces are added by the attach methods,
+        # either here or when their loading stage completes
+        self.snr_extension = None
+        self.cell_masks = None
+        self.mask_display = mask_display
+        self.mask_outlines = mask_outlines
+        self.line_plot = None
+        self.raster = None
+        self.show_raster = show_raster
+        self.trace_transformer = None
+        self._f_neu = f_neu
+        self._initial_trace_mode = trace_mode
+        # if None, the dF/F baseline window is set from the frame rate
+        self.baseline_window = baseline_window
+        self.viewer.bind_key('Shift-D', self._cycle_trace_mode)
 
-        t = np.arange(len(f[0]))
-        if spikes is not None:
-            spike_events = spikes[0] > 50
-        else:
-            spike_events = None
-        self.line_plot = LinePlot(
-            viewer=self.viewer,
-            x=t,
-            y=f,
-            xlabel="time",
-            ylabel="fluorescence",
-            event_indices=spike_events,
-        )
+        # the normalized traces are persisted next to the trace file
+        self._initial_normalization = trace_normalization
+        self.trace_path = trace_path
+        self.neuropil_path = neuropil_path
+        # the file of the cell masks, the features cache depends on it
+        self.mask_path = mask_path
+        self.viewer.bind_key('Shift-Z', self._cycle_normalization)
 
         def update_line(event=None):
+            if self.line_plot is None:
+                return
+            # the temporal proxy has the shape of the movie, so the
+            # current frame is a movie frame in both display modes
             current_frame = self.viewer.dims.point[0]
             self.line_plot.current_x = current_frame
+            if self.raster is not None:
+                self.raster.current_x = current_frame
 
         self.viewer.dims.events.current_step.connect(update_line)
 
+        # a binned copy of the movie is displayed while scrubbing
+        self.temporal_proxy = None
+        self.viewer.bind_key('Shift-P', self.toggle_temporal_proxy)
+
+        # the cells can be colored by their activity at the current frame
+        self.activity_colors = None
+        self._show_activity = activity_colors
+        self.viewer.bind_key('Shift-A', self.toggle_activity_colors)
+        if temporal_proxy is not None:
+            self.attach_temporal_proxy(temporal_proxy)
+
         def select_on_click(viewer, event):
             selected_layers = viewer.layers.selected
             if len(selected_layers) == 1:
 
-                if isinstance(selected_layers[0], napari.layers.Labels):
+                if (
+                    self.cell_masks is not None
+                    and selected_layers[0] in self.cell_masks.mask_layers
+                    and self.cell_masks.contour_vectors is None
+                ):
+                    # the masks may be drawn as outlines, so the cell is
+                    # looked up in the filled masks
+                    selected_index = self.cell_masks.cell_at(
+                        selected_layers[0].coordinates, selected_layers[0]
+                    )
+                    if selected_index is not None:
+                        self.selected_cell = [selected_index]
+                elif isinstance(selected_layers[0], napari.layers.Labels):
                     selected_index = selected_layers[0]._value
 
                     if selected_index is not None:
@@ -94,28 +178,87 @@ class CalciumCurator:
                         self.selected_cell = np.array(
                             selected_index, dtype=np.int
                         )
-                elif (snr_mask is not None) and (snr is not None):
-                    if selected_layers[0] is self.snr_extension.image_layer:
-                        visual = viewer.window.qt_viewer.layer_to_visual[
-                            self.cell_masks.accepted_labels
-                        ]
-                        pos = list(event.pos)
-                        self.cell_masks.accepted_labels.position = visual._transform_position(
-                            pos
+                elif (
+                    self.cell_masks is not None
+                    and self.cell_masks.contour_vectors is not None
+                    and (
+                        selected_layers[0] is self.cell_masks.mask_layers[0]
+                        or (
+                            self.snr_extension is not None
+                            and selected_layers[0]
+                            is self.snr_extension.image_layer
                         )
-                        selected_index = (
-                            self.cell_masks.accepted_labels._get_value()
+                    )
+                ):
+                    # the vectors are picked by their nearest contour vertex
+                    selected_index = self.cell_masks.contour_vectors.cell_at(
+                        selected_layers[0].coordinates
+                    )
+                    if selected_index is not None:
+                        self.selected_cell = [selected_index]
+                elif (self.snr_extension is not None) and (
+                    self.cell_masks is not None
+                ):
+                    if selected_layers[0] is self.snr_extension.image_layer:
+                        selected_index = self.cell_masks.cell_at(
+                            selected_layers[0].coordinates,
+                            self.cell_masks.accepted_labels,
                         )
-
                         if selected_index is not None:
-                            self.selected_cell = [selected_index - 1]
+                            self.selected_cell = [selected_index]
             yield
 
         self.viewer.mouse_drag_callbacks.append(select_on_click)
 
-        self.mode_controls = ModeControls(
-            n_cells=len(self.cell_masks.masks.contours)
-        )
+        # the cell movie shows the selected cell's bounding box over time
+        self.cell_movie_margin = cell_movie_margin
+        self.cell_movie_layer = None
+        self._cell_movie_worker = None
+        self.viewer.bind_key('c', self.show_cell_movie)
+
+        # the traces can be re-extracted from the displayed movie
+        # to compare them with the pipeline traces
+        self._footprints = footprints
+        self._mask_footprints = None
+        self._trace_extractor = None
+        self._extraction_worker = None
+        self.extracted_traces = None
+        self.viewer.bind_key('Shift-E', self.overlay_extracted_traces)
+        self.viewer.bind_key('Shift-X', self.extract_all_traces)
+
+        # step through the likely duplicate cells, which are found in the
+        # background the first time
+        self._duplicates = None
+        self._duplicates_future = None
+        self._duplicate_index = -1
+        self.viewer.bind_key('u', self.select_next_duplicate)
+
+        # navigate between neighboring cells and through the SNR order
+        self.neighbor_radius = neighbor_radius
+        self._neighbor_index = None
+        self._navigation_history = []
+        self.viewer.bind_key('n', self.select_nearest_unreviewed)
+        self.viewer.bind_key('b', self.select_previous_visited)
+        self.viewer.bind_key('Shift-N', self.select_neighbors)
+        self.viewer.bind_key('k', self.select_next_ordered)
+        self.viewer.bind_key('j', self.select_previous_ordered)
+
+        # rank, sort and filter the cells by their features
+        self._features = None
+        self._features_future = None
+        self._on_features_ready = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self.classifier = None
+        self.classifier_probability = None
+        self.order_key = 'snr'
+        self._cell_filter = None
+        self.viewer.bind_key('Shift-F', self._cycle_order_key)
+        self.viewer.bind_key('Shift-C', self.train_classifier)
+
+        # report the memory used by the caches
+        self.viewer.bind_key('Shift-M', self.show_memory_usage)
+
+        self.mode_controls = ModeControls(n_cells=0)
         self.mode_controls.manual_curation_controls.manual_mode_button.clicked.connect(
             self._on_manual_mode_clicked
         )
@@ -133,30 +276,318 @@ class CalciumCurator:
             self.mode_controls, name='mode', area='right'
         )
 
-        self._dataset_loaded = True
+        self._mode = 'all'
+        self.dataset = None
+        self._dispatcher = None
+        self._stage_futures = {}
+        self._stage_results = {}
 
-        self.mode = 'all'
-        self.selected_cell = [0]
+        if (snr_mask is not None) and (snr is not None):
+            self.attach_snr(snr, snr_mask)
+        if cell_masks is not None:
+            self.attach_cell_masks(cell_masks, initial_cell_masks_state)
+        if f is not None:
+            self.attach_traces(f, spikes=spikes)
         self.viewer.show()
 
+    def attach_summary_images(
+        self,
+        summary_images: Optional[Dict[str, np.ndarray]],
+        mip: Optional[np.ndarray] = None,
+    ):
+        """Add the summary images as hidden image layers
+
+        The max projection of the summary images is used as the MIP
+        unless one is provided.
+        """
+        if mip is None and summary_images is not None:
+            mip = summary_images['max']
+        if mip is not None and self.mip is None:
+            self.mip = self.viewer.add_image(
+                mip, name='MIP', colormap='viridis', visible=False
+            )
+        if summary_images is not None:
+            for image_name in ['mean', 'std', 'correlation']:
+                self.summary_layers[image_name] = self.viewer.add_image(
+                    summary_images[image_name],
+                    name=image_name,
+                    colormap='viridis',
+                    visible=False,
+                )
+
+    def attach_temporal_proxy(self, proxy: TemporalProxy):
+        """Display a temporally binned proxy of the movie while scrubbing
+
+        Parameters
+        ----------
+        proxy : TemporalProxy
+            The proxy of the movie
+            (see calciumcurator.images.proxy.load_temporal_proxy()).
+        """
+        if self.temporal_proxy is not None:
+            self.temporal_proxy.disconnect()
+        self.temporal_proxy = TemporalProxyDisplay(
+            self.viewer, self.movie, proxy
+        )
+
+    def toggle_temporal_proxy(self, viewer=None):
+        if self.temporal_proxy is not None:
+            self.temporal_proxy.toggle()
+
+    @property
+    def movie_data(self):
+        """The full-rate movie, also while the temporal proxy is displayed"""
+        if self.temporal_proxy is not None:
+            return self.temporal_proxy.movie
+        return self.movie.data
+
+    def attach_snr(self, snr: np.ndarray, snr_mask: np.ndarray):
+        """Add the SNR mask layer and histogram widget"""
+        self.snr = snr
+        self.snr_extension = ThresholdImage(
+            image=snr_mask,
+            viewer=self.viewer,
+            xlabel='SNR',
+            ylabel='counts',
+            image_layer_name='SNR mask',
+            name='SNR histogram',
+        )
+        if self.cell_masks is not None:
+            self.mode = self.mode
+
+    def attach_cell_masks(
+        self, cell_masks: list, initial_state: Union[str, np.ndarray] = 'good',
+    ):
+        """Add the accepted and rejected cell mask layers"""
+        self.cell_masks = CellMask(
+            viewer=self.viewer,
+            im_shape=self.movie_data.shape[1:],
+            cell_masks=cell_masks,
+            initial_state=initial_state,
+            display=self.mask_display,
+            outlines=self.mask_outlines,
+        )
+        self.mode_controls.manual_curation_controls.selected_cell_spinbox.setMaximum(
+            max(len(cell_masks) - 1, 0)
+        )
+
+        self.mode = self.mode
+        self.selected_cell = [0]
+        self._update_activity_colors()
+
+    def attach_traces(
+        self,
+        f: np.ndarray,
+        spikes: Optional[np.ndarray] = None,
+        f_neu: Optional[np.ndarray] = None,
+        frame_rate: Optional[float] = None,
+    ):
+        """Add the trace plot of the selected cells"""
+        if f_neu is None:
+            f_neu = self._f_neu
+        self.f = f
+
+        t = np.arange(len(f[0]))
+        if spikes is not None:
+            spike_events = spikes[0] > 50
+        else:
+            spike_events = None
+        self.trace_transformer = TraceTransformer(
+            f,
+            f_neu=f_neu,
+            baseline_window=self.baseline_window,
+            frame_rate=frame_rate,
+            source_path=self.trace_path,
+            neuropil_path=self.neuropil_path,
+        )
+        self.line_plot = LinePlot(
+            viewer=self.viewer,
+            x=t,
+            y=f,
+            xlabel="time",
+            ylabel="fluorescence",
+            event_indices=spike_events,
+            trace_transformer=self.trace_transformer,
+        )
+        self.line_plot.trace_mode = self._initial_trace_mode
+        self.line_plot.normalization = self._initial_normalization
+        if self.show_raster:
+            self.attach_raster(f)
+        self._update_selection()
+        self._update_activity_colors()
+
+    def attach_raster(self, f: np.ndarray):
+        """Add the raster of the traces of all cells"""
+        self.raster = PopulationRaster(
+            viewer=self.viewer,
+            traces=f,
+            sort_values={
+                'SNR': lambda: self.snr,
+                'state': self._accepted_state,
+                'classifier': lambda: self.classifier_probability,
+                **{
+                    name: partial(self._feature_values, name)
+                    for name in FEATURE_NAMES
+                },
+            },
+            current_x=self.viewer.dims.point[0],
+        )
+        self.raster.cell_clicked_callbacks.append(self._on_raster_clicked)
+
+    def toggle_activity_colors(self, viewer=None):
+        """Color the cells by their activity at the current frame"""
+        self._show_activity = not self._show_activity
+        self._update_activity_colors()
+
+    def _update_activity_colors(self):
+        if self.activity_colors is None:
+            if not (self._show_activity and self.dataset_loaded):
+                return
+            self.activity_colors = ActivityColors(
+                self.viewer, self.cell_masks.label_image, self.f
+            )
+        self.activity_colors.enabled = self._show_activity
+
+    def _accepted_state(self) -> Optional[np.ndarray]:
+        if self.cell_masks is None:
+            return None
+        return self.cell_masks.masks.good_contour
+
+    def _on_raster_clicked(self, cell_index: int):
+        self.selected_cell = [cell_index]
+
+    @classmethod
+    def from_dataset(
+        cls, dataset: CurationDataset, **kwargs
+    ) -> 'CalciumCurator':
+        """Open the viewer on a dataset and attach its fields as they load
+
+        The viewer opens as soon as the movie is opened. The other fields
+        are loaded in the background (see attach_dataset()).
+
+        Parameters
+        ----------
+        dataset : CurationDataset
+            The dataset returned by a reader
+            (see calciumcurator.io.readers.open_dataset()).
+        **kwargs
+            The keyword arguments passed to CalciumCurator.
+
+        Returns
+        -------
+        curator : CalciumCurator
+            The curator displaying the dataset.
+        """
+        curator = cls(img=dataset.movie, **kwargs)
+        curator.attach_dataset(dataset)
+
+        return curator
+
+    def attach_dataset(self, dataset: CurationDataset):
+        """Load the displayed fields of a dataset and attach them
+
+        Only the fields that are displayed (and the stages they require)
+        are loaded, concurrently and in the background.
+        """
+        self.dataset = dataset
+        self.attach_stages(dataset.load(DISPLAYED_FIELDS))
+
+    def attach_stages(self, futures: Dict[str, Future]):
+        """Attach the results of loading stages as each one completes
+
+        The stages run in worker threads (see
+        calciumcurator.io.pipeline.run_stages()) and their results are
+        attached on the Qt main thread, so the viewer stays responsive
+        while the rest of the dataset loads.
+
+        Parameters
+        ----------
+        futures : Dict[str, Future]
+            The futures of the loading stages. The 'data_range',
+            'summary_images', 'snr', 'snr_mask', 'cell_masks',
+            'initial_state', 'traces', 'spikes', 'neuropil', 'frame_rate'
+            and 'temporal_proxy' stages are attached and the other stages
+            are ignored.
+        """
+        if self._dispatcher is None:
+            self._dispatcher = MainThreadDispatcher()
+        self._stage_futures.update(futures)
+        for name, future in futures.items():
+            future.add_done_callback(
+                partial(self._dispatcher.call, self._on_stage_done, name)
+            )
+
+    def _on_stage_done(self, name: str, future: Future):
+        error = future.exception()
+        if error is not None:
+            notification = NapariNotification(
+                message=f'loading {name} failed: {error}', severity='error'
+            )
+            notification.show()
+            return
+        self._stage_results[name] = future.result()
+
+        if name == 'data_range':
+            self.movie.contrast_limits = self._stage_results['data_range']
+        elif name == 'summary_images':
+            self.attach_summary_images(self._stage_results['summary_images'])
+        elif name == 'temporal_proxy':
+            self.attach_temporal_proxy(self._stage_results['temporal_proxy'])
+        if self._stages_ready(name, ['snr', 'snr_mask']):
+            self.attach_snr(
+                self._stage_results['snr'], self._stage_results['snr_mask']
+            )
+        if self._stages_ready(name, ['cell_masks', 'initial_state']):
+            self.attach_cell_masks(
+                self._stage_results['cell_masks'],
+                self._stage_results.get('initial_state', 'good'),
+            )
+        if self._stages_ready(
+            name, ['traces', 'spikes', 'neuropil', 'frame_rate']
+        ):
+            self.attach_traces(
+                self._stage_results['traces'],
+                spikes=self._stage_results.get('spikes'),
+                f_neu=self._stage_results.get('neuropil'),
+                frame_rate=self._stage_results.get('frame_rate'),
+            )
+
+    def _stages_ready(self, name: str, stage_names: List[str]) -> bool:
+        # a group of stages is ready when the stage that just completed
+        # was the last of the group's stages that are being loaded
+        loaded_names = [n for n in stage_names if n in self._stage_futures]
+        if name not in loaded_names or stage_names[0] not in loaded_names:
+            return False
+        return all(n in self._stage_results for n in loaded_names)
+
+    @property
+    def dataset_loaded(self) -> bool:
+        return (self.cell_masks is not None) and (self.line_plot is not None)
+
     @property
     def mode(self) -> str:
         return self._mode
 
     @mode.setter
     def mode(self, mode: str):
+        if mode not in ['all', 'focus', 'snr_threshold']:
+            raise ValueError(f'{mode} is not a recognized mode')
+        if self.cell_masks is None:
+            # the layers are set when the cell masks are attached
+            self._mode = mode
+            return
 
         if mode == 'all':
             # set visibility
-            self.cell_masks.accepted_labels.visible = True
-            self.cell_masks.rejected_labels.visible = False
-            self.snr_extension.image_layer.visible = False
+            self.cell_masks.set_visible(accepted=True, rejected=False)
+            if self.snr_extension is not None:
+                self.snr_extension.image_layer.visible = False
             self.movie.visible = True
 
             # select layer
-            self.cell_masks.accepted_labels.selected = True
-            self.cell_masks.rejected_labels.selected = False
-            self.snr_extension.image_layer.selected = False
+            self.cell_masks.select_layer(True)
+            if self.snr_extension is not None:
+                self.snr_extension.image_layer.selected = False
             self.movie.selected = False
 
             # set the mode
@@ -169,15 +600,15 @@ class CalciumCurator:
 
         elif mode == 'focus':
             # set visibility
-            self.cell_masks.accepted_labels.visible = True
-            self.cell_masks.rejected_labels.visible = True
-            self.snr_extension.image_layer.visible = False
+            self.cell_masks.set_visible(accepted=True, rejected=True)
+            if self.snr_extension is not None:
+                self.snr_extension.image_layer.visible = False
             self.movie.visible = True
 
             # select layer
-            self.cell_masks.accepted_labels.selected = True
-            self.cell_masks.rejected_labels.selected = False
-            self.snr_extension.image_layer.selected = False
+            self.cell_masks.select_layer(True)
+            if self.snr_extension is not None:
+                self.snr_extension.image_layer.selected = False
             self.movie.selected = False
 
             # update the cell masks
@@ -193,35 +624,32 @@ class CalciumCurator:
 
         elif mode == 'snr_threshold':
             # set visibility
-            self.cell_masks.accepted_labels.visible = False
-            self.cell_masks.rejected_labels.visible = False
-            self.snr_extension.image_layer.visible = True
+            self.cell_masks.set_visible(accepted=False, rejected=False)
+            if self.snr_extension is not None:
+                self.snr_extension.image_layer.visible = True
             self.movie.visible = True
 
             # select layer
-            self.cell_masks.accepted_labels.selected = False
-            self.cell_masks.rejected_labels.selected = False
-            self.snr_extension.image_layer.selected = True
+            self.cell_masks.select_layer(False)
+            if self.snr_extension is not None:
+                self.snr_extension.image_layer.selected = True
             self.movie.selected = False
 
             # update the UI
             self.mode_controls.snr_mode_button.setChecked(True)
 
-        else:
-            raise ValueError(f'{mode} is not a recognized mode')
-
         self._mode = mode
 
-    @property
-    def dataset_loaded(self) -> bool:
-        return self._dataset_loaded
-
     @property
     def selected_cell(self) -> set:
+        if self.cell_masks is None:
+            return set()
         return self.cell_masks.selected_mask
 
     @selected_cell.setter
     def selected_cell(self, selected_cell: Union[set, list]):
+        if self.cell_masks is None:
+            return
         self.cell_masks.selected_mask = set(selected_cell)
         self._update_selection()
 
@@ -236,7 +664,11 @@ class CalciumCurator:
         )
 
     def _update_selection(self, selected_indices: Optional[np.ndarray] = None):
+        if self.line_plot is None:
+            return
         selected_masks = np.asarray(list(self.cell_masks.selected_mask))
+        if self.raster is not None:
+            self.raster.selected_cells = selected_masks[selected_masks >= 0]
         if len(selected_masks) > 0:
             self.line_plot.displayed_traces = {}
             if np.all(selected_masks >= 0):
@@ -270,6 +702,597 @@ class CalciumCurator:
         current_frame = self.viewer.dims.point[0]
         self.line_plot.current_x = current_frame
 
+    def show_cell_movie(self, viewer=None):
+        """Display the movie cropped to the selected cell's bounding box
+
+        The crop is read into memory in the background. If the dataset
+        registers the movie as it is read, only the crop extended by the
+        registration offsets is read from the raw movie and the shift of
+        each frame is applied to the crop.
+        """
+        selected_cells = list(self.selected_cell)
+        if len(selected_cells) == 0:
+            return
+        bbox = self.cell_masks._calculate_mask_bbox(selected_cells[:1])[0]
+        cell_movie, (row_offset, col_offset) = make_cell_movie(
+            self.movie_data, bbox, margin=self.cell_movie_margin
+        )
+
+        def _load_cell_movie():
+            if self.dataset is None:
+                return load_cell_movie(cell_movie)
+            offsets = self.dataset.get('registration_offsets')
+            if offsets is None:
+                return load_cell_movie(cell_movie)
+            return load_registered_cell_movie(
+                self.dataset.get('raw_movie'),
+                offsets,
+                slice(row_offset, row_offset + cell_movie.shape[-2]),
+                slice(col_offset, col_offset + cell_movie.shape[-1]),
+            )
+
+        # place the crop over the cell in the full frame
+        translate = (0,) * (cell_movie.ndim - 2) + (row_offset, col_offset)
+        if self._cell_movie_worker is None:
+            self._cell_movie_worker = LatestOnlyWorker()
+        self.viewer.status = 'loading the cell movie'
+        self._cell_movie_worker.submit(
+            _load_cell_movie,
+            on_result=partial(self._set_cell_movie, translate=translate),
+        )
+
+    def _set_cell_movie(self, cell_movie: np.ndarray, translate: tuple):
+        if (
+            self.cell_movie_layer is None
+            or self.cell_movie_layer not in self.viewer.layers
+        ):
+            self.cell_movie_layer = self.viewer.add_image(
+                cell_movie,
+                name='cell movie',
+                contrast_limits=self.movie.contrast_limits,
+                translate=translate,
+            )
+        else:
+            self.cell_movie_layer.data = cell_movie
+            self.cell_movie_layer.translate = translate
+        self.viewer.status = 'loaded the cell movie'
+
+    def show_memory_usage(self, viewer=None) -> str:
+        """Show the memory used by each cache in the status bar
+
+        Returns
+        -------
+        report : str
+            The table of the memory used by each cache.
+        """
+        budget = get_memory_budget()
+        usage = ', '.join(
+            f'{name}: {format_nbytes(nbytes)}'
+            for name, nbytes in budget.usage().items()
+            if nbytes > 0
+        )
+        self.viewer.status = (
+            f'memory {format_nbytes(budget.nbytes_used)} of '
+            f'{format_nbytes(budget.nbytes)} ({usage})'
+        )
+
+        return budget.report()
+
+    @property
+    def footprints(self) -> sparse.csr_matrix:
+        """The (n_cells, n_frame_pixels) footprint matrix of the cells
+
+        The footprints are the pixel weights provided by the reader (e.g.,
+        the suite2p lam or the CaImAn spatial components). If the dataset
+        has none, binary footprints are made from the filled cell masks.
+        """
+        if self._footprints is None and self.dataset is not None:
+            self._footprints = self.dataset.get('footprints')
+        if self._footprints is None:
+            self._footprints = self.mask_footprints
+        return self._footprints
+
+    @property
+    def mask_footprints(self) -> sparse.csr_matrix:
+        """The (n_cells, n_frame_pixels) binary footprints of the cells
+
+        These are the whole filled ROIs provided by the reader (including
+        the pixels shared with other ROIs), so they are used to measure the
+        shape and the overlap of the cells. If the dataset has none, they
+        are made from the cell masks.
+        """
+        if self._mask_footprints is None and self.dataset is not None:
+            self._mask_footprints = self.dataset.get('roi_footprints')
+        if self._mask_footprints is None:
+            self._mask_footprints = footprints_from_contours(
+                self.cell_masks.masks.contours,
+                im_shape=self.movie_data.shape[1:],
+            )
+        return self._mask_footprints
+
+    @property
+    def trace_extractor(self) -> TraceExtractor:
+        if self._trace_extractor is None:
+            if self.dataset is None:
+                raw_movie, offsets = None, None
+            else:
+                # the registered movie is cropped from the raw movie
+                raw_movie = self.dataset.get('raw_movie')
+                offsets = self.dataset.get('registration_offsets')
+            self._trace_extractor = TraceExtractor(
+                self.movie_data,
+                self.footprints,
+                raw_movie=raw_movie,
+                offsets=offsets,
+            )
+        return self._trace_extractor
+
+    @property
+    def duplicates(self) -> Optional[np.ndarray]:
+        """The ranked pairs of cells that are likely duplicates
+
+        See calciumcurator.analysis.duplicates.find_duplicates(). The
+        pairs are None until find_cell_duplicates() completes.
+        """
+        return self._duplicates
+
+    def find_cell_duplicates(self) -> Optional[Future]:
+        """Find the likely duplicate cells in the background
+
+        Returns
+        -------
+        future : Optional[concurrent.futures.Future]
+            The future of the ranked pairs, or None if the cell masks are
+            not loaded yet.
+        """
+        if self._duplicates_future is not None:
+            return self._duplicates_future
+        if self.cell_masks is None:
+            return None
+
+        def _find_duplicates():
+            return find_duplicates(
+                self.mask_footprints,
+                im_shape=self.movie_data.shape[1:],
+                traces=self.f,
+            )
+
+        if self._dispatcher is None:
+            self._dispatcher = MainThreadDispatcher()
+        self.viewer.status = 'finding the duplicate cells'
+        self._duplicates_future = self._executor.submit(_find_duplicates)
+        self._duplicates_future.add_done_callback(
+            partial(self._dispatcher.call, self._on_duplicates_found)
+        )
+
+        return self._duplicates_future
+
+    def _on_duplicates_found(self, future: Future):
+        error = future.exception()
+        if error is not None:
+            # allow finding them again
+            self._duplicates_future = None
+            notification = NapariNotification(
+                message=f'finding the duplicate cells failed: {error}',
+                severity='error',
+            )
+            notification.show()
+            return
+        self._duplicates = future.result()
+        self.viewer.status = f'found {len(self._duplicates)} likely duplicates'
+        self.select_next_duplicate()
+
+    def select_next_duplicate(self, viewer=None):
+        """Select the next most likely pair of duplicate cells
+
+        The first time, the duplicates are found in the background and
+        the first pair is selected when they are ready.
+        """
+        if self._duplicates is None:
+            self.find_cell_duplicates()
+            return
+        if len(self._duplicates) == 0:
+            return
+        self._duplicate_index = (self._duplicate_index + 1) % len(
+            self._duplicates
+        )
+        pair = self._duplicates[self._duplicate_index]
+        self.selected_cell = [pair['cell_a'], pair['cell_b']]
+
+    @property
+    def neighbor_index(self) -> CellNeighborIndex:
+        """The spatial index of the cells, ordered by SNR if available"""
+        if self._neighbor_index is None:
+            centroids = footprint_centroids(
+                self.footprints, im_shape=self.movie_data.shape[1:]
+            )
+            self._neighbor_index = CellNeighborIndex(
+                centroids, order_values=self.snr
+            )
+        return self._neighbor_index
+
+    def _current_cell(self) -> Optional[int]:
+        selected_cells = list(self.selected_cell)
+        if len(selected_cells) == 0:
+            return None
+        return int(selected_cells[0])
+
+    def select_nearest_unreviewed(self, viewer=None):
+        """Mark the selected cell as reviewed and select the nearest
+        cell that has not been reviewed
+        """
+        current_cell = self._current_cell()
+        if current_cell is None:
+            return
+        self.neighbor_index.mark_reviewed([current_cell])
+        nearest_cell = self.neighbor_index.nearest_unreviewed(current_cell)
+        if nearest_cell is None:
+            return
+        self._navigation_history.append(current_cell)
+        self.selected_cell = [nearest_cell]
+
+    def select_previous_visited(self, viewer=None):
+        """Go back to the cell selected before the last navigation step"""
+        if len(self._navigation_history) == 0:
+            return
+        self.selected_cell = [self._navigation_history.pop()]
+
+    def select_neighbors(self, viewer=None):
+        """Select the cells within neighbor_radius of the selected cell"""
+        current_cell = self._current_cell()
+        if current_cell is None:
+            return
+        neighbors = self.neighbor_index.within_radius(
+            current_cell, self.neighbor_radius
+        )
+        self.selected_cell = [current_cell] + neighbors.tolist()
+
+    def select_next_ordered(self, viewer=None):
+        """Select the next cell in the current order (see sort_cells())"""
+        self._step_ordered(1)
+
+    def select_previous_ordered(self, viewer=None):
+        """Select the previous cell in the current order"""
+        self._step_ordered(-1)
+
+    def _step_ordered(self, step: int):
+        current_cell = self._current_cell()
+        if current_cell is None:
+            return
+        self._navigation_history.append(current_cell)
+        self.selected_cell = [self.neighbor_index.step(current_cell, step)]
+
+    @property
+    def features(self) -> Optional[np.ndarray]:
+        """The (n_cells,) structured array of the features of the cells
+
+        The features (see calciumcurator.analysis.features) are None until
+        compute_cell_features() completes.
+        """
+        return self._features
+
+    def compute_cell_features(self, viewer=None) -> Optional[Future]:
+        """Compute the features of the cells in the background
+
+        The shape features are measured on the filled cell masks and the
+        trace features on the neuropil corrected and dF/F traces. The
+        features are cached next to the trace file, with the trace
+        parameters in the name of the cache, and are recomputed when the
+        trace, neuropil or mask files change.
+
+        Returns
+        -------
+        future : Optional[concurrent.futures.Future]
+            The future of the features, or None if the cell masks or the
+            traces are not loaded yet.
+        """
+        if self._features_future is not None:
+            return self._features_future
+        if self.trace_transformer is None or self.cell_masks is None:
+            return None
+
+        if self.trace_path is None:
+            cache_path = None
+            source_paths = ()
+        else:
+            suffix = self.trace_transformer.parameter_suffix('dff')
+            cache_path = sidecar_path(self.trace_path, f'features_{suffix}')
+            source_paths = [
+                path
+                for path in (
+                    self.trace_path,
+                    self.neuropil_path,
+                    self.mask_path,
+                )
+                if path is not None
+            ]
+
+        def _load_features():
+            return load_features(
+                self.mask_footprints,
+                im_shape=self.movie_data.shape[1:],
+                read_traces=self.trace_transformer.transform,
+                cache_path=cache_path,
+                source_paths=source_paths,
+            )
+
+        if self._dispatcher is None:
+            self._dispatcher = MainThreadDispatcher()
+        self.viewer.status = 'computing the features of the cells'
+        self._features_future = self._executor.submit(_load_features)
+        self._features_future.add_done_callback(
+            partial(self._dispatcher.call, self._on_features_loaded)
+        )
+
+        return self._features_future
+
+    def _on_features_loaded(self, future: Future):
+        on_features_ready, self._on_features_ready = (
+            self._on_features_ready,
+            None,
+        )
+        error = future.exception()
+        if error is not None:
+            # allow computing them again
+            self._features_future = None
+            notification = NapariNotification(
+                message=f'computing the cell features failed: {error}',
+                severity='error',
+            )
+            notification.show()
+            return
+        self._features = future.result()
+        self.viewer.status = 'computed the features of the cells'
+        if on_features_ready is not None:
+            on_features_ready()
+
+    def _when_features_ready(self, func) -> bool:
+        # run func once the features are computed, replacing the action
+        # requested before. returns False if they cannot be computed.
+        if self.compute_cell_features() is None:
+            return False
+        self._on_features_ready = func
+        return True
+
+    def _feature_values(self, name: str) -> Optional[np.ndarray]:
+        if self._features is None:
+            self.compute_cell_features()
+            return None
+        return self._features[name]
+
+    def _order_values(self, order_key: str) -> Optional[np.ndarray]:
+        if order_key == 'snr':
+            return self.snr
+        elif order_key == 'classifier':
+            return self.classifier_probability
+        elif order_key in FEATURE_NAMES:
+            return self._feature_values(order_key)
+        raise ValueError(f'{order_key} is not a recognized cell order')
+
+    def sort_cells(self, order_key: str, descending: bool = True):
+        """Set the order the cells are stepped through with k and j
+
+        Parameters
+        ----------
+        order_key : str
+            'snr', 'classifier' (the acceptance probability predicted by
+            train_classifier()) or the name of a feature (see
+            calciumcurator.analysis.features.FEATURE_NAMES).
+        descending : bool
+            If True, the cells are ordered from the highest to the lowest
+            value. The default value is True. If the order is a feature
+            that is being computed, the cells are sorted once it is ready.
+        """
+        values = self._order_values(order_key)
+        if values is None and order_key in FEATURE_NAMES:
+            if self._when_features_ready(
+                partial(self.sort_cells, order_key, descending=descending)
+            ):
+                return
+        self.neighbor_index.set_order(
+            values, descending=descending, included=self._cell_filter,
+        )
+        self.order_key = order_key
+        self.viewer.status = f'cells ordered by {order_key}'
+
+    def filter_cells(
+        self,
+        name: str,
+        min_value: Optional[float] = None,
+        max_value: Optional[float] = None,
+    ) -> np.ndarray:
+        """Restrict the ordered navigation to the cells within a range
+
+        Filters on several features are combined. clear_cell_filter()
+        removes them.
+
+        Parameters
+        ----------
+        name : str
+            'snr', 'classifier' or the name of a feature.
+        min_value : Optional[float]
+            The minimum value (inclusive). If None, there is no minimum.
+        max_value : Optional[float]
+            The maximum value (inclusive). If None, there is no maximum.
+
+        Returns
+        -------
+        cell_indices : np.ndarray
+            The indices of the cells passing all the filters.
+        """
+        values = self._order_values(name)
+        if values is None:
+            raise ValueError(f'the {name} of the cells is not available yet')
+        values = np.asarray(values, dtype=float)
+        passing = np.ones(len(values), dtype=bool)
+        if min_value is not None:
+            passing &= values >= min_value
+        if max_value is not None:
+            passing &= values <= max_value
+
+        if self._cell_filter is not None:
+            passing &= self._cell_filter
+        self._cell_filter = passing
+        self.sort_cells(self.order_key)
+
+        return np.flatnonzero(passing)
+
+    def clear_cell_filter(self):
+        self._cell_filter = None
+        self.sort_cells(self.order_key)
+
+    def _cycle_order_key(self, viewer=None):
+        # switch between the SNR, feature and classifier orders
+        order_keys = ('snr',) + FEATURE_NAMES + ('classifier',)
+        index = order_keys.index(self.order_key)
+        for step in range(1, len(order_keys) + 1):
+            order_key = order_keys[(index + step) % len(order_keys)]
+            if self._order_values(order_key) is not None or (
+                order_key in FEATURE_NAMES
+                and self._features_future is not None
+            ):
+                self.sort_cells(order_key)
+                return
+
+    def _curation_labels(self):
+        # the previous curation of this output, updated with the cells
+        # reviewed in this session
+        accepted = np.asarray(self.cell_masks.masks.good_contour, dtype=bool)
+        labeled = np.zeros(len(accepted), dtype=bool)
+        labels = np.zeros(len(accepted), dtype=bool)
+
+        previous_path = self.save_path + '_iscell.npy'
+        if os.path.isfile(previous_path):
+            previous = np.load(previous_path)
+            if len(previous) == len(accepted):
+                labels[:] = previous > 0
+                labeled[:] = True
+
+        reviewed = self.neighbor_index.reviewed
+        labels[reviewed] = accepted[reviewed]
+        labeled |= reviewed
+
+        return labeled, labels
+
+    def train_classifier(self, viewer=None) -> Optional[np.ndarray]:
+        """Rank the cells by a classifier trained on the curated cells
+
+        A logistic regression on the features (see
+        calciumcurator.analysis.classifier.CurationClassifier) is fit to
+        the previous curation saved to the output path and to the cells
+        reviewed in this session, and the cells are ordered by their
+        predicted probability of acceptance. If the features are not
+        computed yet, the classifier is trained once they are.
+
+        Returns
+        -------
+        probability : Optional[np.ndarray]
+            (n_cells,) array of the probability of acceptance, or None if
+            the curated cells are not both accepted and rejected or the
+            features are not computed yet.
+        """
+        if not self.dataset_loaded:
+            return None
+        labeled, labels = self._curation_labels()
+        if len(np.unique(labels[labeled])) < 2:
+            self.viewer.status = (
+                'review accepted and rejected cells to train the classifier'
+            )
+            return None
+
+        features = self.features
+        if features is None:
+            self._when_features_ready(self.train_classifier)
+            return None
+        self.classifier = CurationClassifier().fit(
+            features[labeled], labels[labeled]
+        )
+        self.classifier_probability = self.classifier.predict_proba(features)
+        self.sort_cells('classifier')
+
+        return self.classifier_probability
+
+    def overlay_extracted_traces(self, viewer=None):
+        """Plot the selected cells' traces extracted from the movie
+
+        Until all the traces are extracted (see extract_all_traces()),
+        the selected cells are extracted in the background.
+        """
+        selected_cells = list(self.selected_cell)
+        if len(selected_cells) == 0:
+            return
+        if self.extracted_traces is not None:
+            self.line_plot.overlay_traces(
+                self.extracted_traces[selected_cells]
+            )
+            return
+
+        trace_extractor = self.trace_extractor
+        if self._extraction_worker is None:
+            self._extraction_worker = LatestOnlyWorker()
+        self.viewer.status = 'extracting the traces of the selected cells'
+        self._extraction_worker.submit(
+            trace_extractor.extract,
+            selected_cells,
+            on_result=self._overlay_traces,
+        )
+
+    def _overlay_traces(self, traces: np.ndarray):
+        self.line_plot.overlay_traces(traces)
+        self.viewer.status = 'extracted the traces of the selected cells'
+
+    def extract_all_traces(self, viewer=None) -> Optional[Future]:
+        """Extract the traces of all cells from the movie in the background
+
+        When the extraction completes, the extracted traces are kept in
+        extracted_traces and overlay_extracted_traces() uses them.
+
+        Returns
+        -------
+        future : Optional[concurrent.futures.Future]
+            The future of the (n_cells, n_frames) extracted traces, or None
+            if the cell masks are not loaded yet.
+        """
+        if self.cell_masks is None:
+            return None
+        if self._dispatcher is None:
+            self._dispatcher = MainThreadDispatcher()
+        future = self.trace_extractor.extract_all()
+        if not future.done():
+            self.viewer.status = 'extracting the traces of all cells'
+        future.add_done_callback(
+            partial(self._dispatcher.call, self._on_traces_extracted)
+        )
+
+        return future
+
+    def _on_traces_extracted(self, future: Future):
+        error = future.exception()
+        if error is not None:
+            notification = NapariNotification(
+                message=f'extracting the traces failed: {error}',
+                severity='error',
+            )
+            notification.show()
+            return
+        self.extracted_traces = future.result()
+        self.viewer.status = (
+            f'extracted the traces of {len(self.extracted_traces)} cells'
+        )
+
+    def _cycle_trace_mode(self, viewer=None):
+        # switch between the raw, neuropil corrected and dF/F traces
+        mode_index = TRACE_MODES.index(self.line_plot.trace_mode)
+        new_mode = TRACE_MODES[(mode_index + 1) % len(TRACE_MODES)]
+        self.line_plot.trace_mode = new_mode
+
+    def _cycle_normalization(self, viewer=None):
+        # switch between the traces and their normalized traces
+        normalizations = (None,) + NORMALIZATIONS
+        index = normalizations.index(self.line_plot.normalization)
+        new_normalization = normalizations[(index + 1) % len(normalizations)]
+        self.line_plot.normalization = new_normalization
+
     def _on_manual_mode_clicked(self):
         self.mode = 'all'
 
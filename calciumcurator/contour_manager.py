@@ -1,4 +1,5 @@
-from typing import Union
+import copy
+from typing import Optional, Union
 
 import numpy as np
 
@@ -10,8 +11,10 @@ class ContourManager:
         contours: list = [],
         initial_state: Union[str, np.ndarray] = "good",
         mode: str = 'all',
+        outlines: Optional[list] = None,
     ):
         self._contours = contours
+        self._outlines = outlines
         self._contour_labels = np.arange(1, len(contours) + 1)
         self._im_shape = im_shape
 
@@ -36,6 +39,10 @@ class ContourManager:
     def mode(self, mode: str):
         self._mode = mode
 
+    @property
+    def im_shape(self) -> tuple:
+        return self._im_shape
+
     @property
     def contours(self) -> list:
         return self._contours
@@ -44,6 +51,17 @@ class ContourManager:
     def contours(self, contours: list):
         self._contours = contours
 
+    @property
+    def outlines(self) -> list:
+        """The pixels drawn in the mask images for each contour
+
+        These are the outlines if they were provided, otherwise the
+        contours. The contours are used for everything else.
+        """
+        if self._outlines is None:
+            return self._contours
+        return self._outlines
+
     @property
     def good_contour(self) -> np.ndarray:
         return self._good_contour
@@ -72,11 +90,25 @@ class ContourManager:
     ):
         self._selected_contours = set(selected_contours)
 
+    def copy_state(self) -> 'ContourManager':
+        """Copy the curation state, sharing the contours
+
+        The copy can be used to make the mask images in another thread
+        while the state of this ContourManager keeps changing.
+        """
+        state = copy.copy(self)
+        state._good_contour = np.array(self._good_contour, copy=True)
+        state._selected_contours = set(self._selected_contours)
+
+        return state
+
     def make_accepted_mask(self):
         accepted_contours_image = np.zeros(self._im_shape, dtype=np.uint16)
         if self.mode == 'all':
             labels = self._contour_labels[self.good_contour]
-            accepted_contours = self.accepted_contours
+            accepted_contours = [
+                self.outlines[i] for i in np.flatnonzero(self.good_contour)
+            ]
 
         elif self.mode == 'focus':
             selected_contours = np.array(list(self.selected_contours))
@@ -87,12 +119,11 @@ class ContourManager:
                 return_indices=False,
             )
             labels = self._contour_labels[selected_accepted]
-            accepted_contours = [self.contours[i] for i in selected_accepted]
+            accepted_contours = [self.outlines[i] for i in selected_accepted]
 
         for label, cont in zip(labels, accepted_contours):
             accepted_contours_image[
-                np.round(cont[:, 0]).astype("int"),
-                np.round(cont[:, 1]).astype("int"),
+                tuple(np.round(cont).astype("int").T)
             ] = label
 
         return accepted_contours_image
@@ -100,8 +131,11 @@ class ContourManager:
     def make_rejected_mask(self):
         rejected_contours_image = np.zeros(self._im_shape, dtype=np.uint16)
         if self.mode == 'all':
-            labels = self._contour_labels[np.logical_not(self.good_contour)]
-            rejected_contours = self.rejected_contours
+            rejected = np.logical_not(self.good_contour)
+            labels = self._contour_labels[rejected]
+            rejected_contours = [
+                self.outlines[i] for i in np.flatnonzero(rejected)
+            ]
         elif self.mode == 'focus':
             selected_contours = np.array(list(self.selected_contours))
             rejected_contour_indices = np.argwhere(
@@ -113,12 +147,54 @@ class ContourManager:
                 return_indices=False,
             )
             labels = self._contour_labels[selected_rejected]
-            rejected_contours = [self.contours[i] for i in selected_rejected]
+            rejected_contours = [self.outlines[i] for i in selected_rejected]
 
         for label, cont in zip(labels, rejected_contours):
             rejected_contours_image[
-                np.round(cont[:, 0]).astype("int"),
-                np.round(cont[:, 1]).astype("int"),
+                tuple(np.round(cont).astype("int").T)
             ] = label
 
         return rejected_contours_image
+
+    def update_masks(
+        self,
+        accepted_image: np.ndarray,
+        rejected_image: np.ndarray,
+        contour_indices,
+    ):
+        """Repaint only some contours in the accepted and rejected images
+
+        The images are modified in place, so the cost depends on the size
+        of the repainted contours rather than the number of contours.
+
+        Parameters
+        ----------
+        accepted_image : np.ndarray
+            The image made by make_accepted_mask().
+        rejected_image : np.ndarray
+            The image made by make_rejected_mask().
+        contour_indices
+            The indices of the contours to repaint.
+        """
+        contour_indices = np.asarray(contour_indices, dtype=int)
+        if self.mode == 'focus':
+            visible = np.isin(contour_indices, list(self.selected_contours))
+        else:
+            visible = np.ones(contour_indices.shape, dtype=bool)
+
+        for index, is_visible in zip(contour_indices, visible):
+            # clear the contour from both images, then paint it in the
+            # image of its current state
+            label = self._contour_labels[index]
+            pixels = tuple(np.round(self.outlines[index]).astype("int").T)
+            accepted_image[pixels] = np.where(
+                accepted_image[pixels] == label, 0, accepted_image[pixels]
+            )
+            rejected_image[pixels] = np.where(
+                rejected_image[pixels] == label, 0, rejected_image[pixels]
+            )
+            if is_visible:
+                if self.good_contour[index]:
+                    accepted_image[pixels] = label
+                else:
+                    rejected_image[pixels] = label
@@ -0,0 +1,154 @@
+from collections import deque
+from typing import Optional
+
+import numpy as np
+
+
+class StateDiff:
+    """The cells whose accepted/rejected state flipped in one action
+
+    Since the state of a cell is boolean, the same diff undoes and redoes
+    the action by flipping the cells again. The diff is stored as the
+    indices of the flipped cells, or as a bit-packed XOR of the states
+    when that is smaller (e.g., bulk actions on many cells).
+
+    Parameters
+    ----------
+    changed_indices : np.ndarray
+        The indices of the cells that flipped.
+    n_cells : int
+        The total number of cells.
+    description : str
+        A short description of the action.
+    """
+
+    def __init__(
+        self, changed_indices: np.ndarray, n_cells: int, description: str = ''
+    ):
+        changed_indices = np.unique(np.asarray(changed_indices, dtype=int))
+        self.n_cells = n_cells
+        self.description = description
+        self.n_changed = len(changed_indices)
+
+        index_dtype = np.min_scalar_type(max(n_cells - 1, 0))
+        index_nbytes = self.n_changed * index_dtype.itemsize
+        if index_nbytes <= (n_cells + 7) // 8:
+            self._indices = changed_indices.astype(index_dtype)
+            self._packed = None
+        else:
+            changed = np.zeros((n_cells,), dtype=bool)
+            changed[changed_indices] = True
+            self._indices = None
+            self._packed = np.packbits(changed)
+
+    @property
+    def nbytes(self) -> int:
+        if self._packed is not None:
+            return self._packed.nbytes
+        return self._indices.nbytes
+
+    @property
+    def changed_indices(self) -> np.ndarray:
+        if self._packed is not None:
+            changed = np.unpackbits(self._packed, count=self.n_cells)
+            return np.flatnonzero(changed)
+        return self._indices.astype(int)
+
+    def apply(self, state: np.ndarray) -> np.ndarray:
+        """Flip the changed cells in state (in place)
+
+        Returns
+        -------
+        changed_indices : np.ndarray
+            The indices of the flipped cells.
+        """
+        changed_indices = self.changed_indices
+        state[changed_indices] = np.logical_not(state[changed_indices])
+        return changed_indices
+
+
+class CurationHistory:
+    """Undo/redo stack of the curation state
+
+    Only the diffs between states are stored. The oldest actions are
+    dropped when the diffs take more than max_nbytes.
+
+    Parameters
+    ----------
+    n_cells : int
+        The number of cells.
+    max_nbytes : int
+        The maximum memory used by the stored diffs.
+        The default value is 16 MiB.
+    """
+
+    def __init__(self, n_cells: int, max_nbytes: int = 16 * 1024 ** 2):
+        self.n_cells = n_cells
+        self.max_nbytes = max_nbytes
+        self._undo_stack = deque()
+        self._redo_stack = []
+
+    @property
+    def nbytes(self) -> int:
+        return sum(diff.nbytes for diff in self._undo_stack) + sum(
+            diff.nbytes for diff in self._redo_stack
+        )
+
+    @property
+    def can_undo(self) -> bool:
+        return len(self._undo_stack) > 0
+
+    @property
+    def can_redo(self) -> bool:
+        return len(self._redo_stack) > 0
+
+    def record(self, changed_indices, description: str = ''):
+        """Record an action that flipped the state of some cells
+
+        Recording an action clears the redo stack.
+        """
+        diff = StateDiff(changed_indices, self.n_cells, description)
+        if diff.n_changed == 0:
+            return
+        self._undo_stack.append(diff)
+        self._redo_stack = []
+        self._trim()
+
+    def undo(self, state: np.ndarray) -> Optional[np.ndarray]:
+        """Undo the last action on state (in place)
+
+        Returns
+        -------
+        changed_indices : Optional[np.ndarray]
+            The indices of the cells that changed.
+            None if there was nothing to undo.
+        """
+        if not self.can_undo:
+            return None
+        diff = self._undo_stack.pop()
+        self._redo_stack.append(diff)
+        return diff.apply(state)
+
+    def redo(self, state: np.ndarray) -> Optional[np.ndarray]:
+        """Redo the last undone action on state (in place)
+
+        Returns
+        -------
+        changed_indices : Optional[np.ndarray]
+            The indices of the cells that changed.
+            None if there was nothing to redo.
+        """
+        if not self.can_redo:
+            return None
+        diff = self._redo_stack.pop()
+        self._undo_stack.append(diff)
+        return diff.apply(state)
+
+    def clear(self):
+        self._undo_stack.clear()
+        self._redo_stack = []
+
+    def _trim(self):
+        nbytes = self.nbytes
+        while nbytes > self.max_nbytes and len(self._undo_stack) > 1:
+            nbytes -= self._undo_stack.popleft().nbytes
@@ -1,3 +1,7 @@
+from .activity import ActivityColors
 from .cell_mask import CellMask
+from .contour_vectors import ContourVectors
 from .lineplot import LinePlot
+from .raster import PopulationRaster
+from .temporal_proxy import TemporalProxyDisplay
 from .threshold import ThresholdImage
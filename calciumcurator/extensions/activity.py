@@ -0,0 +1,152 @@
+from typing import List
+
+from napari import Viewer
+from napari.utils.colormaps import Colormap, ensure_colormap
+import numpy as np
+
+from ..qt.workers import LatestOnlyWorker
+from ..traces.activity import ActivityLookup
+
+
+# vispy samples the step colormaps from a lookup texture of 1024 colors,
+# so a layer colors at most 511 cells (plus the background) with at least
+# two texels per cell
+MAX_LAYER_CELLS = 511
+
+
+def split_label_image(
+    label_image: np.ndarray, max_cells: int = MAX_LAYER_CELLS
+) -> List[np.ndarray]:
+    """Split a label image into images of at most max_cells cells
+
+    Parameters
+    ----------
+    label_image : np.ndarray
+        The image where the pixels of cell i are i + 1 and the background
+        is 0 (see calciumcurator.images.masks.make_label_image()).
+    max_cells : int
+        The maximum number of cells in each image. The default value is
+        MAX_LAYER_CELLS.
+
+    Returns
+    -------
+    group_images : List[np.ndarray]
+        The uint16 label images of the cells [0, max_cells),
+        [max_cells, 2 max_cells), ..., where the pixels of the j-th cell of
+        the group are j + 1 and the other pixels are 0.
+    """
+    n_groups = max(-(-int(label_image.max(initial=0)) // max_cells), 1)
+    group_images = []
+    for group in range(n_groups):
+        offset = group * max_cells
+        in_group = (label_image > offset) & (label_image <= offset + max_cells)
+        group_image = np.zeros(label_image.shape, dtype=np.uint16)
+        group_image[in_group] = label_image[in_group] - offset
+        group_images.append(group_image)
+
+    return group_images
+
+
+class ActivityColors:
+    """Extension to color the cells by their activity at the current frame
+
+    The cells are drawn once in images of their labels, which are displayed
+    with a colormap that has one color per label. At each frame, the
+    normalized trace value of every cell is looked up (an O(n_cells)
+    read, see calciumcurator.traces.activity.ActivityLookup) in a worker
+    thread and only the colormaps of the layers are replaced, so the cost
+    of a frame does not depend on the size of the image. The cells are
+    split among layers of at most MAX_LAYER_CELLS cells.
+
+    Parameters
+    ----------
+    viewer : napari.Viewer
+        The viewer to add the image layers to.
+    label_image : np.ndarray
+        The image where the pixels of cell i are i + 1 and the background
+        is 0 (see calciumcurator.images.masks.make_label_image()).
+    traces : array-like
+        The (n_cells, n_frames) traces.
+    colormap : str
+        The colormap of the activity. The default value is 'inferno'.
+    layer_name : str
+        The name of the image layers. The default value is 'activity'.
+    """
+
+    def __init__(
+        self,
+        viewer: Viewer,
+        label_image: np.ndarray,
+        traces,
+        colormap: str = 'inferno',
+        layer_name: str = 'activity',
+    ):
+        self.viewer = viewer
+        self.lookup = ActivityLookup(traces)
+        self.colormap = ensure_colormap(colormap)
+
+        # the labels are at the centers of the colormap bins
+        self.image_layers = []
+        for group, group_image in enumerate(split_label_image(label_image)):
+            name = layer_name if group == 0 else f'{layer_name} {group + 1}'
+            # the background is black, which the additive blending leaves
+            # out
+            self.image_layers.append(
+                viewer.add_image(
+                    group_image,
+                    name=name,
+                    colormap=self._make_colormap(name, np.zeros((0, 4))),
+                    contrast_limits=[-0.5, MAX_LAYER_CELLS + 0.5],
+                    blending='additive',
+                    visible=False,
+                )
+            )
+        self._worker = LatestOnlyWorker()
+        self._enabled = False
+
+    @staticmethod
+    def _make_colormap(name: str, cell_colors: np.ndarray) -> Colormap:
+        colors = np.zeros((MAX_LAYER_CELLS + 1, 4), dtype=np.float32)
+        colors[:, 3] = 1
+        colors[1 : len(cell_colors) + 1] = cell_colors
+        return Colormap(colors, interpolation='zero', name=f'{name} colors')
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, enabled: bool):
+        if enabled == self._enabled:
+            return
+        self._enabled = enabled
+        for layer in self.image_layers:
+            layer.visible = enabled
+        if enabled:
+            self.viewer.dims.events.current_step.connect(self.update)
+            self.update()
+        else:
+            self.viewer.dims.events.current_step.disconnect(self.update)
+
+    def update(self, event=None):
+        """Color the cells by their activity at the current frame"""
+        frame = int(self.viewer.dims.point[0])
+        self._worker.submit(
+            self._frame_colormaps, frame, on_result=self._set_colormaps
+        )
+
+    def _frame_colormaps(self, frame: int) -> List[Colormap]:
+        cell_colors = self.colormap.map(self.lookup.values(frame))
+        return [
+            self._make_colormap(
+                layer.name,
+                cell_colors[
+                    group * MAX_LAYER_CELLS : (group + 1) * MAX_LAYER_CELLS
+                ],
+            )
+            for group, layer in enumerate(self.image_layers)
+        ]
+
+    def _set_colormaps(self, colormaps: List[Colormap]):
+        for layer, colormap in zip(self.image_layers, colormaps):
+            layer.colormap = colormap
@@ -1,9 +1,14 @@
-from typing import Union
+from typing import Optional, Sequence, Union
 
 from napari import Viewer
 import numpy as np
 
 from ..contour_manager import ContourManager
+from ..curation_history import CurationHistory
+from ..images.masks import make_label_image
+from ..images.outlines import outline_masks
+from ..qt.workers import LatestOnlyWorker
+from .contour_vectors import ContourVectors
 
 
 class CellMask:
@@ -31,6 +36,17 @@ class CellMask:
         The name of the labels layer containing the accepted cells.
     rejected_layer_name : str
         The name of the labels layer containing the rejected cells.
+    display : str
+        How the masks are displayed: 'labels' for full-frame labels layers
+        or 'vectors' for a single layer of contour outlines.
+        The default value is 'labels'.
+    simplify_tolerance : float
+        The tolerance in pixels of the contour polygon simplification
+        when display is 'vectors'. The default value is 0.5.
+    outlines : bool
+        If True, only the boundary pixels of the masks are drawn in the
+        labels layers. The masks themselves stay filled, so the cells are
+        still picked by clicking inside them. The default value is True.
     """
 
     def __init__(
@@ -43,8 +59,13 @@ class CellMask:
         accepted_layer_name: str = 'accepted_mask',
         rejected_layer_name: str = 'rejected_mask',
         mode: str = 'all',
+        display: str = 'labels',
+        simplify_tolerance: float = 0.5,
+        outlines: bool = True,
     ):
         self.selected_shapes = viewer.add_shapes(name=selection_layer_name)
+        self._mask_worker = LatestOnlyWorker()
+        self._label_image = None
 
         self.initialize_masks(
             viewer=viewer,
@@ -53,10 +74,23 @@ class CellMask:
             initial_state=initial_state,
             accepted_layer_name=accepted_layer_name,
             rejected_layer_name=rejected_layer_name,
+            display=display,
+            simplify_tolerance=simplify_tolerance,
+            outlines=outlines,
         )
 
         viewer.bind_key("t", self.toggle_selected_mask)
 
+        # the labels layers bind their own paint undo, so the curation
+        # undo is also bound on them to take precedence when they are
+        # selected
+        self.history = CurationHistory(n_cells=len(self.masks.contours))
+        for keymap_provider in [viewer] + self.mask_layers:
+            keymap_provider.bind_key('Control-Z', self.undo, overwrite=True)
+            keymap_provider.bind_key(
+                'Control-Shift-Z', self.redo, overwrite=True
+            )
+
         self._mode = mode
 
     def initialize_masks(
@@ -67,11 +101,34 @@ class CellMask:
         initial_state: Union[np.ndarray, str] = 'good',
         accepted_layer_name: str = 'accepted_mask',
         rejected_layer_name: str = 'rejected_mask',
+        display: str = 'labels',
+        simplify_tolerance: float = 0.5,
+        outlines: bool = True,
     ):
+        self._label_image = None
+        if outlines and display == 'labels':
+            drawn_masks = outline_masks(cell_masks, im_shape)
+        else:
+            drawn_masks = None
         self.masks = ContourManager(
-            contours=cell_masks, im_shape=im_shape, initial_state=initial_state
+            contours=cell_masks,
+            im_shape=im_shape,
+            initial_state=initial_state,
+            outlines=drawn_masks,
         )
 
+        if display == 'vectors':
+            # draw the outlines as vectors instead of full-frame labels
+            self.contour_vectors = ContourVectors(
+                viewer, self.masks, tolerance=simplify_tolerance
+            )
+            self.rejected_labels = None
+            self.accepted_labels = None
+            return
+        elif display != 'labels':
+            raise ValueError(f'{display} is not a recognized mask display')
+        self.contour_vectors = None
+
         # put the masks in their respective labels layers
         rejected_mask = self.masks.make_rejected_mask()
         self.rejected_labels = viewer.add_labels(
@@ -82,6 +139,78 @@ class CellMask:
             accepted_mask, name=accepted_layer_name
         )
 
+    @property
+    def mask_layers(self) -> list:
+        """The layers the masks are displayed in"""
+        if self.contour_vectors is not None:
+            return [self.contour_vectors.layer]
+        return [self.accepted_labels, self.rejected_labels]
+
+    def set_visible(self, accepted: bool, rejected: bool):
+        """Show or hide the accepted and rejected masks"""
+        if self.contour_vectors is not None:
+            self.contour_vectors.set_visible(accepted, rejected)
+        else:
+            self.accepted_labels.visible = accepted
+            self.rejected_labels.visible = rejected
+
+    def select_layer(self, selected: bool = True):
+        """Select the layer used to pick masks with the mouse"""
+        if self.contour_vectors is not None:
+            self.contour_vectors.layer.selected = selected
+        else:
+            self.accepted_labels.selected = selected
+            self.rejected_labels.selected = False
+
+    @property
+    def label_image(self) -> np.ndarray:
+        """The image of the filled masks where cell i is labeled i + 1"""
+        if self._label_image is None:
+            self._label_image = make_label_image(
+                self.masks.contours, self.masks.im_shape
+            )
+        return self._label_image
+
+    def cell_at(
+        self, coordinates: Sequence[float], layer=None
+    ) -> Optional[int]:
+        """Get the cell whose filled mask contains a position
+
+        Parameters
+        ----------
+        coordinates : Sequence[float]
+            The position in the data coordinates of the masks (extra
+            leading coordinates, e.g., the frame, are ignored).
+        layer : Optional[napari.layers.Labels]
+            If this is the accepted (rejected) labels layer, only the
+            accepted (rejected) cells can be picked. In focus mode, only
+            the selected cells can be picked.
+
+        Returns
+        -------
+        cell_index : Optional[int]
+            The index of the cell, or None if there is no cell there.
+        """
+        label_image = self.label_image
+        index = np.round(coordinates[-label_image.ndim :]).astype(int)
+        if np.any(index < 0) or np.any(index >= label_image.shape):
+            return None
+        label = int(label_image[tuple(index)])
+        if label == 0:
+            return None
+
+        cell_index = label - 1
+        is_accepted = bool(self.masks.good_contour[cell_index])
+        if layer is not None:
+            if layer is self.accepted_labels and not is_accepted:
+                return None
+            if layer is self.rejected_labels and is_accepted:
+                return None
+        if self.mode == 'focus' and cell_index not in self.selected_mask:
+            return None
+
+        return cell_index
+
     @property
     def selected_mask(self) -> set:
         return self.masks.selected_contours
@@ -113,11 +242,7 @@ class CellMask:
                 edge_color=edge_color,
             )
 
-            rejected_mask = self.masks.make_rejected_mask()
-            self.rejected_labels.data = rejected_mask
-
-            accepted_mask = self.masks.make_accepted_mask()
-            self.accepted_labels.data = accepted_mask
+            self._rebuild_masks()
 
     @property
     def mode(self) -> str:
@@ -131,44 +256,87 @@ class CellMask:
             self.masks.mode = mode
             self._mode = mode
 
-            rejected_mask = self.masks.make_rejected_mask()
-            self.rejected_labels.data = rejected_mask
-
-            accepted_mask = self.masks.make_accepted_mask()
-            self.accepted_labels.data = accepted_mask
+            self._rebuild_masks()
 
-    def toggle_selected_mask(self, viewer):
+    def toggle_selected_mask(self, viewer=None):
         selected_contours = list(self.selected_mask)
         if len(selected_contours) > 0:
             good_contour = self.masks.good_contour
-            new_state = ~good_contour[selected_contours]
-            good_contour[selected_contours] = new_state
+            good_contour[selected_contours] = ~good_contour[selected_contours]
             self.masks.good_contour = good_contour
+            self.history.record(selected_contours, description='toggle')
+
+            self._repaint(selected_contours)
 
-            good_mask_image = self.masks.make_accepted_mask()
-            bad_mask_image = self.masks.make_rejected_mask()
+    def undo(self, viewer=None):
+        """Undo the last change of the mask states"""
+        changed = self.history.undo(self.masks.good_contour)
+        if changed is not None:
+            self._repaint(changed)
 
-            self.accepted_labels.data = good_mask_image
-            self.rejected_labels.data = bad_mask_image
+    def redo(self, viewer=None):
+        """Redo the last undone change of the mask states"""
+        changed = self.history.redo(self.masks.good_contour)
+        if changed is not None:
+            self._repaint(changed)
 
-            # update the colors of the selected shapes
-            new_colors = []
-            for cont in new_state:
-                if cont:
-                    new_colors.append('green')
-                else:
-                    new_colors.append('magenta')
+    def _rebuild_masks(self):
+        if self.contour_vectors is not None:
+            self.contour_vectors.update_colors()
+            return
+
+        # the mask images are made from a copy of the state in the worker
+        # thread and replace the layers' data when they are ready
+        state = self.masks.copy_state()
+        self._mask_worker.submit(
+            lambda: (state.make_accepted_mask(), state.make_rejected_mask()),
+            on_result=self._set_mask_images,
+        )
+
+    def _set_mask_images(self, mask_images):
+        accepted_mask, rejected_mask = mask_images
+        self.accepted_labels.data = accepted_mask
+        self.rejected_labels.data = rejected_mask
+
+    def _repaint(self, mask_indices):
+        if len(mask_indices) == 0:
+            return
+        if self.contour_vectors is not None:
+            # only the colors of the changed contours are updated
+            self.contour_vectors.update_colors(mask_indices)
+        elif self._mask_worker.pending:
+            # the images being rebuilt were made from an older state
+            self._rebuild_masks()
+        else:
+            # only the changed masks are redrawn in the labels images
+            self.masks.update_masks(
+                self.accepted_labels.data,
+                self.rejected_labels.data,
+                mask_indices,
+            )
+            self.accepted_labels.refresh()
+            self.rejected_labels.refresh()
+
+        # update the colors of the selected shapes
+        new_colors = []
+        for cont in self.masks.good_contour[list(self.selected_mask)]:
+            if cont:
+                new_colors.append('green')
+            else:
+                new_colors.append('magenta')
+        if len(new_colors) > 0:
             self.selected_shapes.edge_color = new_colors
 
     def _calculate_mask_bbox(self, mask_indices: list) -> list:
         selection_bbox = []
 
         for mask_index in mask_indices:
+            # the last two columns are the (row, column) coordinates
             contour = self.masks.contours[mask_index]
-            min_r = np.min(contour[:, 0])
-            min_c = np.min(contour[:, 1])
-            max_r = np.max(contour[:, 0])
-            max_c = np.max(contour[:, 1])
+            min_r = np.min(contour[:, -2])
+            min_c = np.min(contour[:, -1])
+            max_r = np.max(contour[:, -2])
+            max_c = np.max(contour[:, -1])
 
             selection_bbox.append(
                 np.array(
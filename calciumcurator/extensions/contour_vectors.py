@@ -0,0 +1,152 @@
+from typing import Optional, Sequence
+
+from napari import Viewer
+from napari.utils.colormaps.standardize_color import transform_color
+import numpy as np
+from scipy.spatial import cKDTree
+
+from ..contour_manager import ContourManager
+from ..images.polygons import contours_to_polygons, polygons_to_segments
+
+
+class ContourVectors:
+    """Extension to display cell contours as a single vectors layer
+
+    The boundary polygon of every cell is drawn as line segments in one
+    vectors layer, colored by the state of the cell. The memory scales
+    with the number of polygon vertices rather than the number of frame
+    pixels, and changing the state of cells only updates the colors of
+    their segments.
+
+    Parameters
+    ----------
+    viewer : napari.Viewer
+        The viewer to add the vectors layer to.
+    masks : ContourManager
+        The contours and their curation state.
+    tolerance : float
+        The tolerance of the polygon simplification in pixels. If 0, the
+        polygons follow the pixel boundary. The default value is 0.5.
+    accepted_color : str
+        The color of the accepted contours. The default value is 'green'.
+    rejected_color : str
+        The color of the rejected contours. The default value is 'magenta'.
+    edge_width : float
+        The width of the contour lines. The default value is 1.
+    layer_name : str
+        The name of the vectors layer.
+    """
+
+    def __init__(
+        self,
+        viewer: Viewer,
+        masks: ContourManager,
+        tolerance: float = 0.5,
+        accepted_color: str = 'green',
+        rejected_color: str = 'magenta',
+        edge_width: float = 1,
+        layer_name: str = 'contours',
+    ):
+        self.masks = masks
+        self.show_accepted = True
+        self.show_rejected = False
+        self._accepted_color = transform_color(accepted_color)[0]
+        self._rejected_color = transform_color(rejected_color)[0]
+
+        polygons = contours_to_polygons(masks.contours, tolerance=tolerance)
+        segments, self._segment_cell_ids = polygons_to_segments(polygons)
+        self._segment_offsets = np.searchsorted(
+            self._segment_cell_ids, np.arange(len(polygons) + 1)
+        )
+
+        # the cells are found from a position by their nearest vertex
+        vertex_cell_ids = np.repeat(
+            np.arange(len(polygons)), [len(polygon) for polygon in polygons]
+        )
+        if len(vertex_cell_ids) > 0:
+            self._vertex_tree = cKDTree(np.concatenate(polygons))
+        else:
+            self._vertex_tree = None
+        self._vertex_cell_ids = vertex_cell_ids
+
+        self.layer = viewer.add_vectors(
+            segments,
+            edge_color=self._segment_colors(self._segment_cell_ids),
+            edge_width=edge_width,
+            length=1,
+            opacity=1,
+            name=layer_name,
+        )
+
+    def _segment_colors(self, segment_cell_ids: np.ndarray) -> np.ndarray:
+        accepted = self.masks.good_contour[segment_cell_ids]
+        colors = np.where(
+            accepted[:, np.newaxis], self._accepted_color, self._rejected_color
+        )
+
+        # hidden contours are transparent
+        visible = np.where(accepted, self.show_accepted, self.show_rejected)
+        if self.masks.mode == 'focus':
+            selected = np.isin(
+                segment_cell_ids, list(self.masks.selected_contours)
+            )
+            visible &= selected
+        colors[:, 3] = visible
+
+        return colors
+
+    def update_colors(self, cell_indices: Optional[Sequence[int]] = None):
+        """Recolor the contours from the current state
+
+        Parameters
+        ----------
+        cell_indices : Optional[Sequence[int]]
+            The cells to recolor. If None, all cells are recolored.
+        """
+        if cell_indices is None:
+            colors = self._segment_colors(self._segment_cell_ids)
+        else:
+            colors = np.array(self.layer.edge_color, copy=True)
+            for cell_index in np.unique(np.asarray(cell_indices, dtype=int)):
+                start = self._segment_offsets[cell_index]
+                stop = self._segment_offsets[cell_index + 1]
+                colors[start:stop] = self._segment_colors(
+                    self._segment_cell_ids[start:stop]
+                )
+        self.layer.edge_color = colors
+
+    def set_visible(self, accepted: bool, rejected: bool):
+        """Show or hide the accepted and rejected contours"""
+        self.show_accepted = accepted
+        self.show_rejected = rejected
+        self.layer.visible = accepted or rejected
+        self.update_colors()
+
+    def cell_at(
+        self, position: Sequence[float], max_distance: float = 10
+    ) -> Optional[int]:
+        """Find the cell with the nearest contour vertex to a position
+
+        Parameters
+        ----------
+        position : Sequence[float]
+            The position in the layer coordinates (the trailing dimensions
+            are used).
+        max_distance : float
+            The maximum distance of the vertex in pixels.
+
+        Returns
+        -------
+        cell_index : Optional[int]
+            The index of the cell, None if there is no contour within
+            max_distance.
+        """
+        if self._vertex_tree is None:
+            return None
+        n_dims = self._vertex_tree.m
+        distance, vertex_index = self._vertex_tree.query(
+            np.asarray(position)[-n_dims:], distance_upper_bound=max_distance
+        )
+        if not np.isfinite(distance):
+            return None
+        return int(self._vertex_cell_ids[vertex_index])
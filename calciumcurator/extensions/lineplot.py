@@ -4,6 +4,7 @@ from napari import Viewer
 import numpy as np
 
 from ..qt.plots import LinePlotWidget
+from ..traces.dff import TraceTransformer
 
 
 class LinePlot:
@@ -25,6 +26,16 @@ class LinePlot:
     displayed_traces : Optional[list]
         The indices of the traces to display.
         Should match the first dimension of y.
+    trace_transformer : Optional[TraceTransformer]
+        The engine used to compute the neuropil corrected and dF/F traces.
+        If None, the traces in y are always displayed as they are.
+    trace_mode : str
+        The traces to display: 'raw', 'neuropil' or 'dff'.
+        The default value is 'raw'.
+    normalization : Optional[str]
+        The normalization of the displayed traces: None, 'zscore' or
+        'minmax'. The normalized traces are read from the stores of the
+        trace_transformer. The default value is None.
 
     xlabel : str
         The label for the horizontal axis of the histogram.
@@ -44,6 +55,9 @@ class LinePlot:
         event_indices: Optional[list] = None,
         current_x: int = 0,
         displayed_traces: Optional[list] = None,
+        trace_transformer: Optional[TraceTransformer] = None,
+        trace_mode: str = 'raw',
+        normalization: Optional[str] = None,
         xlabel: str = '',
         ylabel: str = '',
         name: str = 'traces',
@@ -55,6 +69,9 @@ class LinePlot:
 
         self.x = x
         self.y = y
+        self.trace_transformer = trace_transformer
+        self._trace_mode = trace_mode
+        self._normalization = normalization
 
         # create the plot
         self.plot_widget = LinePlotWidget(
@@ -95,11 +112,72 @@ class LinePlot:
                 x = np.squeeze(self.x[list(displayed_traces)])
             else:
                 x = self.x
-            y = np.squeeze(self.y[list(displayed_traces)])
+            y = np.squeeze(self._get_traces(list(displayed_traces)))
             self.plot_widget.plot(x, y)
             self._displayed_traces = displayed_traces
         else:
+            self._displayed_traces = set()
             self.clear()
 
+    @property
+    def trace_mode(self) -> str:
+        return self._trace_mode
+
+    @trace_mode.setter
+    def trace_mode(self, trace_mode: str):
+        self._trace_mode = trace_mode
+
+        # compute the traces of the remaining cells in the background
+        if trace_mode != 'raw' and self.trace_transformer is not None:
+            self.trace_transformer.compute_all(trace_mode)
+
+        # redraw the displayed traces
+        self.displayed_traces = self.displayed_traces
+
+    @property
+    def normalization(self) -> Optional[str]:
+        return self._normalization
+
+    @normalization.setter
+    def normalization(self, normalization: Optional[str]):
+        self._normalization = normalization
+
+        # normalize the traces of all cells in the background
+        if normalization is not None and self.trace_transformer is not None:
+            self.trace_transformer.normalized_store(
+                self.trace_mode, normalization
+            ).build_async()
+
+        # redraw the displayed traces
+        self.displayed_traces = self.displayed_traces
+
+    def _get_traces(self, trace_indices: list) -> np.ndarray:
+        if (
+            self.normalization is not None
+            and self.trace_transformer is not None
+        ):
+            store = self.trace_transformer.normalized_store(
+                self.trace_mode, self.normalization
+            )
+            return store.get(trace_indices)
+        if self.trace_mode == 'raw' or self.trace_transformer is None:
+            return self.y[trace_indices]
+        return self.trace_transformer.get(trace_indices, mode=self.trace_mode)
+
+    def overlay_traces(self, traces: np.ndarray, color='r'):
+        """Draw traces on top of the displayed traces
+
+        The overlay is removed when the displayed traces change.
+
+        Parameters
+        ----------
+        traces : np.ndarray
+            (n_traces, n_x) array of traces.
+        color
+            The color of the overlaid traces. The default value is 'r'.
+        """
+        for trace in np.atleast_2d(traces):
+            self.plot_widget.add_curve(self.x, trace, color=color)
+
     def clear(self):
         self.plot_widget.clear()
@@ -0,0 +1,173 @@
+from typing import Callable, Dict, Optional
+
+from napari import Viewer
+import numpy as np
+
+from ..qt.raster import RasterWidget
+from ..qt.workers import LatestOnlyWorker
+from ..traces.raster import RasterPyramid
+
+
+class PopulationRaster:
+    """Extension to display the traces of all cells as a cells x time image
+
+    The multi-resolution pyramid of the raster (see
+    calciumcurator.traces.raster.RasterPyramid) is built in a worker
+    thread, and the window of the level matching the zoom is read in
+    another worker thread each time the view changes, so panning and
+    zooming stay interactive with tens of thousands of cells.
+
+    Parameters
+    ----------
+    viewer : napari.Viewer
+        The viewer to add the dock widget to.
+    traces : array-like
+        The (n_cells, n_frames) traces.
+    sort_values : Optional[Dict[str, Callable[[], Optional[np.ndarray]]]]
+        Functions returning the (n_cells,) values the cells can be sorted
+        by, keyed by name. The cells are sorted in decreasing order of the
+        values. The functions are called when the order is selected, and
+        the order is not changed if they return None. The cells can always
+        be sorted by 'index'.
+    current_x : int
+        The current frame for setting the vertical line.
+    name : str
+        The name of the dock widget. The default value is 'raster'.
+    """
+
+    def __init__(
+        self,
+        viewer: Viewer,
+        traces,
+        sort_values: Optional[
+            Dict[str, Callable[[], Optional[np.ndarray]]]
+        ] = None,
+        current_x: int = 0,
+        name: str = 'raster',
+    ):
+        self.traces = traces
+        self.n_cells, self.n_frames = traces.shape
+        self.sort_values = dict(sort_values or {})
+        self.sort_key = 'index'
+        self.order = np.arange(self.n_cells)
+        self._rows = np.arange(self.n_cells)
+        self.pyramid = None
+        self.cell_clicked_callbacks = []
+        self._selected_cells = set()
+
+        self.raster_widget = RasterWidget(
+            sort_keys=['index'] + list(self.sort_values)
+        )
+        self.raster_widget.set_limits(self.n_frames, self.n_cells)
+        self.raster_widget.view_changed_callbacks.append(self.refresh)
+        self.raster_widget.row_clicked_callbacks.append(self._on_row_clicked)
+        self.raster_widget.sort_changed_callbacks.append(self.sort_by)
+        self.current_x = current_x
+
+        # the pyramid is built and sorted in one worker thread and the
+        # displayed windows are read in another
+        self._pyramid_worker = LatestOnlyWorker()
+        self._window_worker = LatestOnlyWorker()
+        self._pyramid_worker.submit(
+            RasterPyramid, traces, on_result=self._on_pyramid_built
+        )
+
+        viewer.window.add_dock_widget(
+            self.raster_widget, name=name, area='bottom'
+        )
+
+    @property
+    def current_x(self) -> int:
+        return self._current_x
+
+    @current_x.setter
+    def current_x(self, current_x):
+        self.raster_widget.update_vline(current_x)
+        self._current_x = current_x
+
+    @property
+    def selected_cells(self) -> set:
+        return self._selected_cells
+
+    @selected_cells.setter
+    def selected_cells(self, selected_cells):
+        self._selected_cells = set(selected_cells)
+        if len(self._selected_cells) == 0:
+            self.raster_widget.highlight_row(None)
+        else:
+            cell = min(self._selected_cells)
+            self.raster_widget.highlight_row(int(self._rows[cell]))
+
+    def sort_by(self, sort_key: str):
+        """Sort the rows of the raster
+
+        Parameters
+        ----------
+        sort_key : str
+            'index' or one of the keys of sort_values.
+        """
+        if sort_key == 'index':
+            order = np.arange(self.n_cells)
+        else:
+            values = self.sort_values[sort_key]()
+            if values is None:
+                return
+            # stable, so ties stay in index order
+            order = np.argsort(-np.asarray(values, dtype=float), kind='stable')
+        self.sort_key = sort_key
+
+        if self.pyramid is None:
+            self._set_order(order)
+        else:
+            self._pyramid_worker.submit(
+                self._sort_pyramid, order, on_result=self._set_order
+            )
+
+    def _sort_pyramid(self, order: np.ndarray) -> np.ndarray:
+        self.pyramid.set_order(order)
+        return order
+
+    def _set_order(self, order: np.ndarray):
+        self.order = order
+        self._rows = np.empty_like(order)
+        self._rows[order] = np.arange(len(order))
+        self.selected_cells = self._selected_cells
+        self.refresh()
+
+    def _on_pyramid_built(self, pyramid: RasterPyramid):
+        self.pyramid = pyramid
+        if not np.array_equal(self.order, pyramid.order):
+            # sorted while the pyramid was being built
+            self.sort_by(self.sort_key)
+        self.refresh()
+
+    def refresh(self):
+        """Draw the window of the raster in view"""
+        if self.pyramid is None:
+            return
+        frame_range, row_range = self.raster_widget.view_region
+        width, height = self.raster_widget.view_size
+        cell_level, time_level = self.pyramid.choose_levels(
+            row_range[1] - row_range[0],
+            frame_range[1] - frame_range[0],
+            height,
+            width,
+        )
+        self._window_worker.submit(
+            self.pyramid.read,
+            cell_level,
+            time_level,
+            row_range,
+            frame_range,
+            on_result=self._set_window,
+        )
+
+    def _set_window(self, window: tuple):
+        image, rect = window
+        self.raster_widget.set_image(image, rect)
+
+    def _on_row_clicked(self, row: int):
+        if 0 <= row < self.n_cells:
+            cell = int(self.order[row])
+            for callback in self.cell_clicked_callbacks:
+                callback(cell)
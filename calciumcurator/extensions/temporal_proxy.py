@@ -0,0 +1,97 @@
+import time
+
+from napari import Viewer
+from napari.layers import Image
+from qtpy.QtCore import QTimer
+
+from ..images.proxy import TemporalProxy
+
+
+class TemporalProxyDisplay:
+    """Extension to display a temporal proxy of the movie while scrubbing
+
+    When the current frame changes faster than fast_step_interval (e.g.,
+    dragging the dims slider or playing the movie), the movie layer shows
+    the binned proxy, which reads one frame per bin. When the frame has
+    not changed for settle_ms, the layer switches back to the full-rate
+    movie. The proxy has the shape of the movie, so the dims slider and
+    the current frame are the same in both modes.
+
+    Parameters
+    ----------
+    viewer : napari.Viewer
+        The viewer displaying the movie.
+    movie_layer : napari.layers.Image
+        The layer of the full-rate movie.
+    proxy : TemporalProxy
+        The proxy of the movie (see calciumcurator.images.proxy).
+    fast_step_interval : float
+        The maximum time between frame changes in seconds for the proxy to
+        be displayed. The default value is 0.15, so playback at the default
+        10 frames per second uses the proxy.
+    settle_ms : int
+        The time in milliseconds the current frame has to stay the same
+        before the full-rate movie is displayed. The default value is 250.
+    """
+
+    def __init__(
+        self,
+        viewer: Viewer,
+        movie_layer: Image,
+        proxy: TemporalProxy,
+        fast_step_interval: float = 0.15,
+        settle_ms: int = 250,
+    ):
+        self.viewer = viewer
+        self.movie_layer = movie_layer
+        self.movie = movie_layer.data
+        self.proxy = proxy
+        self.fast_step_interval = fast_step_interval
+        self.enabled = True
+
+        self._last_step_time = None
+        self._settle_timer = QTimer()
+        self._settle_timer.setSingleShot(True)
+        self._settle_timer.setInterval(settle_ms)
+        self._settle_timer.timeout.connect(self.show_movie)
+
+        self.viewer.dims.events.current_step.connect(self._on_step)
+
+    @property
+    def showing_proxy(self) -> bool:
+        return self.movie_layer.data is self.proxy
+
+    def show_proxy(self):
+        if not self.showing_proxy:
+            self.movie_layer.data = self.proxy
+
+    def show_movie(self):
+        self._settle_timer.stop()
+        if self.showing_proxy:
+            self.movie_layer.data = self.movie
+
+    def toggle(self, viewer=None):
+        """Enable or disable displaying the proxy"""
+        self.enabled = not self.enabled
+        if not self.enabled:
+            self.show_movie()
+
+    def disconnect(self):
+        self.viewer.dims.events.current_step.disconnect(self._on_step)
+        self.show_movie()
+
+    def _on_step(self, event=None):
+        now = time.monotonic()
+        is_fast = (
+            self._last_step_time is not None
+            and now - self._last_step_time < self.fast_step_interval
+        )
+        self._last_step_time = now
+        if not self.enabled:
+            return
+
+        if is_fast:
+            self.show_proxy()
+        if self.showing_proxy:
+            # switch back once the frame stops changing
+            self._settle_timer.start()
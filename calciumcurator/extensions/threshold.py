@@ -2,6 +2,7 @@ from napari import Viewer
 import numpy as np
 
 from ..qt.dock_widgets import HistogramWidget
+from ..qt.workers import LatestOnlyWorker
 
 
 class ThresholdImage:
@@ -47,6 +48,7 @@ class ThresholdImage:
             values, counts, xlabel=xlabel, ylabel=ylabel
         )
         self._threshold = 0
+        self._threshold_worker = LatestOnlyWorker()
 
         # update the SNR image and connect the event
         self.on_snr_changed()
@@ -65,8 +67,13 @@ class ThresholdImage:
     def threshold(self, threshold: float):
         self._threshold = threshold
 
-        # apply the threshold to the image
-        thresholded_image = self._threshold_image(threshold)
+        # the threshold is applied in a worker thread and only the image
+        # of the latest threshold is displayed
+        self._threshold_worker.submit(
+            self._threshold_image, threshold, on_result=self._set_image_data
+        )
+
+    def _set_image_data(self, thresholded_image: np.ndarray):
         self.image_layer.data = thresholded_image
 
     def _threshold_image(self, threshold):
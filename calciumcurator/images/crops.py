@@ -0,0 +1,206 @@
+from typing import Any, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ..io.utils.frames import choose_block_size, map_frame_blocks
+
+
+def bbox_to_slices(
+    bbox: np.ndarray, im_shape: Sequence[int], margin: int = 0
+) -> Tuple[slice, slice]:
+    """Get the row and column slices of a bounding box with a margin
+
+    Parameters
+    ----------
+    bbox : np.ndarray
+        The (n_corners, 2) corners of the bounding box in (row, column)
+        coordinates, e.g., from CellMask._calculate_mask_bbox().
+    im_shape : Sequence[int]
+        The shape of the frames. Only the last two dimensions are used.
+    margin : int
+        The number of pixels added around the bounding box. The slices
+        are clipped to the frame.
+
+    Returns
+    -------
+    row_slice : slice
+        The rows of the crop.
+    col_slice : slice
+        The columns of the crop.
+    """
+    bbox = np.asarray(bbox)
+    n_rows, n_cols = im_shape[-2:]
+    min_r = int(max(np.floor(bbox[:, 0].min()) - margin, 0))
+    min_c = int(max(np.floor(bbox[:, 1].min()) - margin, 0))
+    max_r = int(min(np.ceil(bbox[:, 0].max()) + margin + 1, n_rows))
+    max_c = int(min(np.ceil(bbox[:, 1].max()) + margin + 1, n_cols))
+
+    return slice(min_r, max_r), slice(min_c, max_c)
+
+
+def crop_movie(movie, row_slice: slice, col_slice: slice):
+    """Lazily crop every frame of a movie
+
+    Only the cropped region is read when the crop is indexed. The chunks
+    of dask movies are kept, so streamed blocks stay aligned to the chunks
+    the movie was opened with and to its on-disk HDF5 chunks.
+
+    Parameters
+    ----------
+    movie : array-like
+        The (n_frames, ..., n_rows, n_cols) movie.
+    row_slice : slice
+        The rows of the crop.
+    col_slice : slice
+        The columns of the crop.
+
+    Returns
+    -------
+    cropped_movie : array-like
+        The (n_frames, ..., crop_rows, crop_cols) crop. This is a dask array
+        for dask movies and a view for numpy arrays and memory maps.
+    """
+    return movie[..., row_slice, col_slice]
+
+
+def load_cell_movie(
+    cropped_movie,
+    block_size: Optional[int] = None,
+    n_workers: Optional[int] = None,
+) -> np.ndarray:
+    """Read a cropped movie into memory with parallel, chunk-aligned reads
+
+    Parameters
+    ----------
+    cropped_movie : array-like
+        The cropped movie returned by crop_movie().
+    block_size : Optional[int]
+        The number of frames read per task. If None, the largest multiple
+        of the time chunk size that fits in the default block size is used.
+    n_workers : Optional[int]
+        The number of worker threads. If None, the number of CPUs is used.
+
+    Returns
+    -------
+    cell_movie : np.ndarray
+        The cropped movie.
+    """
+    if block_size is None:
+        block_size = choose_block_size(cropped_movie)
+    cell_movie = np.empty(cropped_movie.shape, dtype=cropped_movie.dtype)
+
+    def _copy_block(frames, start, stop):
+        cell_movie[start:stop] = frames
+
+    for _ in map_frame_blocks(
+        cropped_movie, _copy_block, block_size=block_size, n_workers=n_workers,
+    ):
+        pass
+
+    return cell_movie
+
+
+def load_registered_cell_movie(
+    raw_movie,
+    offsets: np.ndarray,
+    row_slice: slice,
+    col_slice: slice,
+    block_size: Optional[int] = None,
+    n_workers: Optional[int] = None,
+) -> np.ndarray:
+    """Read a crop of the registered movie from the unregistered movie
+
+    Each registered frame is the raw frame rolled by minus its
+    (row, column) offset. Only the crop extended by the offsets is read
+    from the raw movie and each frame's shift is applied to the crop, so
+    the full frames are never read or registered.
+
+    Parameters
+    ----------
+    raw_movie : array-like
+        The (n_frames, ..., n_rows, n_cols) unregistered movie.
+    offsets : np.ndarray
+        The (n_frames, 2) (row, column) registration offset of each frame.
+    row_slice : slice
+        The rows of the crop in the registered frames.
+    col_slice : slice
+        The columns of the crop in the registered frames.
+    block_size : Optional[int]
+        The number of frames read per task. If None, it is chosen with
+        choose_block_size().
+    n_workers : Optional[int]
+        The number of worker threads. If None, the number of CPUs is used.
+
+    Returns
+    -------
+    cell_movie : np.ndarray
+        The (n_frames, ..., crop_rows, crop_cols) crop of the registered
+        movie.
+    """
+    n_rows, n_cols = raw_movie.shape[-2:]
+    offsets = np.asarray(offsets).astype(int)
+
+    # the raw pixels of the crop in each frame, which wrap around the
+    # frame like the registration
+    raw_rows = (
+        np.arange(n_rows)[row_slice][np.newaxis] + offsets[:, [0]]
+    ) % n_rows
+    raw_cols = (
+        np.arange(n_cols)[col_slice][np.newaxis] + offsets[:, [1]]
+    ) % n_cols
+    row_start, col_start = raw_rows.min(), raw_cols.min()
+    raw_crop = crop_movie(
+        raw_movie,
+        slice(row_start, raw_rows.max() + 1),
+        slice(col_start, raw_cols.max() + 1),
+    )
+
+    cell_movie = np.empty(
+        raw_movie.shape[:-2] + raw_rows.shape[1:] + raw_cols.shape[1:],
+        dtype=raw_movie.dtype,
+    )
+
+    def _shift_block(frames, start, stop):
+        for frame_index, frame in enumerate(frames, start):
+            cell_movie[frame_index] = frame[
+                ...,
+                raw_rows[frame_index, :, np.newaxis] - row_start,
+                raw_cols[frame_index] - col_start,
+            ]
+
+    if block_size is None:
+        block_size = choose_block_size(raw_crop)
+    for _ in map_frame_blocks(
+        raw_crop, _shift_block, block_size=block_size, n_workers=n_workers,
+    ):
+        pass
+
+    return cell_movie
+
+
+def make_cell_movie(
+    movie, bbox: np.ndarray, margin: int = 10
+) -> Tuple[Any, Tuple[int, int]]:
+    """Make the lazy movie of a cell's bounding box plus a margin
+
+    Parameters
+    ----------
+    movie : array-like
+        The (n_frames, ..., n_rows, n_cols) movie.
+    bbox : np.ndarray
+        The (n_corners, 2) corners of the cell's bounding box.
+    margin : int
+        The number of pixels added around the bounding box.
+        The default value is 10.
+
+    Returns
+    -------
+    cell_movie : array-like
+        The lazily cropped movie.
+    offset : Tuple[int, int]
+        The (row, column) of the crop's origin in the full frame.
+    """
+    row_slice, col_slice = bbox_to_slices(bbox, movie.shape, margin=margin)
+    cell_movie = crop_movie(movie, row_slice, col_slice)
+
+    return cell_movie, (row_slice.start, col_slice.start)
@@ -4,14 +4,48 @@ import numpy as np
 
 
 def make_scalar_mask(
-    masks, im_shape: Tuple[int, int], values: np.ndarray
+    masks, im_shape: Tuple[int, ...], values: np.ndarray
 ) -> np.ndarray:
     mask_im = np.zeros(im_shape)
 
     for mask, value in zip(masks, values):
-        mask_im[
-            np.round(mask[:, 0]).astype("int"),
-            np.round(mask[:, 1]).astype("int"),
-        ] = value
+        mask_im[tuple(np.round(mask).astype("int").T)] = value
 
     return mask_im
+
+
+def make_label_image(masks, im_shape: Tuple[int, ...]) -> np.ndarray:
+    """Make an image of the masks labeled by cell
+
+    Parameters
+    ----------
+    masks : list
+        The (n_pixels, n_dims) pixel coordinates of each cell.
+    im_shape : Tuple[int, ...]
+        The shape of the image.
+
+    Returns
+    -------
+    label_image : np.ndarray
+        The image where the pixels of cell i are i + 1 and the background
+        is 0. Where masks overlap, the cell with the highest index is
+        labeled.
+    """
+    n_cells = len(masks)
+    dtype = np.min_scalar_type(n_cells)
+    label_image = np.zeros(im_shape, dtype=dtype)
+    if n_cells == 0:
+        return label_image
+
+    coords = [
+        np.round(mask).astype(int).reshape(-1, len(im_shape)) for mask in masks
+    ]
+    labels = np.repeat(
+        np.arange(1, n_cells + 1, dtype=dtype), [len(c) for c in coords]
+    )
+    coords = np.concatenate(coords)
+    in_image = np.all((coords >= 0) & (coords < im_shape), axis=1)
+    # numpy assigns repeated indices in order, so the last cell is kept
+    label_image[tuple(coords[in_image].T)] = labels[in_image]
+
+    return label_image
@@ -0,0 +1,154 @@
+from typing import List, Tuple
+
+import numpy as np
+
+
+# offsets of the 4-connected neighbors of a pixel
+NEIGHBOR_OFFSETS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+
+
+def find_outline_pixels(
+    pixel_indices: np.ndarray, cell_ids: np.ndarray, im_shape: Tuple[int, int]
+) -> np.ndarray:
+    """Find the boundary pixels of every cell mask in a single pass
+
+    A pixel is on the boundary of its cell if any of its 4-connected
+    neighbors is outside of the image or not part of the same cell.
+    Membership is tested for all pixels of all cells at once by searching
+    (cell, pixel) keys in the sorted keys of the packed masks.
+
+    Parameters
+    ----------
+    pixel_indices : np.ndarray
+        The flat index of every pixel of every cell mask.
+    cell_ids : np.ndarray
+        The index of the cell each pixel belongs to.
+    im_shape : Tuple[int, int]
+        The (n_rows, n_cols) shape of the image the masks are in.
+
+    Returns
+    -------
+    is_outline : np.ndarray
+        Boolean array, True for the pixels on the boundary of their cell.
+    """
+    n_rows, n_cols = im_shape
+    n_image_pixels = n_rows * n_cols
+
+    pixel_indices = np.asarray(pixel_indices, dtype=np.int64)
+    cell_ids = np.asarray(cell_ids, dtype=np.int64)
+    is_outline = np.zeros(pixel_indices.shape, dtype=bool)
+    if len(pixel_indices) == 0:
+        return is_outline
+    rows, cols = np.unravel_index(pixel_indices, (n_rows, n_cols))
+
+    keys = cell_ids * n_image_pixels + pixel_indices
+    sorted_keys = np.sort(keys)
+
+    for row_offset, col_offset in NEIGHBOR_OFFSETS:
+        neighbor_rows = rows + row_offset
+        neighbor_cols = cols + col_offset
+        in_image = (
+            (neighbor_rows >= 0)
+            & (neighbor_rows < n_rows)
+            & (neighbor_cols >= 0)
+            & (neighbor_cols < n_cols)
+        )
+        neighbor_keys = (
+            cell_ids * n_image_pixels
+            + np.clip(neighbor_rows, 0, n_rows - 1) * n_cols
+            + np.clip(neighbor_cols, 0, n_cols - 1)
+        )
+        key_positions = np.searchsorted(sorted_keys, neighbor_keys)
+        key_positions = np.minimum(key_positions, len(sorted_keys) - 1)
+        in_cell = sorted_keys[key_positions] == neighbor_keys
+        is_outline |= np.logical_not(in_image & in_cell)
+
+    return is_outline
+
+
+def extract_outlines(
+    pixel_indices: np.ndarray,
+    cell_ids: np.ndarray,
+    n_cells: int,
+    im_shape: Tuple[int, int],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Get the boundary pixels of every cell mask in a single pass
+
+    See find_outline_pixels().
+
+    Parameters
+    ----------
+    pixel_indices : np.ndarray
+        The flat index of every pixel of every cell mask.
+    cell_ids : np.ndarray
+        The index of the cell each pixel belongs to.
+    n_cells : int
+        The total number of cells.
+    im_shape : Tuple[int, int]
+        The (n_rows, n_cols) shape of the image the masks are in.
+
+    Returns
+    -------
+    outline_indices : np.ndarray
+        The flat index of every boundary pixel.
+    outline_cell_ids : np.ndarray
+        The index of the cell each boundary pixel belongs to.
+    outline_offsets : np.ndarray
+        (n_cells + 1,) array with the start of each cell in outline_indices.
+    """
+    pixel_indices = np.asarray(pixel_indices, dtype=np.int64)
+    cell_ids = np.asarray(cell_ids, dtype=np.int64)
+    is_outline = find_outline_pixels(pixel_indices, cell_ids, im_shape)
+
+    outline_indices = pixel_indices[is_outline]
+    outline_cell_ids = cell_ids[is_outline]
+
+    # keep the pixels grouped by cell so each cell is a contiguous slice
+    order = np.argsort(outline_cell_ids, kind='stable')
+    outline_indices = outline_indices[order]
+    outline_cell_ids = outline_cell_ids[order]
+
+    outline_offsets = np.zeros((n_cells + 1,), dtype=np.int64)
+    outline_offsets[1:] = np.cumsum(
+        np.bincount(outline_cell_ids, minlength=n_cells)
+    )
+
+    return outline_indices, outline_cell_ids, outline_offsets
+
+
+def outline_masks(
+    masks: List[np.ndarray], im_shape: Tuple[int, ...]
+) -> List[np.ndarray]:
+    """Get the boundary pixels of masks given as pixel coordinates
+
+    Parameters
+    ----------
+    masks : List[np.ndarray]
+        (n_pixels, n_dims) array of the pixel coordinates of each mask.
+        The last two columns are the (row, column) coordinates and the
+        other columns (e.g., the plane) are constant within a mask.
+    im_shape : Tuple[int, ...]
+        The shape of the image the masks are in.
+
+    Returns
+    -------
+    outlines : List[np.ndarray]
+        The rows of each mask that are on its boundary.
+    """
+    n_pixels = np.array([len(mask) for mask in masks], dtype=int)
+    if n_pixels.sum() == 0:
+        return list(masks)
+    coordinates = np.concatenate(masks)
+    pixels = np.round(coordinates[:, -2:]).astype(np.int64)
+    pixel_indices = np.ravel_multi_index(
+        tuple(pixels.T), im_shape[-2:], mode='clip'
+    )
+    cell_ids = np.repeat(np.arange(len(masks)), n_pixels)
+
+    is_outline = find_outline_pixels(pixel_indices, cell_ids, im_shape[-2:])
+    offsets = np.cumsum(n_pixels)[:-1]
+
+    return [
+        mask[mask_is_outline]
+        for mask, mask_is_outline in zip(masks, np.split(is_outline, offsets))
+    ]
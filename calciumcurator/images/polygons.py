@@ -0,0 +1,109 @@
+from typing import List, Tuple
+
+import numpy as np
+from scipy import ndimage as ndi
+from skimage import measure
+
+
+def contour_to_polygon(
+    contour: np.ndarray, tolerance: float = 0
+) -> np.ndarray:
+    """Get the ordered boundary polygon of a cell contour
+
+    The contour pixels (an outline, a filled mask or a polygon) are drawn
+    in a small image around the cell, the holes are filled and the
+    boundary is traced with skimage.measure.find_contours(), so the
+    vertices are ordered along the boundary.
+
+    Parameters
+    ----------
+    contour : np.ndarray
+        (n_pixels, n_dims) array of pixel coordinates. The last two columns
+        are the (row, column) coordinates and the other columns (e.g., the
+        plane) are constant.
+    tolerance : float
+        The maximum distance of the simplified polygon from the boundary
+        (see skimage.measure.approximate_polygon()). If 0, the polygon is
+        not simplified.
+
+    Returns
+    -------
+    polygon : np.ndarray
+        (n_vertices, n_dims) array of the polygon vertices. The polygon is
+        closed (the first and last vertices are the same).
+    """
+    contour = np.asarray(contour)
+    other_coordinates = contour[:1, :-2]
+    pixels = np.round(contour[:, -2:]).astype(int)
+    if len(pixels) == 0:
+        return np.zeros((0, contour.shape[1]))
+
+    # pad by one pixel so the boundary is closed
+    origin = pixels.min(axis=0) - 1
+    crop_shape = pixels.max(axis=0) - origin + 2
+    mask = np.zeros(crop_shape, dtype=bool)
+    mask[tuple((pixels - origin).T)] = True
+    mask = ndi.binary_fill_holes(mask)
+
+    boundaries = measure.find_contours(mask.astype(np.float32), 0.5)
+    polygon = max(boundaries, key=len) + origin
+    if tolerance > 0:
+        polygon = measure.approximate_polygon(polygon, tolerance)
+
+    if other_coordinates.shape[1] > 0:
+        polygon = np.column_stack(
+            [np.repeat(other_coordinates, len(polygon), axis=0), polygon]
+        )
+
+    return polygon
+
+
+def contours_to_polygons(
+    contours: List[np.ndarray], tolerance: float = 0
+) -> List[np.ndarray]:
+    """Get the ordered boundary polygon of each contour
+
+    See contour_to_polygon().
+    """
+    return [
+        contour_to_polygon(contour, tolerance=tolerance)
+        for contour in contours
+    ]
+
+
+def polygons_to_segments(
+    polygons: List[np.ndarray],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Batch the edges of all polygons as a single array of line segments
+
+    Parameters
+    ----------
+    polygons : List[np.ndarray]
+        The closed (n_vertices, n_dims) polygon of each cell.
+
+    Returns
+    -------
+    segments : np.ndarray
+        (n_segments, 2, n_dims) array of the start point and the
+        projection of each edge, the format of napari vectors layers.
+        The segments are sorted by cell.
+    segment_cell_ids : np.ndarray
+        (n_segments,) array of the index of the cell of each segment.
+    """
+    n_dims = max([polygon.shape[1] for polygon in polygons] + [2])
+    n_segments = np.array(
+        [max(len(polygon) - 1, 0) for polygon in polygons], dtype=int
+    )
+    segment_cell_ids = np.repeat(np.arange(len(polygons)), n_segments)
+    if n_segments.sum() == 0:
+        return np.zeros((0, 2, n_dims)), segment_cell_ids
+
+    starts = np.concatenate(
+        [polygon[:-1] for polygon in polygons if len(polygon) > 1]
+    )
+    ends = np.concatenate(
+        [polygon[1:] for polygon in polygons if len(polygon) > 1]
+    )
+    segments = np.stack([starts, ends - starts], axis=1)
+
+    return segments, segment_cell_ids
@@ -0,0 +1,275 @@
+import os
+from typing import Optional, Sequence
+
+import numpy as np
+
+from ..io.utils.cache import is_cache_valid, sidecar_path
+from ..io.utils.frames import choose_block_size, map_frame_blocks
+
+
+# the default number of frames averaged into each frame of the proxy
+DEFAULT_BIN_SIZE = 10
+
+
+def proxy_dtype(dtype) -> np.dtype:
+    """Get the dtype of the proxy of a movie
+
+    Integer movies keep their dtype, so the proxy is as small as possible
+    and the contrast limits of the movie apply to it. Other movies are
+    binned to float32.
+    """
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.integer):
+        return dtype
+    return np.dtype(np.float32)
+
+
+def _bin_frames(frames: np.ndarray, bin_size: int, dtype) -> np.ndarray:
+    n_full = len(frames) // bin_size
+    bins = np.empty(
+        (-(-len(frames) // bin_size),) + frames.shape[1:], dtype=dtype
+    )
+    full_bins = frames[: n_full * bin_size].reshape(
+        (n_full, bin_size) + frames.shape[1:]
+    )
+    mean = full_bins.mean(axis=1, dtype=np.float32)
+    if n_full < len(bins):
+        # the last bin of the movie may be partial
+        mean = np.concatenate(
+            [
+                mean,
+                frames[n_full * bin_size :].mean(
+                    axis=0, dtype=np.float32, keepdims=True
+                ),
+            ]
+        )
+    if np.issubdtype(dtype, np.integer):
+        np.rint(mean, out=mean)
+    bins[:] = mean
+
+    return bins
+
+
+def compute_temporal_proxy(
+    movie,
+    bin_size: int = DEFAULT_BIN_SIZE,
+    out: Optional[np.ndarray] = None,
+    block_size: Optional[int] = None,
+    n_workers: Optional[int] = None,
+) -> np.ndarray:
+    """Average consecutive frames of a movie in a single streaming pass
+
+    Parameters
+    ----------
+    movie : array-like
+        The (n_frames, ...) movie.
+    bin_size : int
+        The number of frames averaged into each frame of the proxy.
+        The default value is 10.
+    out : Optional[np.ndarray]
+        The (ceil(n_frames / bin_size), ...) array the proxy is written to,
+        e.g., a memory mapped .npy file. If None, it is allocated.
+    block_size : Optional[int]
+        The number of frames per block. It is rounded down to a multiple of
+        bin_size. If None, it is chosen with choose_block_size().
+    n_workers : Optional[int]
+        The number of worker threads. If None, the number of CPUs is used.
+
+    Returns
+    -------
+    proxy_frames : np.ndarray
+        The (ceil(n_frames / bin_size), ...) binned movie.
+    """
+    n_frames = movie.shape[0]
+    n_bins = -(-n_frames // bin_size)
+    dtype = proxy_dtype(movie.dtype)
+    if out is None:
+        out = np.empty((n_bins,) + tuple(movie.shape[1:]), dtype=dtype)
+    if block_size is None:
+        block_size = choose_block_size(movie)
+    # the blocks never split a bin
+    block_size = max(block_size // bin_size, 1) * bin_size
+
+    def _bin_block(frames, start, stop):
+        bin_start = start // bin_size
+        bins = _bin_frames(frames, bin_size, dtype)
+        out[bin_start : bin_start + len(bins)] = bins
+
+    for _ in map_frame_blocks(
+        movie, _bin_block, block_size=block_size, n_workers=n_workers
+    ):
+        pass
+
+    return out
+
+
+class TemporalProxy:
+    """Full-rate view of a temporally binned movie
+
+    The proxy has the shape of the movie and frame t shows the mean of the
+    bin containing t, so it can replace the movie in the viewer without
+    changing the dims slider, the current frame or the frame indices of
+    the traces.
+
+    Parameters
+    ----------
+    frames : array-like
+        The (n_bins, ...) binned movie (see compute_temporal_proxy()).
+    bin_size : int
+        The number of movie frames per bin.
+    n_frames : int
+        The number of frames of the movie.
+    """
+
+    def __init__(self, frames, bin_size: int, n_frames: int):
+        self.frames = frames
+        self.bin_size = bin_size
+        self.n_frames = n_frames
+        self.shape = (n_frames,) + tuple(frames.shape[1:])
+        self.dtype = np.dtype(frames.dtype)
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    def __len__(self) -> int:
+        return self.n_frames
+
+    def __repr__(self) -> str:
+        return (
+            f'TemporalProxy(shape={self.shape}, dtype={self.dtype}, '
+            f'bin_size={self.bin_size})'
+        )
+
+    def bin_index(self, frame_index):
+        """Get the index of the bin containing a movie frame"""
+        return np.asarray(frame_index) // self.bin_size
+
+    def __getitem__(self, key) -> np.ndarray:
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) == 0:
+            key = (slice(None),)
+        frame_key, other_key = key[0], key[1:]
+
+        if isinstance(frame_key, (int, np.integer)):
+            # the viewer reads single frames
+            frame_index = int(frame_key)
+            if frame_index < 0:
+                frame_index += self.n_frames
+            if not 0 <= frame_index < self.n_frames:
+                raise IndexError(
+                    f'index {frame_key} is out of bounds for axis 0 with '
+                    f'size {self.n_frames}'
+                )
+            bin_key = frame_index // self.bin_size
+        else:
+            bin_key = np.arange(self.n_frames)[frame_key] // self.bin_size
+
+        return np.asarray(self.frames[(bin_key,) + other_key])
+
+    def __array__(self, dtype=None) -> np.ndarray:
+        frames = self[:]
+        if dtype is not None:
+            frames = frames.astype(dtype)
+        return frames
+
+
+def temporal_proxy_path(source_path: str, bin_size: int) -> str:
+    """Get the path of the cached proxy of a movie
+
+    For example, the proxy of 'movie.h5' binned by 10 frames is
+    'movie_proxy10.npy'.
+    """
+    return sidecar_path(source_path, f'proxy{bin_size}', ext='.npy')
+
+
+def load_temporal_proxy(
+    movie,
+    bin_size: int = DEFAULT_BIN_SIZE,
+    cache_path: Optional[str] = None,
+    source_paths: Sequence[str] = (),
+    block_size: Optional[int] = None,
+    n_workers: Optional[int] = None,
+) -> TemporalProxy:
+    """Load the temporal proxy of a movie, computing and caching it if needed
+
+    The cached proxy is written directly to a .npy file and memory mapped,
+    so it is not held in memory.
+
+    Parameters
+    ----------
+    movie : array-like
+        The (n_frames, ...) movie.
+    bin_size : int
+        The number of frames averaged into each frame of the proxy.
+        The default value is 10.
+    cache_path : Optional[str]
+        The path to the .npy file the binned movie is cached in
+        (see temporal_proxy_path()). If None, the proxy is not cached.
+    source_paths : Sequence[str]
+        The paths to the files the movie is loaded from. The cache is
+        recomputed if any of them is newer than the cache.
+    block_size : Optional[int]
+        The number of frames per block.
+    n_workers : Optional[int]
+        The number of worker threads.
+
+    Returns
+    -------
+    proxy : TemporalProxy
+        The full-rate view of the binned movie.
+    """
+    n_frames = movie.shape[0]
+    n_bins = -(-n_frames // bin_size)
+    proxy_shape = (n_bins,) + tuple(movie.shape[1:])
+
+    if cache_path is not None and is_cache_valid(cache_path, source_paths):
+        frames = np.load(cache_path, mmap_mode='r')
+        if frames.shape == proxy_shape:
+            return TemporalProxy(frames, bin_size, n_frames)
+
+    if cache_path is None:
+        frames = compute_temporal_proxy(
+            movie, bin_size, block_size=block_size, n_workers=n_workers
+        )
+        return TemporalProxy(frames, bin_size, n_frames)
+
+    partial_path = sidecar_path(cache_path, 'partial', ext='.npy')
+    try:
+        out = np.lib.format.open_memmap(
+            partial_path,
+            mode='w+',
+            dtype=proxy_dtype(movie.dtype),
+            shape=proxy_shape,
+        )
+    except OSError:
+        # the output directory may be read only
+        frames = compute_temporal_proxy(
+            movie, bin_size, block_size=block_size, n_workers=n_workers
+        )
+        return TemporalProxy(frames, bin_size, n_frames)
+
+    try:
+        compute_temporal_proxy(
+            movie,
+            bin_size,
+            out=out,
+            block_size=block_size,
+            n_workers=n_workers,
+        )
+        out.flush()
+        del out
+        os.replace(partial_path, cache_path)
+    except BaseException:
+        if os.path.isfile(partial_path):
+            os.remove(partial_path)
+        raise
+
+    return TemporalProxy(
+        np.load(cache_path, mmap_mode='r'), bin_size, n_frames
+    )
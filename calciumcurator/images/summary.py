@@ -0,0 +1,183 @@
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+from ..io.utils.cache import is_cache_valid
+from ..io.utils.frames import map_frame_blocks, read_frames
+
+
+SUMMARY_IMAGE_NAMES = ('mean', 'max', 'std', 'correlation')
+
+# the (row, column) shifts of the neighbors each pixel is correlated with.
+# together with their opposites these are the 8 neighbors of a pixel.
+NEIGHBOR_SHIFTS = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+
+def _shifted_pair(frames: np.ndarray, shift) -> tuple:
+    """Get the views of frames and their neighbors for a (row, column) shift"""
+    row_shift, col_shift = shift
+    n_rows, n_cols = frames.shape[-2:]
+    rows = slice(0, n_rows - row_shift)
+    neighbor_rows = slice(row_shift, n_rows)
+    if col_shift >= 0:
+        cols = slice(0, n_cols - col_shift)
+        neighbor_cols = slice(col_shift, n_cols)
+    else:
+        cols = slice(-col_shift, n_cols)
+        neighbor_cols = slice(0, n_cols + col_shift)
+
+    return (
+        frames[..., rows, cols],
+        frames[..., neighbor_rows, neighbor_cols],
+        (rows, cols),
+        (neighbor_rows, neighbor_cols),
+    )
+
+
+def _block_moments(frames: np.ndarray, offset: np.ndarray) -> dict:
+    """Compute the moments of a block of frames needed for the summary images"""
+    frames = frames.astype(np.float64) - offset
+    moments = {
+        'n': frames.shape[0],
+        'sum': frames.sum(axis=0),
+        'sum_sq': np.sum(frames ** 2, axis=0),
+        'max': frames.max(axis=0),
+    }
+    for shift in NEIGHBOR_SHIFTS:
+        pixels, neighbors, _, _ = _shifted_pair(frames, shift)
+        moments[shift] = np.sum(pixels * neighbors, axis=0)
+
+    return moments
+
+
+def _merge_moments(total: Optional[dict], moments: dict) -> dict:
+    if total is None:
+        return moments
+    for key, value in moments.items():
+        if key == 'max':
+            np.maximum(total[key], value, out=total[key])
+        else:
+            total[key] = total[key] + value
+    return total
+
+
+def compute_summary_images(
+    movie, block_size: Optional[int] = None, n_workers: Optional[int] = None,
+) -> Dict[str, np.ndarray]:
+    """Compute the mean, max, std and local correlation images of a movie
+
+    All images are computed in a single streaming pass over blocks of
+    frames processed in parallel. Each block contributes the per-pixel sum,
+    sum of squares, max and the sums of products with the neighboring
+    pixels, so the local correlation (the mean correlation of each pixel's
+    trace with its 8 neighbors) does not require a second pass. The mean
+    of the first frames is subtracted from all frames to avoid losing
+    precision.
+
+    Parameters
+    ----------
+    movie : array-like
+        The (n_frames, ..., n_rows, n_cols) movie.
+    block_size : Optional[int]
+        The number of frames per block. If None, the block size is chosen
+        to align with the movie's chunks.
+    n_workers : Optional[int]
+        The number of worker threads. If None, the number of CPUs is used.
+
+    Returns
+    -------
+    summary_images : Dict[str, np.ndarray]
+        The 'mean', 'max', 'std' and 'correlation' images.
+    """
+    n_frames = movie.shape[0]
+    offset = read_frames(movie, 0, min(n_frames, 100)).mean(axis=0)
+
+    total = None
+    for _, _, moments in map_frame_blocks(
+        movie,
+        lambda frames, start, stop: _block_moments(frames, offset),
+        block_size=block_size,
+        n_workers=n_workers,
+    ):
+        total = _merge_moments(total, moments)
+
+    mean = total['sum'] / n_frames
+    variance = np.maximum(total['sum_sq'] / n_frames - mean ** 2, 0)
+    std = np.sqrt(variance)
+
+    correlation_sum = np.zeros(mean.shape)
+    n_neighbors = np.zeros(mean.shape)
+    for shift in NEIGHBOR_SHIFTS:
+        pixel_mean, neighbor_mean, pixels, neighbors = _shifted_pair(
+            mean, shift
+        )
+        pixel_std, neighbor_std, _, _ = _shifted_pair(std, shift)
+        covariance = total[shift] / n_frames - pixel_mean * neighbor_mean
+        denominator = pixel_std * neighbor_std
+        pair_correlation = np.zeros(covariance.shape)
+        np.divide(
+            covariance,
+            denominator,
+            out=pair_correlation,
+            where=denominator > 0,
+        )
+
+        # each pair contributes to the correlation of both of its pixels
+        correlation_sum[(Ellipsis,) + pixels] += pair_correlation
+        correlation_sum[(Ellipsis,) + neighbors] += pair_correlation
+        n_neighbors[(Ellipsis,) + pixels] += 1
+        n_neighbors[(Ellipsis,) + neighbors] += 1
+    correlation = correlation_sum / np.maximum(n_neighbors, 1)
+
+    return {
+        'mean': (mean + offset).astype(np.float32),
+        'max': (total['max'] + offset).astype(np.float32),
+        'std': std.astype(np.float32),
+        'correlation': correlation.astype(np.float32),
+    }
+
+
+def load_summary_images(
+    movie,
+    cache_path: Optional[str] = None,
+    source_paths: Sequence[str] = (),
+    block_size: Optional[int] = None,
+    n_workers: Optional[int] = None,
+) -> Dict[str, np.ndarray]:
+    """Load the summary images of a movie, computing and caching them if needed
+
+    Parameters
+    ----------
+    movie : array-like
+        The (n_frames, ..., n_rows, n_cols) movie.
+    cache_path : Optional[str]
+        The path to the .npz file the summary images are cached in.
+        If None, the images are not cached.
+    source_paths : Sequence[str]
+        The paths to the files the movie is loaded from. The cache is
+        recomputed if any of them is newer than the cache.
+    block_size : Optional[int]
+        The number of frames per block.
+    n_workers : Optional[int]
+        The number of worker threads.
+
+    Returns
+    -------
+    summary_images : Dict[str, np.ndarray]
+        The 'mean', 'max', 'std' and 'correlation' images.
+    """
+    if cache_path is not None and is_cache_valid(cache_path, source_paths):
+        with np.load(cache_path) as cached:
+            return {name: cached[name] for name in SUMMARY_IMAGE_NAMES}
+
+    summary_images = compute_summary_images(
+        movie, block_size=block_size, n_workers=n_workers
+    )
+    if cache_path is not None:
+        try:
+            np.savez(cache_path, **summary_images)
+        except OSError:
+            # the output directory may be read only
+            pass
+
+    return summary_images
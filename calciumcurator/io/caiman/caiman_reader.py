@@ -1,13 +1,19 @@
 import os
+from typing import Dict, Optional
 
-import dask.array as da
-import h5py
 import numpy as np
 from skimage import measure
 
 from ...images.masks import make_scalar_mask
+from ...memory import get_memory_budget
+from ...traces.extraction import binarize_footprints, footprints_from_caiman
+from ..dataset import CurationDataset
+from ..pipeline import Stage, load_stages
 from ..utils.data_range import calc_data_range
-from ._vendored import load_dict_from_hdf5, load_memmap
+from ..utils.hdf5 import close_hdf5_movie, open_hdf5_movie
+from ..utils.tiff import TIFF_EXTENSIONS, open_tiff_movie
+from ._vendored import load_dict_from_hdf5
+from .mmap_movie import open_mmap_movie
 
 
 def make_caiman_cell_masks(img_components: np.ndarray) -> list:
@@ -18,92 +24,206 @@ def make_caiman_cell_masks(img_components: np.ndarray) -> list:
     return cell_masks
 
 
-def load_movie(filename: str, dataset_name: str = 'mov'):
+def load_movie(
+    filename: str, dataset_name: str = 'mov', convert_mmap: bool = True
+):
     """Adapted from caiman
 
-
+    'C' order .mmap movies are converted once, in the background, to a
+    frame-major copy next to the movie, unless convert_mmap is False (see
+    calciumcurator.io.caiman.mmap_movie.open_mmap_movie()).
     """
     file_ext = os.path.splitext(filename)[-1]
 
     if file_ext in ['.hdf5', '.hdf']:
-        image_path = filename
-        f = h5py.File(image_path, "r")
-        im = f[dataset_name]
-        im_shape = im.shape
-        images = da.from_array(im, chunks=(1, im_shape[-2], im_shape[-1]))
+        images = open_hdf5_movie(filename, dataset_name)
     elif file_ext == '.mmap':
-        Yr, dims, T = load_memmap(filename)
-        images = np.reshape(Yr.T, [T] + list(dims), order="C")
+        images = open_mmap_movie(filename, convert=convert_mmap)
+    elif file_ext.lower() in TIFF_EXTENSIONS:
+        images = open_tiff_movie(filename)
     else:
         raise IOError(f'{file_ext} files cannot be read')
 
     return images
 
 
-def caiman_reader(
-    pipeline_params,
-    image_path,
-    snr_path=None,
-    trace_path=None,
-    cell_path=None,
-    spikes_path=None,
-):
-
-    # Load the image
-    im_registered = load_movie(image_path)
-    data_range = calc_data_range(im_registered)
+def _plane_dims(cnm_obj, im_registered) -> tuple:
+    plane_dims = cnm_obj["dims"]
+    if plane_dims is None:
+        plane_dims = im_registered.shape[1::]
+    return tuple(plane_dims)
 
-    # load the pipeline output object
-    cnm_obj = load_dict_from_hdf5(pipeline_params)
 
+def _make_cell_masks(cnm_obj, im_registered) -> list:
     # make the contours
     estimates = cnm_obj["estimates"]
-    plane_dims = cnm_obj["dims"]
-    if plane_dims is None:
-        plane_dims = im_registered.shape[1::]
-    img_components = (
-        estimates["A"]
-        .toarray()
-        .reshape((plane_dims[0], plane_dims[1], -1), order="F")
-        .transpose([2, 0, 1])
-    )
-    img_components = (
-        img_components / img_components.max(axis=(1, 2))[:, None, None]
+    plane_dims = _plane_dims(cnm_obj, im_registered)
+    footprints = estimates["A"].tocsc()
+    n_pixels, n_components = footprints.shape
+
+    # the dense component images are made in blocks that fit the budget
+    budget = get_memory_budget()
+    block_size = n_components
+    while block_size > 1 and not budget.fits_in_memory(
+        block_size * n_pixels * footprints.dtype.itemsize
+    ):
+        block_size = (block_size + 1) // 2
+
+    cell_masks = []
+    for start in range(0, n_components, max(block_size, 1)):
+        img_components = (
+            footprints[:, start : start + block_size]
+            .toarray()
+            .reshape((plane_dims[0], plane_dims[1], -1), order="F")
+            .transpose([2, 0, 1])
+        )
+        img_components = (
+            img_components / img_components.max(axis=(1, 2))[:, None, None]
+        )
+        img_components = img_components * 255
+        cell_masks += make_caiman_cell_masks(img_components.astype(np.uint8))
+
+    return cell_masks
+
+
+def _make_roi_footprints(cnm_obj, im_registered):
+    # the pixels of the spatial components above 40/255 of their maximum,
+    # the level of the contours
+    footprints = footprints_from_caiman(
+        cnm_obj["estimates"]["A"], _plane_dims(cnm_obj, im_registered)
     )
-    img_components = img_components * 255
-    estimates["img_components"] = img_components.astype(np.uint8)
-    cell_masks = make_caiman_cell_masks(estimates["img_components"])
+    return binarize_footprints(footprints, threshold=40 / 255)
+
 
-    good_indices = estimates["idx_components"]
+def _make_initial_state(cnm_obj, cell_masks) -> np.ndarray:
+    good_indices = cnm_obj["estimates"]["idx_components"]
     initial_cell_masks_state = np.zeros((len(cell_masks),), dtype=np.bool)
     initial_cell_masks_state[good_indices] = True
 
-    # calculate the SNR and make the mask
+    return initial_cell_masks_state
+
+
+def _load_snr(cnm_obj) -> np.ndarray:
     # note that we clean the SNR and set inf snr values to the max
     # non-inf value
-    snr = estimates["SNR_comp"]
+    snr = cnm_obj["estimates"]["SNR_comp"]
     max_snr = np.nanmax(snr[snr != np.inf])
     snr[snr == np.inf] = max_snr
+
+    return snr
+
+
+def _load_frame_rate(cnm_obj) -> Optional[float]:
+    # the frame rate is in the CaImAn parameters, if they were saved
+    try:
+        return float(cnm_obj["params"]["data"]["fr"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _make_snr_mask(cell_masks, snr, im_registered) -> np.ndarray:
     im_shape = im_registered.shape
-    snr_mask = make_scalar_mask(
+    return make_scalar_mask(
         cell_masks, im_shape=(im_shape[-2], im_shape[-1]), values=snr
     )
 
-    # get the fluorescence data
-    f_traces = estimates["C"] + estimates["YrA"]
 
-    # caiman doesn't use spikes and is_cell for now
-    is_cell = None
-    spikes = None
+def caiman_stages(
+    pipeline_params,
+    image_path,
+    snr_path=None,
+    trace_path=None,
+    cell_path=None,
+    spikes_path=None,
+) -> Dict[str, Stage]:
+    """Get the loading stages of a CaImAn dataset
+
+    The stages can be run concurrently with
+    calciumcurator.io.pipeline.run_stages(). The parameters are the same
+    as caiman_reader().
+
+    Returns
+    -------
+    stages : Dict[str, Stage]
+        The 'movie', 'data_range', 'cell_masks', 'footprints',
+        'roi_footprints', 'initial_state', 'traces', 'frame_rate', 'spikes',
+        'is_cell', 'snr' and 'snr_mask' stages, and the intermediate stages
+        they require.
+    """
+
+    def _load_traces(cnm_obj):
+        # get the fluorescence data
+        estimates = cnm_obj["estimates"]
+        return estimates["C"] + estimates["YrA"]
+
+    return {
+        "movie": Stage(lambda: load_movie(image_path), close=close_hdf5_movie),
+        "data_range": Stage(calc_data_range, requires=("movie",)),
+        # load the pipeline output object
+        "cnm_obj": Stage(lambda: load_dict_from_hdf5(pipeline_params)),
+        "cell_masks": Stage(_make_cell_masks, requires=("cnm_obj", "movie")),
+        # the traces are extracted with the spatial components
+        "footprints": Stage(
+            lambda cnm_obj, movie: footprints_from_caiman(
+                cnm_obj["estimates"]["A"], _plane_dims(cnm_obj, movie)
+            ),
+            requires=("cnm_obj", "movie"),
+        ),
+        # the filled ROIs measure the shape and the overlap of the cells
+        "roi_footprints": Stage(
+            _make_roi_footprints, requires=("cnm_obj", "movie")
+        ),
+        "initial_state": Stage(
+            _make_initial_state, requires=("cnm_obj", "cell_masks")
+        ),
+        "snr": Stage(_load_snr, requires=("cnm_obj",)),
+        "snr_mask": Stage(
+            _make_snr_mask, requires=("cell_masks", "snr", "movie")
+        ),
+        "traces": Stage(_load_traces, requires=("cnm_obj",)),
+        "frame_rate": Stage(_load_frame_rate, requires=("cnm_obj",)),
+        # caiman doesn't use spikes and is_cell for now
+        "spikes": Stage(lambda: None),
+        "is_cell": Stage(lambda: None),
+    }
+
+
+def caiman_reader(
+    pipeline_params,
+    image_path,
+    snr_path=None,
+    trace_path=None,
+    cell_path=None,
+    spikes_path=None,
+):
+    # the independent stages are loaded concurrently
+    results = load_stages(caiman_stages(pipeline_params, image_path))
 
     return (
-        im_registered,
-        data_range,
-        cell_masks,
-        initial_cell_masks_state,
-        f_traces,
-        snr,
-        snr_mask,
-        spikes,
-        is_cell,
+        results["movie"],
+        results["data_range"],
+        results["cell_masks"],
+        results["initial_state"],
+        results["traces"],
+        results["snr"],
+        results["snr_mask"],
+        results["spikes"],
+        results["is_cell"],
+    )
+
+
+def caiman_dataset(
+    pipeline_params,
+    image_path,
+    snr_path=None,
+    trace_path=None,
+    cell_path=None,
+    spikes_path=None,
+) -> CurationDataset:
+    """Open a CaImAn dataset whose fields are loaded on first access
+
+    The parameters are the same as caiman_reader().
+    """
+    return CurationDataset(
+        caiman_stages(pipeline_params, image_path), name='caiman'
     )
@@ -0,0 +1,217 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import mmap
+import os
+from typing import Optional
+
+import dask.array as da
+import numpy as np
+
+from ..utils.cache import is_cache_valid, sidecar_path
+from ..utils.frames import choose_block_size, map_frame_blocks
+from ._vendored import load_memmap
+
+
+# the target size of the blocks of frames copied at once by the conversion
+CONVERT_BLOCK_BYTES = 128 * 1024 ** 2
+
+
+def is_frame_major(Yr: np.ndarray) -> bool:
+    """Check if the frames of a CaImAn memmap are contiguous
+
+    The memmap is the (n_pixels, n_frames) array returned by load_memmap().
+    CaImAn saves movies either in 'F' order, where each frame is a
+    contiguous run of pixels, or in 'C' order, where each frame is strided
+    across the whole file.
+    """
+    return Yr.flags.f_contiguous or Yr.shape[1] == 1
+
+
+def frame_major_path(filename: str) -> str:
+    """Get the path of the frame-major copy of a CaImAn .mmap movie
+
+    For example, the copy of 'Yr_d1_512_d2_512_d3_1_order_C_frames_3000_.mmap'
+    is 'Yr_d1_512_d2_512_d3_1_order_C_frames_3000__frames.npy'.
+    """
+    return sidecar_path(filename, 'frames', ext='.npy')
+
+
+def _write_frames(
+    frames: np.ndarray,
+    path: str,
+    dims: tuple,
+    block_size: int,
+    n_workers: int,
+):
+    # the memmap is closed when the function returns
+    movie = np.lib.format.open_memmap(
+        path, mode='w+', dtype=frames.dtype, shape=(len(frames),) + dims
+    )
+
+    def _copy_block(block, start, stop):
+        movie[start:stop] = block.reshape((stop - start,) + dims)
+
+    for _ in map_frame_blocks(
+        frames, _copy_block, block_size=block_size, n_workers=n_workers
+    ):
+        pass
+    movie.flush()
+
+
+def convert_to_frame_major(
+    filename: str,
+    output_path: Optional[str] = None,
+    block_size: Optional[int] = None,
+    n_workers: Optional[int] = None,
+) -> str:
+    """Copy a CaImAn .mmap movie to a frame-major .npy file
+
+    Blocks of frames are copied in parallel. Each block reads a contiguous
+    run of every pixel's time series, so the strided C-order file is read
+    with page-sized (or larger) accesses. The copy is written to a
+    temporary file first, so an interrupted conversion does not leave an
+    invalid cache.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the .mmap movie.
+    output_path : Optional[str]
+        The path to the frame-major copy. If None, frame_major_path()
+        is used.
+    block_size : Optional[int]
+        The number of frames copied per task. If None, a multiple of the
+        number of frames per memory page is chosen.
+    n_workers : Optional[int]
+        The number of worker threads. If None, the number of CPUs (at
+        most 4, since the conversion is bound by the disk) is used.
+
+    Returns
+    -------
+    output_path : str
+        The path to the frame-major copy.
+    """
+    if output_path is None:
+        output_path = frame_major_path(filename)
+    if n_workers is None:
+        n_workers = min(os.cpu_count() or 1, 4)
+
+    Yr, dims, n_frames = load_memmap(filename)
+    frames = Yr.T
+    if block_size is None:
+        block_size = choose_block_size(
+            frames, target_nbytes=CONVERT_BLOCK_BYTES, max_frames=n_frames
+        )
+        # each pixel's run of frames spans whole pages
+        page_frames = mmap.PAGESIZE // Yr.dtype.itemsize
+        if block_size >= page_frames:
+            block_size -= block_size % page_frames
+
+    partial_path = sidecar_path(output_path, 'partial', ext='.npy')
+    try:
+        _write_frames(
+            frames,
+            partial_path,
+            tuple(dims),
+            block_size=block_size,
+            n_workers=n_workers,
+        )
+        os.replace(partial_path, output_path)
+    except BaseException:
+        if os.path.isfile(partial_path):
+            os.remove(partial_path)
+        raise
+
+    return output_path
+
+
+class ConvertingMmapMovie:
+    """A 'C' order CaImAn .mmap movie converted in the background
+
+    The frames are read from the strided movie until the frame-major copy
+    (see convert_to_frame_major()) is written, and from the copy after,
+    so the movie can be displayed while it is converted.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the .mmap movie.
+    n_workers : Optional[int]
+        The number of worker threads of the conversion (see
+        convert_to_frame_major()).
+    """
+
+    def __init__(self, filename: str, n_workers: Optional[int] = None):
+        Yr, dims, n_frames = load_memmap(filename)
+        self.filename = filename
+        self.cache_path = frame_major_path(filename)
+        self._frames = np.reshape(Yr.T, [n_frames] + list(dims), order="C")
+        self.shape = tuple(self._frames.shape)
+        self.dtype = self._frames.dtype
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.conversion = executor.submit(
+            convert_to_frame_major,
+            filename,
+            output_path=self.cache_path,
+            n_workers=n_workers,
+        )
+        executor.shutdown(wait=False)
+        self.conversion.add_done_callback(self._on_converted)
+
+    def _on_converted(self, future: Future):
+        # if the conversion failed, the strided movie is still read
+        if future.exception() is None:
+            self._frames = np.load(self.cache_path, mmap_mode='r')
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, key) -> np.ndarray:
+        return np.asarray(self._frames[key])
+
+    def __array__(self, dtype=None) -> np.ndarray:
+        frames = self[:]
+        if dtype is not None:
+            frames = frames.astype(dtype)
+        return frames
+
+
+def open_mmap_movie(filename: str, convert: bool = True):
+    """Open a CaImAn .mmap movie as (n_frames, ...) frames
+
+    Frame-major ('F' order) files are returned as a zero-copy view. For
+    'C' order files, the frame-major copy next to the movie is used. If
+    there is none yet and convert is True, the movie is opened right away
+    and converted in the background (see ConvertingMmapMovie).
+
+    Parameters
+    ----------
+    filename : str
+        The path to the .mmap movie.
+    convert : bool
+        If True, 'C' order movies are converted to a frame-major copy
+        (once) in the background. If False, the frames are read from the
+        strided movie. The default value is True.
+
+    Returns
+    -------
+    movie : Union[np.ndarray, da.Array]
+        The (n_frames, ...) movie, a read-only memmap, or a dask array of
+        single frames while a 'C' order movie is converted.
+    """
+    Yr, dims, n_frames = load_memmap(filename)
+    if is_frame_major(Yr):
+        return np.reshape(Yr.T, [n_frames] + list(dims), order="C")
+
+    cache_path = frame_major_path(filename)
+    if is_cache_valid(cache_path, [filename]):
+        return np.load(cache_path, mmap_mode='r')
+    elif convert:
+        movie = ConvertingMmapMovie(filename)
+        return da.from_array(movie, chunks=(1,) + movie.shape[1:])
+
+    return np.reshape(Yr.T, [n_frames] + list(dims), order="C")
@@ -0,0 +1,279 @@
+from concurrent.futures import Future
+from functools import partial
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from .pipeline import Stage, _check_stages, run_stages
+
+
+# the fields readers provide. Readers may omit the optional fields
+# (raw_movie, registration_offsets, footprints, roi_footprints, neuropil,
+# frame_rate, snr, snr_mask, spikes and is_cell), which are then None. Readers
+# that register the movie as it is read provide the unregistered movie and the
+# (n_frames, 2) (row, column) offsets that are rolled out of each raw frame.
+# The roi_footprints are binary footprints of the whole filled ROIs,
+# including the pixels shared with other ROIs.
+DATASET_FIELDS = (
+    'movie',
+    'raw_movie',
+    'registration_offsets',
+    'data_range',
+    'cell_masks',
+    'footprints',
+    'roi_footprints',
+    'initial_state',
+    'traces',
+    'neuropil',
+    'frame_rate',
+    'spikes',
+    'snr',
+    'snr_mask',
+    'is_cell',
+)
+
+
+class CurationDataset:
+    """A curation dataset whose fields are loaded on first access
+
+    Each field is computed by a loading stage (see
+    calciumcurator.io.pipeline.Stage) the first time it is accessed,
+    together with the stages it requires, and the result is kept. Fields
+    that are never accessed are never loaded. load() loads many fields
+    concurrently in the background.
+
+    Parameters
+    ----------
+    stages : Dict[str, Stage]
+        The stages that load the fields, keyed by field name. Intermediate
+        stages (e.g., a parsed results file used by several fields) may
+        be included.
+    name : str
+        A description of the dataset (e.g., the reader name).
+    """
+
+    def __init__(self, stages: Dict[str, Stage], name: str = ''):
+        _check_stages(stages)
+        self.stages = dict(stages)
+        self.name = name
+
+        self._results = {}
+        self._futures = {}
+        self._locks = {stage_name: threading.Lock() for stage_name in stages}
+
+    def __repr__(self) -> str:
+        return (
+            f'CurationDataset({self.name!r}, '
+            f'loaded={sorted(self._results)})'
+        )
+
+    @property
+    def fields(self) -> List[str]:
+        """The names of all the stages of the dataset"""
+        return list(self.stages)
+
+    @property
+    def loaded_fields(self) -> List[str]:
+        """The names of the stages that are loaded"""
+        return list(self._results)
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._results
+
+    def add_stage(self, name: str, stage: Stage):
+        """Add a stage, e.g., a derived image computed from the movie"""
+        stages = dict(self.stages)
+        stages[name] = stage
+        _check_stages(stages)
+        self.stages = stages
+        self._locks[name] = threading.Lock()
+
+    def get(self, name: str) -> Any:
+        """Get a field, loading it (and the stages it requires) if needed
+
+        Parameters
+        ----------
+        name : str
+            The name of the field.
+
+        Returns
+        -------
+        value : Any
+            The value of the field. The optional fields that the reader
+            does not provide are None.
+        """
+        if name in self._results:
+            return self._results[name]
+        if name not in self.stages:
+            if name in DATASET_FIELDS:
+                return None
+            raise KeyError(f'{name} is not a field of {self!r}')
+
+        with self._locks[name]:
+            if name in self._results:
+                return self._results[name]
+            future = self._futures.get(name)
+            if future is not None:
+                # being loaded by load()
+                return future.result()
+
+            stage = self.stages[name]
+            args = [self.get(required) for required in stage.requires]
+            self._results[name] = stage.func(*args)
+
+        return self._results[name]
+
+    def load(
+        self,
+        names: Optional[Iterable[str]] = None,
+        n_workers: Optional[int] = None,
+        on_stage_done: Optional[Callable[[str, Future], None]] = None,
+    ) -> Dict[str, Future]:
+        """Load fields concurrently in the background
+
+        The stages that are already loaded are not run again. This
+        function returns immediately.
+
+        Parameters
+        ----------
+        names : Optional[Iterable[str]]
+            The fields to load. The stages they require are also loaded.
+            If None, all the stages are loaded.
+        n_workers : Optional[int]
+            The number of worker threads. If None, one per stage.
+        on_stage_done : Optional[Callable[[str, Future], None]]
+            Called from the worker thread with the name and the future of
+            each stage when it completes.
+
+        Returns
+        -------
+        futures : Dict[str, Future]
+            The future of each stage that is loaded, keyed by name.
+        """
+        if names is None:
+            names = self.stages
+        names = [name for name in names if name in self.stages]
+
+        # collect the stages the fields require
+        needed = set()
+        to_visit = list(names)
+        while len(to_visit) > 0:
+            name = to_visit.pop()
+            if name not in needed:
+                needed.add(name)
+                to_visit.extend(self.stages[name].requires)
+
+        # the futures are registered before any stage runs, so get() waits
+        # for them instead of loading the stages again
+        stages = {}
+        registered = {}
+        for name in needed:
+            if not self._locks[name].acquire(blocking=False):
+                # being loaded by get()
+                stages[name] = Stage(partial(self.get, name))
+                continue
+            try:
+                if name in self._results:
+                    stages[name] = Stage(_constant(self._results[name]))
+                elif name in self._futures:
+                    # being loaded by a previous load()
+                    stages[name] = Stage(self._futures[name].result)
+                else:
+                    stages[name] = self.stages[name]
+                    registered[name] = Future()
+                    self._futures[name] = registered[name]
+            finally:
+                self._locks[name].release()
+
+        def _on_stage_done(name: str, future: Future):
+            error = future.exception()
+            if error is None:
+                self._results.setdefault(name, future.result())
+            if name in registered:
+                self._futures.pop(name, None)
+                if error is None:
+                    registered[name].set_result(self._results[name])
+                else:
+                    registered[name].set_exception(error)
+            if on_stage_done is not None:
+                on_stage_done(name, future)
+
+        futures = run_stages(
+            stages, n_workers=n_workers, on_stage_done=_on_stage_done
+        )
+
+        return futures
+
+    def close(self):
+        """Release the resources held by the loaded fields
+
+        The stages that have a close function (see
+        calciumcurator.io.pipeline.Stage) are closed and the loaded
+        results are dropped, so the fields are loaded again if they are
+        accessed.
+        """
+        for name, stage in self.stages.items():
+            with self._locks[name]:
+                if name in self._results and stage.close is not None:
+                    stage.close(self._results[name])
+                self._results.pop(name, None)
+
+    @property
+    def movie(self):
+        """The (n_frames, ...) registered movie"""
+        return self.get('movie')
+
+    @property
+    def data_range(self):
+        """The (min, max) pixel values of the movie"""
+        return self.get('data_range')
+
+    @property
+    def cell_masks(self) -> list:
+        """The (n_pixels, n_dims) pixel coordinates of each cell"""
+        return self.get('cell_masks')
+
+    @property
+    def footprints(self):
+        """The (n_cells, n_frame_pixels) sparse pixel weights of each cell,
+        None if unavailable
+        """
+        return self.get('footprints')
+
+    @property
+    def initial_state(self):
+        """The initial accepted state of each cell"""
+        return self.get('initial_state')
+
+    @property
+    def traces(self):
+        """The (n_cells, n_frames) fluorescence traces"""
+        return self.get('traces')
+
+    @property
+    def neuropil(self):
+        """The (n_cells, n_frames) neuropil traces, None if unavailable"""
+        return self.get('neuropil')
+
+    @property
+    def spikes(self):
+        """The (n_cells, n_frames) deconvolved spikes, None if unavailable"""
+        return self.get('spikes')
+
+    @property
+    def snr(self):
+        """The (n_cells,) signal to noise ratios, None if unavailable"""
+        return self.get('snr')
+
+    @property
+    def snr_mask(self):
+        """The image of the cell masks colored by SNR, None if unavailable"""
+        return self.get('snr_mask')
+
+    @property
+    def is_cell(self):
+        """The pipeline's cell classification, None if unavailable"""
+        return self.get('is_cell')
+
+
+def _constant(value: Any) -> Callable[[], Any]:
+    return lambda: value
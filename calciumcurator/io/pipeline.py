@@ -0,0 +1,142 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+
+class Stage(NamedTuple):
+    """A step of loading a dataset
+
+    Parameters
+    ----------
+    func : Callable
+        The function that runs the stage. It is called with the results
+        of the required stages as positional arguments, in order.
+    requires : Tuple[str, ...]
+        The names of the stages whose results func needs.
+    close : Optional[Callable[[Any], None]]
+        Called with the result of the stage to release the resources it
+        holds (e.g., open files) when the dataset is closed.
+    """
+
+    func: Callable[..., Any]
+    requires: Tuple[str, ...] = ()
+    close: Optional[Callable[[Any], None]] = None
+
+
+def _check_stages(stages: Dict[str, Stage]):
+    # every stage must eventually become ready: all the required stages
+    # exist and there are no cycles
+    for name, stage in stages.items():
+        for required_name in stage.requires:
+            if required_name not in stages:
+                raise ValueError(
+                    f'stage {name} requires unknown stage {required_name}'
+                )
+
+    done = set()
+    while len(done) < len(stages):
+        ready = [
+            name
+            for name, stage in stages.items()
+            if name not in done and all(r in done for r in stage.requires)
+        ]
+        if len(ready) == 0:
+            raise ValueError(
+                f'stages have circular requirements: {set(stages) - done}'
+            )
+        done.update(ready)
+
+
+def run_stages(
+    stages: Dict[str, Stage],
+    n_workers: Optional[int] = None,
+    on_stage_done: Optional[Callable[[str, Future], None]] = None,
+) -> Dict[str, Future]:
+    """Run the stages of a loader concurrently
+
+    Each stage is submitted to a thread pool as soon as the stages it
+    requires are done, so independent stages (e.g., the movie, the
+    contours and the traces) run at the same time. This function returns
+    immediately.
+
+    Parameters
+    ----------
+    stages : Dict[str, Stage]
+        The stages to run, keyed by name.
+    n_workers : Optional[int]
+        The number of worker threads. If None, one per stage.
+    on_stage_done : Optional[Callable[[str, Future], None]]
+        Called from the worker thread with the name and the future of each
+        stage when it completes.
+
+    Returns
+    -------
+    futures : Dict[str, Future]
+        The future of each stage. If a stage fails, the stages that
+        require it fail with the same exception.
+    """
+    _check_stages(stages)
+
+    if n_workers is None:
+        n_workers = max(len(stages), 1)
+    executor = ThreadPoolExecutor(max_workers=n_workers)
+    futures = {name: Future() for name in stages}
+    n_pending = {name: len(stage.requires) for name, stage in stages.items()}
+    dependents = {name: [] for name in stages}
+    for name, stage in stages.items():
+        for required_name in stage.requires:
+            dependents[required_name].append(name)
+    lock = threading.Lock()
+    n_remaining = [len(stages)]
+
+    def _run(name: str):
+        stage = stages[name]
+        future = futures[name]
+        if not future.set_running_or_notify_cancel():
+            _finish(name)
+            return
+        try:
+            args = [futures[required].result() for required in stage.requires]
+            future.set_result(stage.func(*args))
+        except BaseException as error:
+            future.set_exception(error)
+        _finish(name)
+
+    def _finish(name: str):
+        if on_stage_done is not None:
+            on_stage_done(name, futures[name])
+
+        ready = []
+        with lock:
+            for dependent in dependents[name]:
+                n_pending[dependent] -= 1
+                if n_pending[dependent] == 0:
+                    ready.append(dependent)
+            n_remaining[0] -= 1
+            all_done = n_remaining[0] == 0
+        for dependent in ready:
+            executor.submit(_run, dependent)
+        if all_done:
+            executor.shutdown(wait=False)
+
+    # the first stages are listed before any is submitted, since the
+    # pending counts change as soon as stages complete
+    first_stages = [name for name, n in n_pending.items() if n == 0]
+    for name in first_stages:
+        executor.submit(_run, name)
+
+    return futures
+
+
+def load_stages(
+    stages: Dict[str, Stage], n_workers: Optional[int] = None
+) -> Dict[str, Any]:
+    """Run the stages of a loader concurrently and wait for all results
+
+    Returns
+    -------
+    results : Dict[str, Any]
+        The result of each stage, keyed by name.
+    """
+    futures = run_stages(stages, n_workers=n_workers)
+    return {name: future.result() for name, future in futures.items()}
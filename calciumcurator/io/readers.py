@@ -0,0 +1,111 @@
+import threading
+from typing import Callable, Dict, List
+
+from .caiman.caiman_reader import caiman_dataset
+from .dataset import CurationDataset
+from .s2p.multiplane import s2p_multiplane_dataset
+from .s2p.s2p_reader import s2p_dataset
+
+
+# packages register readers under this entry point group, e.g. in setup.cfg:
+# [options.entry_points]
+# calciumcurator.readers =
+#     my-pipeline = my_package.reader:my_dataset
+READER_ENTRY_POINT_GROUP = 'calciumcurator.readers'
+
+# a reader is called with the reader keyword arguments (pipeline_params,
+# image_path, snr_path, trace_path, cell_path and spikes_path) and returns
+# a CurationDataset
+_READERS = {
+    "s2p": s2p_dataset,
+    "s2p-multiplane": s2p_multiplane_dataset,
+    "caiman": caiman_dataset,
+}
+_entry_points_loaded = False
+_registry_lock = threading.Lock()
+
+
+def _iter_entry_points(group: str):
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        # python < 3.8
+        import pkg_resources
+
+        return list(pkg_resources.iter_entry_points(group))
+
+    all_entry_points = entry_points()
+    if hasattr(all_entry_points, 'select'):
+        return list(all_entry_points.select(group=group))
+    return list(all_entry_points.get(group, []))
+
+
+def _load_entry_points():
+    global _entry_points_loaded
+    with _registry_lock:
+        if _entry_points_loaded:
+            return
+        _entry_points_loaded = True
+        entry_points = _iter_entry_points(READER_ENTRY_POINT_GROUP)
+
+    for entry_point in entry_points:
+        # the built-in readers are also registered as entry points
+        if entry_point.name not in _READERS:
+            register_reader(entry_point.name, entry_point.load())
+
+
+def register_reader(
+    name: str, reader: Callable[..., CurationDataset], overwrite: bool = False,
+):
+    """Register a reader for a pipeline
+
+    Parameters
+    ----------
+    name : str
+        The name of the pipeline (the --pipeline argument).
+    reader : Callable[..., CurationDataset]
+        The function that opens a dataset of the pipeline.
+    overwrite : bool
+        If True, an existing reader with the same name is replaced.
+        The default value is False.
+    """
+    with _registry_lock:
+        if name in _READERS and not overwrite:
+            raise ValueError(f'a reader is already registered for {name}')
+        _READERS[name] = reader
+
+
+def get_readers() -> Dict[str, Callable[..., CurationDataset]]:
+    """Get the registered readers, including the entry point plugins"""
+    _load_entry_points()
+    with _registry_lock:
+        return dict(_READERS)
+
+
+def reader_names() -> List[str]:
+    return sorted(get_readers())
+
+
+def open_dataset(pipeline: str, **reader_kwargs) -> CurationDataset:
+    """Open a dataset with the reader registered for a pipeline
+
+    Parameters
+    ----------
+    pipeline : str
+        The name of the pipeline.
+    **reader_kwargs
+        The keyword arguments passed to the reader.
+
+    Returns
+    -------
+    dataset : CurationDataset
+        The dataset. Its fields are loaded on first access.
+    """
+    readers = get_readers()
+    if pipeline not in readers:
+        raise KeyError(
+            f'unknown pipeline {pipeline}. valid options are '
+            f'{", ".join(sorted(readers))}'
+        )
+
+    return readers[pipeline](**reader_kwargs)
@@ -0,0 +1,322 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import re
+from typing import Dict, List, Optional
+
+import dask.array as da
+import numpy as np
+from scipy import sparse
+
+from ...contour_manager import ContourManager
+from ...images.masks import make_scalar_mask
+from ..dataset import CurationDataset
+from ..pipeline import Stage, load_stages
+from ..utils.data_range import calc_data_range
+from ..utils.npy import load_npy
+from .s2p_reader import (
+    create_cell_mask_indices,
+    create_footprints,
+    create_roi_footprints,
+)
+from .snr import load_snr
+from .stat_cache import load_stat
+
+
+def find_plane_dirs(suite2p_dir: str) -> List[str]:
+    """Find the plane directories (plane0...planeN) in a suite2p output directory
+
+    Parameters
+    ----------
+    suite2p_dir : str
+        The suite2p output directory containing the plane directories.
+
+    Returns
+    -------
+    plane_dirs : List[str]
+        The paths to the plane directories sorted by plane number.
+    """
+    plane_dirs = []
+    for name in os.listdir(suite2p_dir):
+        match = re.fullmatch(r'plane(\d+)', name)
+        path = os.path.join(suite2p_dir, name)
+        if match is not None and os.path.isdir(path):
+            plane_dirs.append((int(match.group(1)), path))
+
+    if len(plane_dirs) == 0:
+        raise FileNotFoundError(f'no plane directories found in {suite2p_dir}')
+
+    return [path for _, path in sorted(plane_dirs)]
+
+
+def load_plane_movie(plane_dir: str, ops: dict) -> da.Array:
+    """Lazily load the registered movie (data.bin) of a suite2p plane
+
+    Parameters
+    ----------
+    plane_dir : str
+        The path to the plane directory.
+    ops : dict
+        The options and intermediate outputs from s2p for the plane.
+
+    Returns
+    -------
+    movie : da.Array
+        (n_frames, n_rows, n_cols) array backed by a memory map of data.bin.
+    """
+    movie_path = os.path.join(plane_dir, 'data.bin')
+    n_rows = ops['Ly']
+    n_cols = ops['Lx']
+    n_frames = os.path.getsize(movie_path) // (n_rows * n_cols * 2)
+    movie = np.memmap(
+        movie_path, mode='r', dtype=np.int16, shape=(n_frames, n_rows, n_cols)
+    )
+
+    return da.from_array(movie, chunks=(1, n_rows, n_cols))
+
+
+def load_plane_ops(plane_dir: str) -> dict:
+    """Load the options and intermediate outputs (ops.npy) of a suite2p plane"""
+    ops = np.load(os.path.join(plane_dir, 'ops.npy'), allow_pickle=True)
+    return ops.item()
+
+
+def load_plane_spikes(plane_dir: str) -> Optional[np.ndarray]:
+    """Load the deconvolved traces (spks.npy) of a suite2p plane
+
+    Returns None if the plane has no spks.npy.
+    """
+    spikes_path = os.path.join(plane_dir, 'spks.npy')
+    if os.path.isfile(spikes_path):
+        return load_npy(spikes_path)
+    return None
+
+
+def s2p_multiplane_reader(
+    pipeline_params,
+    image_path=None,
+    snr_path=None,
+    trace_path=None,
+    cell_path=None,
+    spikes_path=None,
+    n_workers: Optional[int] = None,
+):
+    """Load all planes of a suite2p output directory concurrently
+
+    The planes are stacked into a single lazy movie with shape
+    (n_frames, n_planes, n_rows, n_cols) and the cell masks have
+    (plane, row, column) coordinates, so switching planes in the viewer
+    is a slice along the plane axis. The outputs of the planes are
+    concatenated in plane order.
+
+    Parameters
+    ----------
+    pipeline_params : str
+        The suite2p output directory containing plane0...planeN.
+    image_path, snr_path, trace_path, cell_path, spikes_path
+        Unused. The outputs are loaded from the plane directories.
+        These are accepted so this reader has the same signature as s2p_reader.
+    n_workers : Optional[int]
+        The number of threads each stage uses to read the files of the
+        planes. If None, one thread per plane is used.
+    """
+    results = load_stages(
+        s2p_multiplane_stages(pipeline_params, n_workers=n_workers)
+    )
+
+    contour_manager = ContourManager(
+        contours=results["cell_masks"],
+        initial_state=results["initial_state"],
+        im_shape=results["movie"].shape[1:],
+    )
+
+    return (
+        results["movie"],
+        results["data_range"],
+        contour_manager,
+        results["traces"],
+        results["snr"],
+        results["snr_mask"],
+        results["spikes"],
+        results["is_cell"],
+    )
+
+
+def _stack_cell_masks(plane_stats: List, plane_ops: List[dict]) -> list:
+    cell_masks = []
+    for plane_index, (stat, ops) in enumerate(zip(plane_stats, plane_ops)):
+        for mask in create_cell_mask_indices(stat, ops):
+            plane_column = np.full((len(mask), 1), plane_index)
+            cell_masks.append(np.hstack((plane_column, mask)))
+
+    return cell_masks
+
+
+def _stack_footprints(
+    plane_stats: List, plane_ops: List[dict]
+) -> sparse.csr_matrix:
+    # the pixels of plane i follow those of the previous planes, as in
+    # the flattened (n_planes, n_rows, n_cols) frames
+    return sparse.block_diag(
+        [
+            create_footprints(stat, ops)
+            for stat, ops in zip(plane_stats, plane_ops)
+        ],
+        format='csr',
+    )
+
+
+def _stack_roi_footprints(
+    plane_stats: List, plane_ops: List[dict]
+) -> sparse.csr_matrix:
+    return sparse.block_diag(
+        [
+            create_roi_footprints(stat, ops)
+            for stat, ops in zip(plane_stats, plane_ops)
+        ],
+        format='csr',
+    )
+
+
+def _stack_traces(plane_traces: List[np.ndarray], n_frames: int) -> np.ndarray:
+    return np.concatenate([traces[:, :n_frames] for traces in plane_traces])
+
+
+def _stack_spikes(
+    plane_spikes: List[Optional[np.ndarray]], n_frames: int
+) -> Optional[np.ndarray]:
+    if all(spikes is not None for spikes in plane_spikes):
+        return _stack_traces(plane_spikes, n_frames)
+    return None
+
+
+def s2p_multiplane_stages(
+    pipeline_params,
+    image_path=None,
+    snr_path=None,
+    trace_path=None,
+    cell_path=None,
+    spikes_path=None,
+    n_workers: Optional[int] = None,
+) -> Dict[str, Stage]:
+    """Get the loading stages of a multi-plane suite2p dataset
+
+    The stages can be run concurrently with
+    calciumcurator.io.pipeline.run_stages(). The parameters are the same
+    as s2p_multiplane_reader().
+
+    Returns
+    -------
+    stages : Dict[str, Stage]
+        The 'movie', 'data_range', 'cell_masks', 'footprints',
+        'roi_footprints', 'initial_state', 'traces', 'frame_rate', 'spikes',
+        'is_cell', 'snr' and 'snr_mask' stages, and the intermediate stages
+        they require.
+    """
+
+    def _map_planes(func, plane_dirs, file_name=None) -> list:
+        # each stage reads its files of all planes concurrently
+        if file_name is not None:
+            plane_dirs = [
+                os.path.join(plane_dir, file_name) for plane_dir in plane_dirs
+            ]
+        max_workers = n_workers or max(len(plane_dirs), 1)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(func, plane_dirs))
+
+    def _make_snr_mask(cell_masks, snr, movie):
+        return make_scalar_mask(
+            cell_masks, im_shape=movie.shape[1:], values=snr
+        )
+
+    return {
+        "plane_dirs": Stage(lambda: find_plane_dirs(pipeline_params)),
+        "plane_ops": Stage(
+            lambda plane_dirs: _map_planes(load_plane_ops, plane_dirs),
+            requires=("plane_dirs",),
+        ),
+        "plane_stats": Stage(
+            lambda plane_dirs: _map_planes(load_stat, plane_dirs, 'stat.npy'),
+            requires=("plane_dirs",),
+        ),
+        "plane_movies": Stage(
+            lambda plane_dirs, plane_ops: [
+                load_plane_movie(plane_dir, ops)
+                for plane_dir, ops in zip(plane_dirs, plane_ops)
+            ],
+            requires=("plane_dirs", "plane_ops"),
+        ),
+        # frames missing from the end of some planes are dropped
+        "n_frames": Stage(
+            lambda plane_movies: min(movie.shape[0] for movie in plane_movies),
+            requires=("plane_movies",),
+        ),
+        "movie": Stage(
+            lambda plane_movies, n_frames: da.stack(
+                [movie[:n_frames] for movie in plane_movies], axis=1
+            ),
+            requires=("plane_movies", "n_frames"),
+        ),
+        "data_range": Stage(calc_data_range, requires=("movie",)),
+        # the volume rate, at which each plane is imaged
+        "frame_rate": Stage(
+            lambda plane_ops: plane_ops[0].get('fs'), requires=("plane_ops",)
+        ),
+        "cell_masks": Stage(
+            _stack_cell_masks, requires=("plane_stats", "plane_ops")
+        ),
+        "footprints": Stage(
+            _stack_footprints, requires=("plane_stats", "plane_ops")
+        ),
+        "roi_footprints": Stage(
+            _stack_roi_footprints, requires=("plane_stats", "plane_ops")
+        ),
+        "traces": Stage(
+            lambda plane_dirs, n_frames: _stack_traces(
+                _map_planes(load_npy, plane_dirs, 'F.npy'), n_frames
+            ),
+            requires=("plane_dirs", "n_frames"),
+        ),
+        "snr": Stage(
+            lambda plane_dirs: np.concatenate(
+                _map_planes(load_snr, plane_dirs, 'F.npy')
+            ),
+            requires=("plane_dirs",),
+        ),
+        "is_cell": Stage(
+            lambda plane_dirs: np.concatenate(
+                _map_planes(np.load, plane_dirs, 'iscell.npy')
+            ),
+            requires=("plane_dirs",),
+        ),
+        "spikes": Stage(
+            lambda plane_dirs, n_frames: _stack_spikes(
+                _map_planes(load_plane_spikes, plane_dirs), n_frames
+            ),
+            requires=("plane_dirs", "n_frames"),
+        ),
+        "initial_state": Stage(
+            lambda is_cell: is_cell[:, 0].astype(bool), requires=("is_cell",)
+        ),
+        "snr_mask": Stage(
+            _make_snr_mask, requires=("cell_masks", "snr", "movie")
+        ),
+    }
+
+
+def s2p_multiplane_dataset(
+    pipeline_params,
+    image_path=None,
+    snr_path=None,
+    trace_path=None,
+    cell_path=None,
+    spikes_path=None,
+    n_workers: Optional[int] = None,
+) -> CurationDataset:
+    """Open a multi-plane suite2p dataset whose fields are loaded on first access
+
+    The parameters are the same as s2p_multiplane_reader().
+    """
+    return CurationDataset(
+        s2p_multiplane_stages(pipeline_params, n_workers=n_workers),
+        name='s2p-multiplane',
+    )
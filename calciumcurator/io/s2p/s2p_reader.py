@@ -1,13 +1,21 @@
-from typing import Any, Dict, Tuple
+import os
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import dask.array as da
-import h5py
 from napari.layers.utils.layer_utils import calc_data_range
 import numpy as np
-import pandas as pd
 
 from ...contour_manager import ContourManager
 from ...images.masks import make_scalar_mask
+from ...images.outlines import extract_outlines
+from ...traces.extraction import binarize_footprints, footprints_from_stat
+from ..dataset import CurationDataset
+from ..pipeline import Stage, load_stages
+from ..utils.hdf5 import close_hdf5_movie, open_hdf5_movie
+from ..utils.npy import load_npy
+from ..utils.tiff import TIFF_EXTENSIONS, open_tiff_movie
+from .snr import load_snr
+from .stat_cache import PackedStat, load_stat, pack_stat
 
 
 def create_cell_mask(
@@ -41,15 +49,66 @@ def create_cell_mask(
     return cell_mask, lam_normed
 
 
+def pack_cell_masks(
+    stat_all: Union[list, PackedStat],
+    n_rows: int,
+    n_cols: int,
+    allow_overlap: bool = False,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Get the flat pixel indices of all cell masks as a single array
+
+    This is the vectorized equivalent of calling create_cell_mask()
+    for each cell.
+
+    Parameters
+    ----------
+    stat_all : Union[list, PackedStat]
+        The list of stat for each cell loaded from suite2p or the
+        packed stats.
+    n_rows : int
+        y size of frame
+    n_cols : int
+        x size of frame
+    allow_overlap : bool
+        whether or not to include overlapping pixels in cell masks
+
+    Returns
+    -------
+    pixel_indices : np.ndarray
+        The flat index of every pixel of every cell mask.
+    cell_ids : np.ndarray
+        The index of the cell each pixel belongs to.
+    offsets : np.ndarray
+        (n_cells + 1,) array with the start of each cell in pixel_indices.
+    """
+    if not isinstance(stat_all, PackedStat):
+        stat_all = pack_stat(stat_all)
+
+    pixel_indices = np.ravel_multi_index(
+        (stat_all.ypix, stat_all.xpix), (n_rows, n_cols)
+    )
+    cell_ids = stat_all.cell_ids
+    if not allow_overlap:
+        keep = np.logical_not(stat_all.overlap)
+        pixel_indices = pixel_indices[keep]
+        cell_ids = cell_ids[keep]
+
+    offsets = np.zeros((stat_all.n_cells + 1,), dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(cell_ids, minlength=stat_all.n_cells))
+
+    return pixel_indices, cell_ids, offsets
+
+
 def create_cell_labels_ims(
-    stat_all: list, is_cell: np.ndarray, ops: dict,
+    stat_all: Union[list, PackedStat], is_cell: np.ndarray, ops: dict,
 ) -> Tuple[np.ndarray, np.ndarray]:
     """Create a label images for the good and bad cells
 
     Parameters
     ----------
-    stat_all : list
-        The list of stat for each cell loaded from suite2p
+    stat_all : Union[list, PackedStat]
+        The list of stat for each cell loaded from suite2p or the
+        packed stats.
     is_cell : np.ndarray
         This is the contents of the iscell.npy file
     ops : dict
@@ -69,114 +128,295 @@ def create_cell_labels_ims(
     n_rows = ops["Ly"]
     n_cols = ops["Lx"]
 
-    cell_masks = [
-        create_cell_mask(
-            stat,
-            n_rows=n_rows,
-            n_cols=n_cols,
-            allow_overlap=ops["allow_overlap"],
-        )[0]
-        for stat in stat_all
-    ]
+    pixel_indices, cell_ids, _ = pack_cell_masks(
+        stat_all,
+        n_rows=n_rows,
+        n_cols=n_cols,
+        allow_overlap=ops["allow_overlap"],
+    )
+    good_pixels = is_cell[cell_ids, 0] == 1
+    bad_pixels = np.logical_not(good_pixels)
 
     good_cell_mask = np.zeros((n_rows, n_cols))
     bad_cell_mask = np.zeros((n_rows, n_cols))
-    for cell_index, cell in enumerate(is_cell):
-        cell_mask_indices = np.unravel_index(
-            cell_masks[cell_index], (ops["Ly"], ops["Lx"])
-        )
-        if cell[0] == 1:
-            good_cell_mask[cell_mask_indices] = cell_index
-        else:
-            bad_cell_mask[cell_mask_indices] = cell_index
+    good_cell_mask.flat[pixel_indices[good_pixels]] = cell_ids[good_pixels]
+    bad_cell_mask.flat[pixel_indices[bad_pixels]] = cell_ids[bad_pixels]
 
     return good_cell_mask, bad_cell_mask
 
 
-def create_cell_mask_indices(stat_all: list, ops: dict):
+def create_cell_mask_indices(
+    stat_all: Union[list, PackedStat], ops: dict, outlines: bool = False
+) -> List[np.ndarray]:
+    """Get the (row, column) coordinates of the pixels in each cell mask
+
+    Parameters
+    ----------
+    stat_all : Union[list, PackedStat]
+        The list of stat for each cell loaded from suite2p or the
+        packed stats.
+    ops : dict
+        The options and intermediate outputs from s2p
+    outlines : bool
+        If True, only the boundary pixels of each mask are returned.
+        If False, all pixels of each mask are returned.
+        The default value is False.
+
+    Returns
+    -------
+    cell_mask_indices : List[np.ndarray]
+        (n_pixels, 2) array of pixel coordinates for each cell.
+    """
     n_rows = ops["Ly"]
     n_cols = ops["Lx"]
 
-    cell_masks = [
-        create_cell_mask(
-            stat,
-            n_rows=n_rows,
-            n_cols=n_cols,
-            allow_overlap=ops["allow_overlap"],
-        )[0]
-        for stat in stat_all
-    ]
-
-    cell_mask_indices = [
-        np.vstack(np.unravel_index(cell, (ops["Ly"], ops["Lx"]))).T
-        for cell in cell_masks
-    ]
+    pixel_indices, cell_ids, offsets = pack_cell_masks(
+        stat_all,
+        n_rows=n_rows,
+        n_cols=n_cols,
+        allow_overlap=ops["allow_overlap"],
+    )
+    if outlines:
+        pixel_indices, _, offsets = extract_outlines(
+            pixel_indices,
+            cell_ids,
+            n_cells=len(offsets) - 1,
+            im_shape=(n_rows, n_cols),
+        )
+    pixel_coordinates = np.column_stack(
+        np.unravel_index(pixel_indices, (n_rows, n_cols))
+    )
+    cell_mask_indices = np.split(pixel_coordinates, offsets[1:-1])
 
     return cell_mask_indices
 
 
-def s2p_reader(
-    pipeline_params, image_path, snr_path, trace_path, cell_path, spikes_path
-):
-    stat_all = np.load(pipeline_params, allow_pickle=True)
-    is_cell = np.load(cell_path, allow_pickle=True)
-    f_traces = np.load(trace_path, allow_pickle=True)
-    spikes = np.load(spikes_path)
-
-    # load the shifts
-    ops = np.load("ops.npy", allow_pickle=True).item()
-    y_offset = ops["yoff"]
-    x_offset = ops["xoff"]
-    offsets = np.vstack((y_offset, x_offset)).T
-
-    def translate_slice(array, offsets, block_info=None):
-        if block_info is not None:
-            array_location = block_info[None]["array-location"]
-            t_slice = array_location[0][0]
-            registered_array = np.roll(
-                array,
-                (
-                    -np.int16(offsets[t_slice][0]),
-                    -np.int16(offsets[t_slice][1]),
-                ),
-                axis=(1, 2),
+def create_footprints(stat_all: Union[list, PackedStat], ops: dict):
+    """Get the (n_cells, n_frame_pixels) matrix of the lam pixel weights
+
+    See calciumcurator.traces.extraction.footprints_from_stat().
+    """
+    if not isinstance(stat_all, PackedStat):
+        stat_all = pack_stat(stat_all)
+    return footprints_from_stat(
+        stat_all,
+        im_shape=(ops["Ly"], ops["Lx"]),
+        allow_overlap=ops["allow_overlap"],
+    )
+
+
+def create_roi_footprints(stat_all: Union[list, PackedStat], ops: dict):
+    """Get the (n_cells, n_frame_pixels) binary footprints of the ROIs
+
+    The footprints are the whole filled ROIs, including the pixels shared
+    with other ROIs whatever ops["allow_overlap"], so they measure the
+    shape and the overlap of the cells.
+    """
+    if not isinstance(stat_all, PackedStat):
+        stat_all = pack_stat(stat_all)
+    footprints = footprints_from_stat(
+        stat_all, im_shape=(ops["Ly"], ops["Lx"]), allow_overlap=True,
+    )
+    return binarize_footprints(footprints)
+
+
+def _load_offsets(ops: Dict[str, Any]) -> np.ndarray:
+    return np.vstack((ops["yoff"], ops["xoff"])).T
+
+
+def _translate_slice(array, offsets, block_info=None):
+    if block_info is not None:
+        # blocks can span several frames, each with its own offset
+        array_location = block_info[None]["array-location"]
+        t_start = array_location[0][0]
+        registered_array = np.empty_like(array)
+        for frame_index, frame in enumerate(array):
+            frame_offset = offsets[t_start + frame_index]
+            registered_array[frame_index] = np.roll(
+                frame,
+                (-np.int16(frame_offset[0]), -np.int16(frame_offset[1])),
+                axis=(0, 1),
             )
 
-        else:
-            registered_array = array
+    else:
+        registered_array = array
 
-        return registered_array
+    return registered_array
 
-    f = h5py.File(image_path, "r")
-    im = f["MSession_0/MUnit_0/Channel_0"]
-    im_shape = im.shape
-    da_im = da.from_array(im, chunks=(1, im_shape[-2], im_shape[-1]))
-    data_range = calc_data_range(da_im)
-    im_registered = da_im.map_blocks(translate_slice, offsets=offsets)
 
-    # load SNR
-    snr_df = pd.read_csv(snr_path)
-    snr = snr_df["0"].values
+def s2p_stages(
+    pipeline_params,
+    image_path,
+    snr_path=None,
+    trace_path=None,
+    cell_path=None,
+    spikes_path=None,
+    ops_path: Optional[str] = None,
+) -> Dict[str, Stage]:
+    """Get the loading stages of a suite2p dataset
 
-    cell_mask_indicies = create_cell_mask_indices(stat_all, ops)
-    initial_state = is_cell[:, 0].astype(np.bool)
-    contour_manager = ContourManager(
-        cell_mask_indicies,
-        initial_state=initial_state,
-        im_shape=(im_shape[-2], im_shape[-1]),
+    The stages can be run concurrently with
+    calciumcurator.io.pipeline.run_stages(). The parameters are the same
+    as s2p_reader().
+
+    Returns
+    -------
+    stages : Dict[str, Stage]
+        The 'movie', 'raw_movie', 'registration_offsets', 'data_range',
+        'cell_masks', 'footprints', 'roi_footprints', 'initial_state',
+        'traces', 'neuropil', 'frame_rate', 'spikes', 'is_cell', 'snr' and
+        'snr_mask' stages, and the intermediate stages they require.
+        The traces and the neuropil are left out if trace_path is not
+        given, the SNR and its mask if neither trace_path nor snr_path
+        is, and the spikes if spikes_path is not.
+    """
+    # ops.npy is loaded from the directory of stat.npy unless specified
+    if ops_path is None:
+        ops_path = os.path.join(
+            os.path.dirname(os.path.abspath(pipeline_params)), "ops.npy"
+        )
+
+    def _open_raw_movie():
+        if os.path.splitext(image_path)[-1].lower() in TIFF_EXTENSIONS:
+            # uncompressed tiffs are memory mapped and the registration
+            # is applied to single-frame blocks
+            movie = open_tiff_movie(image_path)
+            if not isinstance(movie, da.Array):
+                movie = da.from_array(movie, chunks=(1,) + movie.shape[1:])
+            return movie
+        # single-frame dask chunks, the streaming passes read blocks
+        # aligned to the hdf5 chunks on disk
+        return open_hdf5_movie(image_path, "MSession_0/MUnit_0/Channel_0")
+
+    def _register_movie(raw_movie, offsets):
+        return raw_movie.map_blocks(_translate_slice, offsets=offsets)
+
+    def _load_neuropil():
+        # the neuropil traces are stored next to the traces
+        neuropil_path = os.path.join(
+            os.path.dirname(os.path.abspath(trace_path)), "Fneu.npy"
+        )
+        if os.path.isfile(neuropil_path):
+            return load_npy(neuropil_path)
+        return None
+
+    def _make_snr_mask(cell_masks, snr, raw_movie):
+        im_shape = raw_movie.shape
+        return make_scalar_mask(
+            cell_masks, im_shape=(im_shape[-2], im_shape[-1]), values=snr
+        )
+
+    stages = {
+        "ops": Stage(lambda: np.load(ops_path, allow_pickle=True).item()),
+        "stat": Stage(lambda: load_stat(pipeline_params)),
+        "raw_movie": Stage(_open_raw_movie, close=close_hdf5_movie),
+        "registration_offsets": Stage(_load_offsets, requires=("ops",)),
+        "frame_rate": Stage(lambda ops: ops.get("fs"), requires=("ops",)),
+        # the frames are registered as they are read
+        "movie": Stage(
+            _register_movie, requires=("raw_movie", "registration_offsets")
+        ),
+        "data_range": Stage(calc_data_range, requires=("raw_movie",)),
+        "is_cell": Stage(lambda: np.load(cell_path, allow_pickle=True)),
+        # the traces are memory mapped if they do not fit the budget
+        "traces": Stage(lambda: load_npy(trace_path, allow_pickle=True)),
+        "spikes": Stage(lambda: load_npy(spikes_path)),
+        "neuropil": Stage(_load_neuropil),
+        # the SNR is computed from F.npy/Fneu.npy unless a CSV is provided
+        "snr": Stage(lambda: load_snr(trace_path, snr_path=snr_path)),
+        # the masks are filled, the viewer draws their outlines
+        "cell_masks": Stage(
+            create_cell_mask_indices, requires=("stat", "ops")
+        ),
+        # the traces are extracted with the suite2p pixel weights
+        "footprints": Stage(create_footprints, requires=("stat", "ops")),
+        # the filled ROIs measure the shape and the overlap of the cells
+        "roi_footprints": Stage(
+            create_roi_footprints, requires=("stat", "ops")
+        ),
+        "initial_state": Stage(
+            lambda is_cell: is_cell[:, 0].astype(np.bool),
+            requires=("is_cell",),
+        ),
+        "snr_mask": Stage(
+            _make_snr_mask, requires=("cell_masks", "snr", "raw_movie")
+        ),
+    }
+
+    # the fields whose files are not given are left out, so they are None
+    if not trace_path:
+        del stages["traces"], stages["neuropil"]
+        if not snr_path:
+            del stages["snr"], stages["snr_mask"]
+    if not spikes_path:
+        del stages["spikes"]
+
+    return stages
+
+
+def s2p_reader(
+    pipeline_params,
+    image_path,
+    snr_path=None,
+    trace_path=None,
+    cell_path=None,
+    spikes_path=None,
+    ops_path: Optional[str] = None,
+):
+    # the independent stages are loaded concurrently
+    results = load_stages(
+        s2p_stages(
+            pipeline_params,
+            image_path,
+            snr_path=snr_path,
+            trace_path=trace_path,
+            cell_path=cell_path,
+            spikes_path=spikes_path,
+            ops_path=ops_path,
+        )
     )
 
-    snr_mask = make_scalar_mask(
-        cell_mask_indicies, im_shape=(im_shape[-2], im_shape[-1]), values=snr
+    im_shape = results["raw_movie"].shape
+    contour_manager = ContourManager(
+        contours=results["cell_masks"],
+        initial_state=results["initial_state"],
+        im_shape=(im_shape[-2], im_shape[-1]),
     )
 
     return (
-        im_registered,
-        data_range,
+        results["movie"],
+        results["data_range"],
         contour_manager,
-        f_traces,
-        snr,
-        snr_mask,
-        spikes,
-        is_cell,
+        results.get("traces"),
+        results.get("snr"),
+        results.get("snr_mask"),
+        results.get("spikes"),
+        results["is_cell"],
+    )
+
+
+def s2p_dataset(
+    pipeline_params,
+    image_path,
+    snr_path=None,
+    trace_path=None,
+    cell_path=None,
+    spikes_path=None,
+    ops_path: Optional[str] = None,
+) -> CurationDataset:
+    """Open a suite2p dataset whose fields are loaded on first access
+
+    The parameters are the same as s2p_reader().
+    """
+    return CurationDataset(
+        s2p_stages(
+            pipeline_params,
+            image_path,
+            snr_path=snr_path,
+            trace_path=trace_path,
+            cell_path=cell_path,
+            spikes_path=spikes_path,
+            ops_path=ops_path,
+        ),
+        name='s2p',
     )
@@ -0,0 +1,149 @@
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from ..utils.cache import is_cache_valid, sidecar_path
+
+
+def compute_snr(
+    f: np.ndarray,
+    f_neu: Optional[np.ndarray] = None,
+    neuropil_coefficient: float = 0.7,
+    chunk_size: int = 5000,
+) -> np.ndarray:
+    """Compute the signal to noise ratio of every cell in one pass over time.
+
+    The signal is the peak of the neuropil corrected trace above its mean
+    and the noise is estimated from the first temporal difference
+    (std(diff(F)) / sqrt(2)), which is insensitive to slow baseline drift.
+    Both are accumulated over time chunks so memory mapped traces are never
+    loaded in full.
+
+    Parameters
+    ----------
+    f : np.ndarray
+        (n_cells, n_frames) array of fluorescence traces (e.g., F.npy).
+    f_neu : Optional[np.ndarray]
+        (n_cells, n_frames) array of neuropil traces (e.g., Fneu.npy).
+        If None, no neuropil correction is applied.
+    neuropil_coefficient : float
+        The scale factor applied to f_neu before subtracting it from f.
+        The default value is 0.7 (the suite2p default).
+    chunk_size : int
+        The number of frames processed at once. The default value is 5000.
+
+    Returns
+    -------
+    snr : np.ndarray
+        (n_cells,) array with the signal to noise ratio of each cell.
+    """
+    n_cells, n_frames = f.shape
+    trace_sum = np.zeros((n_cells,), dtype=np.float64)
+    trace_max = np.full((n_cells,), -np.inf, dtype=np.float64)
+    diff_sq_sum = np.zeros((n_cells,), dtype=np.float64)
+    last_frame = None
+
+    for start in range(0, n_frames, chunk_size):
+        stop = min(start + chunk_size, n_frames)
+        chunk = np.array(f[:, start:stop], dtype=np.float64)
+        if f_neu is not None:
+            chunk -= neuropil_coefficient * np.asarray(
+                f_neu[:, start:stop], dtype=np.float64
+            )
+
+        trace_sum += chunk.sum(axis=1)
+        np.maximum(trace_max, chunk.max(axis=1), out=trace_max)
+
+        # include the last frame of the previous chunk so the
+        # difference across the chunk boundary is counted
+        if last_frame is not None:
+            chunk_diff = np.diff(np.hstack((last_frame, chunk)), axis=1)
+        else:
+            chunk_diff = np.diff(chunk, axis=1)
+        diff_sq_sum += np.sum(chunk_diff ** 2, axis=1)
+        last_frame = chunk[:, -1:]
+
+    trace_mean = trace_sum / n_frames
+    noise = np.sqrt(diff_sq_sum / (2 * max(n_frames - 1, 1)))
+
+    snr = np.zeros((n_cells,), dtype=np.float64)
+    np.divide(trace_max - trace_mean, noise, out=snr, where=noise > 0)
+
+    return snr
+
+
+def load_snr(
+    trace_path: Optional[str],
+    snr_path: Optional[str] = None,
+    neuropil_path: Optional[str] = None,
+    neuropil_coefficient: float = 0.7,
+    use_cache: bool = True,
+) -> Optional[np.ndarray]:
+    """Load the SNR for a suite2p dataset, computing and caching it if needed.
+
+    The name of the cache includes the neuropil coefficient (or 'raw' if
+    there are no neuropil traces), so changing it computes the SNR again.
+
+    Parameters
+    ----------
+    trace_path : Optional[str]
+        The path to the suite2p F.npy file.
+    snr_path : Optional[str]
+        The path to a CSV file with precomputed SNR values in column "0".
+        If provided, it overrides the computed SNR.
+    neuropil_path : Optional[str]
+        The path to the suite2p Fneu.npy file. If None, Fneu.npy is looked
+        for next to trace_path.
+    neuropil_coefficient : float
+        The scale factor applied to the neuropil traces. The default value
+        is 0.7.
+    use_cache : bool
+        If True, the computed SNR is saved next to trace_path and reused
+        on subsequent loads. The default value is True.
+
+    Returns
+    -------
+    snr : Optional[np.ndarray]
+        (n_cells,) array with the signal to noise ratio of each cell, or
+        None if neither trace_path nor snr_path is given.
+    """
+    if snr_path:
+        snr_df = pd.read_csv(snr_path)
+        return snr_df["0"].values
+    if not trace_path:
+        return None
+
+    if neuropil_path is None:
+        neuropil_path = os.path.join(
+            os.path.dirname(os.path.abspath(trace_path)), 'Fneu.npy'
+        )
+    if not os.path.isfile(neuropil_path):
+        neuropil_path = None
+
+    source_paths = [trace_path]
+    if neuropil_path is not None:
+        source_paths.append(neuropil_path)
+        cache_suffix = f'snr_neuropil{neuropil_coefficient:g}'
+    else:
+        cache_suffix = 'snr_raw'
+    cache_path = sidecar_path(trace_path, cache_suffix)
+    if use_cache and is_cache_valid(cache_path, source_paths):
+        return np.load(cache_path)
+
+    f = np.load(trace_path, mmap_mode='r')
+    if neuropil_path is not None:
+        f_neu = np.load(neuropil_path, mmap_mode='r')
+    else:
+        f_neu = None
+    snr = compute_snr(f, f_neu, neuropil_coefficient=neuropil_coefficient)
+
+    if use_cache:
+        try:
+            np.save(cache_path, snr)
+        except OSError:
+            # the output directory may be read only
+            pass
+
+    return snr
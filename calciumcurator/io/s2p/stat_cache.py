@@ -0,0 +1,184 @@
+from typing import List, Optional
+
+import numpy as np
+
+from ..utils.cache import is_cache_valid, sidecar_path
+
+
+class PackedStat:
+    """The suite2p ROI stats stored as concatenated per-pixel columns
+
+    The pixels of cell i are the slice offsets[i]:offsets[i + 1] of each
+    of the pixel columns (ypix, xpix, lam, overlap).
+
+    Parameters
+    ----------
+    ypix : np.ndarray
+        The row index of every ROI pixel.
+    xpix : np.ndarray
+        The column index of every ROI pixel.
+    lam : np.ndarray
+        The weight of every ROI pixel.
+    overlap : np.ndarray
+        True for pixels that are shared with another ROI.
+    offsets : np.ndarray
+        (n_cells + 1,) array with the start of each cell in the pixel columns.
+    """
+
+    def __init__(
+        self,
+        ypix: np.ndarray,
+        xpix: np.ndarray,
+        lam: np.ndarray,
+        overlap: np.ndarray,
+        offsets: np.ndarray,
+    ):
+        self.ypix = ypix
+        self.xpix = xpix
+        self.lam = lam
+        self.overlap = overlap
+        self.offsets = offsets
+
+    @property
+    def n_cells(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def n_pixels(self) -> np.ndarray:
+        """The number of pixels in each cell"""
+        return np.diff(self.offsets)
+
+    @property
+    def cell_ids(self) -> np.ndarray:
+        """The index of the cell each pixel belongs to"""
+        return np.repeat(np.arange(self.n_cells), self.n_pixels)
+
+    def __len__(self) -> int:
+        return self.n_cells
+
+    def __getitem__(self, index: int) -> dict:
+        cell_slice = slice(self.offsets[index], self.offsets[index + 1])
+        return {
+            'ypix': self.ypix[cell_slice],
+            'xpix': self.xpix[cell_slice],
+            'lam': self.lam[cell_slice],
+            'overlap': self.overlap[cell_slice],
+        }
+
+
+def pack_stat(stat_all: List[dict]) -> PackedStat:
+    """Concatenate the per-cell suite2p stat dictionaries into columns
+
+    Parameters
+    ----------
+    stat_all : List[dict]
+        The list of stat for each cell loaded from suite2p stat.npy
+
+    Returns
+    -------
+    packed_stat : PackedStat
+        The stats stored as concatenated per-pixel columns.
+    """
+    n_pixels = np.array([len(stat['ypix']) for stat in stat_all], dtype=int)
+    offsets = np.zeros((len(stat_all) + 1,), dtype=np.int64)
+    offsets[1:] = np.cumsum(n_pixels)
+
+    def _concatenate(key, dtype):
+        if len(stat_all) == 0:
+            return np.zeros((0,), dtype=dtype)
+        return np.concatenate(
+            [np.asarray(stat[key], dtype=dtype) for stat in stat_all]
+        )
+
+    ypix = _concatenate('ypix', np.int32)
+    xpix = _concatenate('xpix', np.int32)
+    lam = _concatenate('lam', np.float32)
+
+    # older versions of suite2p do not store the overlap
+    if all('overlap' in stat for stat in stat_all):
+        overlap = _concatenate('overlap', bool)
+    else:
+        overlap = np.zeros((offsets[-1],), dtype=bool)
+
+    return PackedStat(
+        ypix=ypix, xpix=xpix, lam=lam, overlap=overlap, offsets=offsets
+    )
+
+
+def save_packed_stat(packed_stat: PackedStat, path: str):
+    """Save packed stats to an .npz file"""
+    np.savez(
+        path,
+        ypix=packed_stat.ypix,
+        xpix=packed_stat.xpix,
+        lam=packed_stat.lam,
+        overlap=packed_stat.overlap,
+        offsets=packed_stat.offsets,
+    )
+
+
+def load_packed_stat(path: str) -> PackedStat:
+    """Load packed stats from an .npz file created by save_packed_stat()"""
+    with np.load(path) as packed:
+        return PackedStat(
+            ypix=packed['ypix'],
+            xpix=packed['xpix'],
+            lam=packed['lam'],
+            overlap=packed['overlap'],
+            offsets=packed['offsets'],
+        )
+
+
+def convert_stat(stat_path: str, cache_path: Optional[str] = None) -> str:
+    """Convert a suite2p stat.npy file to a packed .npz sidecar
+
+    Parameters
+    ----------
+    stat_path : str
+        The path to the suite2p stat.npy file.
+    cache_path : Optional[str]
+        The path to save the packed stats to. If None, the stats are
+        saved next to stat.npy (e.g., stat_packed.npz).
+
+    Returns
+    -------
+    cache_path : str
+        The path the packed stats were saved to.
+    """
+    if cache_path is None:
+        cache_path = sidecar_path(stat_path, 'packed', ext='.npz')
+    stat_all = np.load(stat_path, allow_pickle=True)
+    save_packed_stat(pack_stat(stat_all), cache_path)
+
+    return cache_path
+
+
+def load_stat(stat_path: str, use_cache: bool = True) -> PackedStat:
+    """Load the suite2p stats, using the packed sidecar when it is up to date
+
+    Parameters
+    ----------
+    stat_path : str
+        The path to the suite2p stat.npy file.
+    use_cache : bool
+        If True, the packed stats are loaded from (or saved to) the
+        stat_packed.npz sidecar next to stat.npy. The default value is True.
+
+    Returns
+    -------
+    packed_stat : PackedStat
+        The stats stored as concatenated per-pixel columns.
+    """
+    cache_path = sidecar_path(stat_path, 'packed', ext='.npz')
+    if use_cache and is_cache_valid(cache_path, [stat_path]):
+        return load_packed_stat(cache_path)
+
+    packed_stat = pack_stat(np.load(stat_path, allow_pickle=True))
+    if use_cache:
+        try:
+            save_packed_stat(packed_stat, cache_path)
+        except OSError:
+            # the output directory may be read only
+            pass
+
+    return packed_stat
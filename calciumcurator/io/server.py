@@ -0,0 +1,675 @@
+import argparse
+from functools import partial
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Connection, Listener
+import os
+import queue
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import dask.array as da
+import numpy as np
+from scipy import sparse
+
+from ..images.proxy import TemporalProxy, load_temporal_proxy
+from ..images.summary import load_summary_images
+from ..memory import (
+    LRUCache,
+    estimate_nbytes,
+    get_memory_budget,
+    set_memory_budget,
+)
+from .dataset import CurationDataset
+from .pipeline import Stage
+from .readers import open_dataset
+
+
+DEFAULT_HOST = 'localhost'
+DEFAULT_PORT = 6342
+
+# arrays larger than this (and all lazy arrays) stay on the server and
+# are read by the client with RemoteArray
+REMOTE_ARRAY_BYTES = 16 * 1024 ** 2
+
+
+# the environment variable that overrides the authentication key
+AUTHKEY_ENV = 'CALCIUMCURATOR_AUTHKEY'
+
+# the name of the file the authentication key is stored in
+AUTHKEY_FILE = 'server-authkey'
+
+
+def authkey_dir() -> str:
+    """Get the private directory the authentication key is stored in
+
+    This is a calciumcurator directory in the user's runtime directory
+    (XDG_RUNTIME_DIR), or in ~/.calciumcurator if it is not set.
+    """
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, 'calciumcurator')
+    return os.path.join(os.path.expanduser('~'), '.calciumcurator')
+
+
+def _check_private(path: str):
+    # the key must only be readable by its owner
+    if not hasattr(os, 'getuid'):
+        return
+    info = os.stat(path)
+    if info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError(
+            f'{path} must be owned and only accessible by the current user'
+        )
+
+
+def get_authkey() -> bytes:
+    """Get the key used to authenticate the client and the server
+
+    The data server unpickles the requests it receives, so the key must be
+    secret. It is read from the CALCIUMCURATOR_AUTHKEY environment
+    variable if it is set. Otherwise, a random key is generated once and
+    stored in a file only the user can read (see authkey_dir()), which
+    the viewers and the servers of the user share.
+
+    Raises
+    ------
+    PermissionError
+        If the key file or its directory can be accessed by other users.
+    OSError
+        If the key file cannot be created.
+    """
+    env_key = os.environ.get(AUTHKEY_ENV)
+    if env_key:
+        return env_key.encode()
+
+    key_dir = authkey_dir()
+    os.makedirs(key_dir, mode=0o700, exist_ok=True)
+    _check_private(key_dir)
+    key_path = os.path.join(key_dir, AUTHKEY_FILE)
+
+    if not os.path.isfile(key_path):
+        # the key is written to a temporary file and linked into place,
+        # so concurrent processes never read a partially written key
+        temp_path = f'{key_path}.{os.getpid()}.tmp'
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(secrets.token_hex(32))
+            os.link(temp_path, key_path)
+        except FileExistsError:
+            # another process created the key first
+            pass
+        finally:
+            os.remove(temp_path)
+
+    _check_private(key_path)
+    with open(key_path) as f:
+        key = f.read().strip()
+    if not key:
+        raise PermissionError(f'the authentication key {key_path} is empty')
+
+    return key.encode()
+
+
+class DatasetClosedError(LookupError):
+    """The dataset of a request was closed by the DataServer
+
+    The server closes the least recently used datasets to keep the
+    memory within its budget, and their arrays cannot be read anymore.
+    The dataset has to be reopened with DataClient.open_dataset().
+    """
+
+
+def _is_remote(value) -> bool:
+    if isinstance(value, np.generic) or sparse.issparse(value):
+        return False
+    if isinstance(value, np.ndarray) and not isinstance(value, np.memmap):
+        return value.nbytes > REMOTE_ARRAY_BYTES
+    # lazy arrays (dask, h5py datasets, memory maps)
+    return hasattr(value, 'shape') and hasattr(value, 'dtype')
+
+
+class RemoteArray:
+    """Array-like view of an array held by a DataServer
+
+    Indexing sends the index to the server, which reads the data and
+    returns it as a numpy array, so the disk reads, dask graphs and
+    registration run in the server process. Reading the array of a
+    dataset the server has closed raises DatasetClosedError.
+
+    Parameters
+    ----------
+    client : DataClient
+        The client connected to the server.
+    array_id : int
+        The id of the array on the server.
+    shape : Tuple[int, ...]
+        The shape of the array.
+    dtype : np.dtype
+        The dtype of the array.
+    """
+
+    def __init__(
+        self,
+        client: 'DataClient',
+        array_id: int,
+        shape: Tuple[int, ...],
+        dtype: np.dtype,
+    ):
+        self.client = client
+        self.array_id = array_id
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, key) -> np.ndarray:
+        return self.client.read(self.array_id, key)
+
+    def __array__(self, dtype=None) -> np.ndarray:
+        return np.asarray(self[...], dtype=dtype)
+
+    def __repr__(self) -> str:
+        return (
+            f'RemoteArray(id={self.array_id}, shape={self.shape}, '
+            f'dtype={self.dtype})'
+        )
+
+
+class DataServer:
+    """Serve the data of the curation datasets to viewer processes
+
+    The server runs the readers and keeps the opened datasets (and their
+    caches) in memory, so a viewer that reopens a dataset gets it without
+    reading it again. Each client connection is handled in its own thread.
+
+    Parameters
+    ----------
+    address : Tuple[str, int]
+        The (host, port) to listen on.
+    authkey : Optional[bytes]
+        The key clients must authenticate with. If None, get_authkey()
+        is used.
+    max_datasets : int
+        The number of opened datasets kept warm. The least recently
+        opened datasets are closed first, also when the memory held by
+        the datasets exceeds the shared memory budget. The default value
+        is 4.
+    """
+
+    def __init__(
+        self,
+        address: Tuple[str, int] = (DEFAULT_HOST, DEFAULT_PORT),
+        authkey: Optional[bytes] = None,
+        max_datasets: int = 4,
+    ):
+        if authkey is None:
+            authkey = get_authkey()
+        self.address = address
+        self.authkey = authkey
+        self.max_datasets = max_datasets
+
+        self._datasets = LRUCache(
+            'server datasets',
+            max_entries=max_datasets,
+            on_evict=self._close_dataset,
+        )
+        self._dataset_ids = {}
+        self._next_dataset_id = 0
+        self._arrays = {}
+        # array_id: the id of the dataset the array belongs to
+        self._array_datasets = {}
+        self._next_array_id = 0
+        self._lock = threading.Lock()
+        self._shutdown = threading.Event()
+
+    def serve_forever(self):
+        with Listener(self.address, authkey=self.authkey) as listener:
+            while not self._shutdown.is_set():
+                try:
+                    conn = listener.accept()
+                except (AuthenticationError, OSError):
+                    continue
+                threading.Thread(
+                    target=self._handle_connection, args=(conn,), daemon=True
+                ).start()
+
+    def _handle_connection(self, conn: Connection):
+        with conn:
+            while True:
+                try:
+                    op, args = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    op_func = getattr(self, f'_op_{op}', None)
+                    if op_func is None:
+                        raise ValueError(f'unknown request: {op}')
+                    result = op_func(*args)
+                    conn.send(('ok', result))
+                except DatasetClosedError as error:
+                    conn.send(('closed', str(error)))
+                except Exception as error:
+                    conn.send(('error', f'{type(error).__name__}: {error}'))
+
+                if op == 'shutdown':
+                    # unblock accept() so serve_forever can return
+                    try:
+                        Client(self.address, authkey=self.authkey).close()
+                    except OSError:
+                        pass
+                    return
+
+    def _register_array(self, array, dataset_id: int) -> Dict[str, Any]:
+        array_id = self._next_array_id
+        self._next_array_id += 1
+        self._arrays[array_id] = array
+        self._array_datasets[array_id] = dataset_id
+
+        return {
+            'array_id': array_id,
+            'shape': tuple(array.shape),
+            'dtype': np.dtype(array.dtype).str,
+        }
+
+    def _close_dataset(self, dataset_id: int, served: Dict[str, Any]):
+        self._dataset_ids.pop(served['key'], None)
+        # the fields include the temporal proxies computed from the movie
+        for kind, value in served['fields'].values():
+            if kind == 'remote':
+                self._arrays.pop(value['array_id'], None)
+                self._array_datasets.pop(value['array_id'], None)
+        served['dataset'].close()
+
+    def _get_served(self, dataset_id: int) -> Dict[str, Any]:
+        served = self._datasets.get(dataset_id)
+        if served is None:
+            raise DatasetClosedError(
+                f'dataset {dataset_id} was closed, reopen it'
+            )
+        return served
+
+    def _get_array(self, array_id: int):
+        dataset_id = self._array_datasets.get(array_id)
+        if dataset_id is None:
+            raise DatasetClosedError(
+                f'the dataset of array {array_id} was closed, reopen it'
+            )
+        # reading an array marks its dataset as recently used, so the
+        # datasets displayed by viewers are closed last
+        self._get_served(dataset_id)
+        array = self._arrays.get(array_id)
+        if array is None:
+            raise DatasetClosedError(
+                f'the dataset of array {array_id} was closed, reopen it'
+            )
+        return array
+
+    def _op_open(
+        self, pipeline: str, reader_kwargs: Dict[str, Any]
+    ) -> Tuple[int, List[str]]:
+        key = (pipeline, tuple(sorted(reader_kwargs.items())))
+        with self._lock:
+            dataset_id = self._dataset_ids.get(key)
+        if dataset_id is not None and dataset_id in self._datasets:
+            served = self._get_served(dataset_id)
+            return dataset_id, served['dataset'].fields
+
+        # the fields are loaded when clients request them
+        dataset = open_dataset(pipeline, **reader_kwargs)
+        with self._lock:
+            dataset_id = self._next_dataset_id
+            self._next_dataset_id += 1
+            self._dataset_ids[key] = dataset_id
+        served = {'key': key, 'dataset': dataset, 'fields': {}}
+        self._datasets.put(dataset_id, served, nbytes=0)
+
+        return dataset_id, dataset.fields
+
+    def _op_field(self, dataset_id: int, name: str):
+        served = self._get_served(dataset_id)
+        if name in served['fields']:
+            return served['fields'][name]
+
+        value = served['dataset'].get(name)
+        with self._lock:
+            # replace the lazy and large arrays with references
+            if name not in served['fields']:
+                if _is_remote(value):
+                    served['fields'][name] = (
+                        'remote',
+                        self._register_array(value, dataset_id),
+                    )
+                else:
+                    served['fields'][name] = ('value', value)
+
+        # the lazy arrays are not counted in the memory of the dataset
+        loaded = [
+            served['dataset'].get(field)
+            for field in served['dataset'].loaded_fields
+        ]
+        self._datasets.put(dataset_id, served, nbytes=estimate_nbytes(loaded))
+
+        return served['fields'][name]
+
+    def _op_getitem(self, array_id: int, key) -> np.ndarray:
+        data = self._get_array(array_id)[key]
+        if isinstance(data, da.Array):
+            data = data.compute()
+        return np.asarray(data)
+
+    def _op_summary_images(
+        self,
+        array_id: int,
+        cache_path: Optional[str],
+        source_paths: Sequence[str],
+    ) -> Dict[str, np.ndarray]:
+        return load_summary_images(
+            self._get_array(array_id),
+            cache_path=cache_path,
+            source_paths=source_paths,
+        )
+
+    def _op_temporal_proxy(
+        self,
+        array_id: int,
+        bin_size: int,
+        cache_path: Optional[str],
+        source_paths: Sequence[str],
+    ) -> Dict[str, Any]:
+        movie = self._get_array(array_id)
+        dataset_id = self._array_datasets[array_id]
+        # the proxies are fields of the dataset, so they are dropped with
+        # it and a proxy requested again is not registered twice
+        field = ('temporal_proxy', array_id, bin_size)
+        served = self._get_served(dataset_id)
+        if field not in served['fields']:
+            proxy = load_temporal_proxy(
+                movie,
+                bin_size=bin_size,
+                cache_path=cache_path,
+                source_paths=source_paths,
+            )
+            with self._lock:
+                if self._datasets.get(dataset_id) is not served:
+                    raise DatasetClosedError(
+                        f'dataset {dataset_id} was closed, reopen it'
+                    )
+                if field not in served['fields']:
+                    info = self._register_array(proxy.frames, dataset_id)
+                    info['n_frames'] = proxy.n_frames
+                    served['fields'][field] = ('remote', info)
+
+        return served['fields'][field][1]
+
+    def _op_memory_usage(self) -> Dict[str, int]:
+        return get_memory_budget().usage()
+
+    def _op_ping(self) -> bool:
+        return True
+
+    def _op_shutdown(self) -> bool:
+        self._shutdown.set()
+        return True
+
+
+def _send_request(conn: Connection, op: str, args: tuple):
+    conn.send((op, args))
+    status, result = conn.recv()
+    if status == 'closed':
+        raise DatasetClosedError(result)
+    if status == 'error':
+        raise RuntimeError(f'data server error: {result}')
+    return result
+
+
+class DataClient:
+    """Connections from a viewer to a DataServer
+
+    The array reads (RemoteArray indexing, e.g., the frames displayed by
+    the viewer) have their own connection, so they are never queued
+    behind long requests such as the summary images. The other requests
+    take an idle connection from a pool, which is grown when all the
+    connections are busy, so concurrent load stages run in parallel on
+    the server.
+
+    Parameters
+    ----------
+    address : Tuple[str, int]
+        The (host, port) of the server.
+    authkey : Optional[bytes]
+        The key to authenticate with. If None, get_authkey() is used.
+    """
+
+    def __init__(
+        self,
+        address: Tuple[str, int] = (DEFAULT_HOST, DEFAULT_PORT),
+        authkey: Optional[bytes] = None,
+    ):
+        if authkey is None:
+            authkey = get_authkey()
+        self.address = address
+        self._authkey = authkey
+
+        self._read_conn = Client(address, authkey=authkey)
+        self._read_lock = threading.Lock()
+        self._idle = queue.LifoQueue()
+        self._idle.put(Client(address, authkey=authkey))
+
+    def request(self, op: str, *args):
+        """Send a request to the server and wait for its result"""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = Client(self.address, authkey=self._authkey)
+        try:
+            result = _send_request(conn, op, args)
+        except (EOFError, OSError):
+            # the connection is broken, it is not reused
+            conn.close()
+            raise
+        self._idle.put(conn)
+        return result
+
+    def read(self, array_id: int, key) -> np.ndarray:
+        """Read the data of a RemoteArray on the reads connection"""
+        with self._read_lock:
+            return _send_request(self._read_conn, 'getitem', (array_id, key))
+
+    def open_dataset(self, pipeline: str, **reader_kwargs) -> CurationDataset:
+        """Open a dataset with a reader on the server
+
+        Parameters
+        ----------
+        pipeline : str
+            The name of the reader (see calciumcurator.io.readers).
+        **reader_kwargs
+            The keyword arguments passed to the reader.
+
+        Returns
+        -------
+        dataset : CurationDataset
+            The dataset. Each field is loaded on the server and fetched
+            when it is first accessed. The movie and the other lazy or
+            large arrays are RemoteArray.
+        """
+        dataset_id, fields = self.request('open', pipeline, reader_kwargs)
+        stages = {
+            name: Stage(partial(self.get_field, dataset_id, name))
+            for name in fields
+        }
+
+        return CurationDataset(stages, name=pipeline)
+
+    def get_field(self, dataset_id: int, name: str) -> Any:
+        """Get a field of a dataset opened on the server"""
+        kind, value = self.request('field', dataset_id, name)
+        if kind == 'remote':
+            return RemoteArray(
+                self,
+                value['array_id'],
+                shape=value['shape'],
+                dtype=value['dtype'],
+            )
+        return value
+
+    def summary_images(
+        self,
+        movie: RemoteArray,
+        cache_path: Optional[str] = None,
+        source_paths: Sequence[str] = (),
+    ) -> Dict[str, np.ndarray]:
+        """Compute (or load the cached) summary images on the server"""
+        return self.request(
+            'summary_images', movie.array_id, cache_path, list(source_paths)
+        )
+
+    def temporal_proxy(
+        self,
+        movie: RemoteArray,
+        bin_size: int,
+        cache_path: Optional[str] = None,
+        source_paths: Sequence[str] = (),
+    ) -> TemporalProxy:
+        """Compute (or load the cached) temporal proxy on the server
+
+        The binned frames stay on the server and are read with a
+        RemoteArray.
+        """
+        served = self.request(
+            'temporal_proxy',
+            movie.array_id,
+            bin_size,
+            cache_path,
+            list(source_paths),
+        )
+        frames = RemoteArray(
+            self,
+            served['array_id'],
+            shape=served['shape'],
+            dtype=served['dtype'],
+        )
+
+        return TemporalProxy(frames, bin_size, served['n_frames'])
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Get the memory used by each cache of the server in bytes"""
+        return self.request('memory_usage')
+
+    def shutdown_server(self):
+        self.request('shutdown')
+
+    def close(self):
+        with self._read_lock:
+            self._read_conn.close()
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def connect(
+    address: Tuple[str, int] = (DEFAULT_HOST, DEFAULT_PORT),
+    authkey: Optional[bytes] = None,
+    start: bool = True,
+    timeout: float = 30,
+    memory_budget: Optional[str] = None,
+) -> DataClient:
+    """Connect to a data server, starting one if none is running
+
+    A started server runs in its own process and keeps running after the
+    viewer closes, so the next viewer launch finds the datasets warm.
+
+    Parameters
+    ----------
+    address : Tuple[str, int]
+        The (host, port) of the server.
+    authkey : Optional[bytes]
+        The key to authenticate with. If None, get_authkey() is used.
+    start : bool
+        If True, a server is started if none is running.
+    timeout : float
+        The time in seconds to wait for a started server.
+    memory_budget : Optional[str]
+        The memory budget of the caches of a started server, e.g., '8G'.
+        If None, the default budget (see
+        calciumcurator.memory.default_memory_budget()) is used.
+
+    Returns
+    -------
+    client : DataClient
+        The connected client.
+    """
+    try:
+        return DataClient(address, authkey=authkey)
+    except ConnectionRefusedError:
+        if not start:
+            raise
+
+    host, port = address
+    command = [
+        sys.executable,
+        '-m',
+        'calciumcurator.io.server',
+        '--host',
+        host,
+        '--port',
+        str(port),
+    ]
+    if memory_budget is not None:
+        command += ['--memory-budget', str(memory_budget)]
+    subprocess.Popen(
+        command,
+        start_new_session=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return DataClient(address, authkey=authkey)
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def serve():
+    parser = argparse.ArgumentParser(description="calciumcurator-server")
+    parser.add_argument("--host", default=DEFAULT_HOST, type=str)
+    parser.add_argument("--port", default=DEFAULT_PORT, type=int)
+    parser.add_argument("--max-datasets", default=4, type=int)
+    parser.add_argument(
+        "--memory-budget",
+        default=None,
+        type=str,
+        help="memory budget of the caches, e.g. 8G",
+    )
+    args = parser.parse_args()
+
+    if args.memory_budget is not None:
+        set_memory_budget(args.memory_budget)
+
+    server = DataServer(
+        address=(args.host, args.port), max_datasets=args.max_datasets
+    )
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    serve()
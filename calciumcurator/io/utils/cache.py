@@ -0,0 +1,50 @@
+import os
+from typing import Sequence
+
+
+def sidecar_path(source_path: str, suffix: str, ext: str = '.npy') -> str:
+    """Get the path of a cache file stored next to a source file.
+
+    Parameters
+    ----------
+    source_path : str
+        The path to the file the cached values are derived from.
+    suffix : str
+        The suffix appended to the base name of the source file.
+    ext : str
+        The file extension of the cache file. The default value is '.npy'.
+
+    Returns
+    -------
+    cache_path : str
+        The path to the cache file. For example, the 'snr' sidecar of
+        'suite2p/plane0/F.npy' is 'suite2p/plane0/F_snr.npy'.
+    """
+    base = os.path.splitext(source_path)[0]
+    return f'{base}_{suffix}{ext}'
+
+
+def is_cache_valid(cache_path: str, source_paths: Sequence[str]) -> bool:
+    """Check if a cache file exists and is newer than all of its sources.
+
+    Parameters
+    ----------
+    cache_path : str
+        The path to the cache file.
+    source_paths : Sequence[str]
+        The paths to the files the cache was computed from. Sources that
+        do not exist are ignored.
+
+    Returns
+    -------
+    valid : bool
+        True if the cache can be used in place of recomputing from the sources.
+    """
+    if not os.path.isfile(cache_path):
+        return False
+    cache_mtime = os.path.getmtime(cache_path)
+    for source_path in source_paths:
+        if os.path.isfile(source_path):
+            if os.path.getmtime(source_path) > cache_mtime:
+                return False
+    return True
@@ -0,0 +1,142 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import os
+from typing import Any, Callable, Iterator, Optional, Tuple
+
+import dask.array as da
+import numpy as np
+
+from .hdf5 import disk_chunk_frames
+
+
+# the default target size of a block of frames read at once
+DEFAULT_BLOCK_BYTES = 64 * 1024 ** 2
+
+
+def read_frames(movie, start: int, stop: int) -> np.ndarray:
+    """Read a range of frames from a lazy or in-memory movie into memory
+
+    Dask arrays are computed with the synchronous scheduler so that the
+    read can be run from a worker thread without oversubscribing threads.
+
+    Parameters
+    ----------
+    movie : array-like
+        The (n_frames, ...) movie (np.ndarray, np.memmap or da.Array).
+    start : int
+        The index of the first frame to read.
+    stop : int
+        The index after the last frame to read.
+
+    Returns
+    -------
+    frames : np.ndarray
+        The (stop - start, ...) frames.
+    """
+    frames = movie[start:stop]
+    if isinstance(frames, da.Array):
+        frames = frames.compute(scheduler='synchronous')
+    return np.asarray(frames)
+
+
+def choose_block_size(
+    movie, target_nbytes: int = DEFAULT_BLOCK_BYTES, max_frames: int = 10000
+) -> int:
+    """Choose how many frames to read at once when streaming a movie
+
+    The block size is the largest multiple of the dask chunk size along
+    time (1 for other arrays) that fits in target_nbytes, so that blocks
+    never split a chunk. Blocks of HDF5 movies are also multiples of the
+    on-disk chunks (see calciumcurator.io.utils.hdf5.disk_chunk_frames()),
+    so each chunk is decompressed by a single block.
+
+    Parameters
+    ----------
+    movie : array-like
+        The (n_frames, ...) movie.
+    target_nbytes : int
+        The target size of a block in bytes.
+    max_frames : int
+        The maximum number of frames in a block.
+
+    Returns
+    -------
+    block_size : int
+        The number of frames per block.
+    """
+    frame_nbytes = (
+        int(np.prod(movie.shape[1:])) * np.dtype(movie.dtype).itemsize
+    )
+    if isinstance(movie, da.Array):
+        chunk_frames = int(
+            np.lcm(max(movie.chunks[0]), disk_chunk_frames(movie))
+        )
+    else:
+        chunk_frames = 1
+
+    n_chunks = max(target_nbytes // max(frame_nbytes * chunk_frames, 1), 1)
+    n_chunks = min(n_chunks, max(max_frames // chunk_frames, 1))
+    block_size = n_chunks * chunk_frames
+
+    return int(min(block_size, movie.shape[0]))
+
+
+def iter_frame_blocks(
+    n_frames: int, block_size: int
+) -> Iterator[Tuple[int, int]]:
+    """Iterate over (start, stop) frame ranges that cover a movie"""
+    for start in range(0, n_frames, block_size):
+        yield start, min(start + block_size, n_frames)
+
+
+def map_frame_blocks(
+    movie,
+    func: Callable[[np.ndarray, int, int], Any],
+    block_size: Optional[int] = None,
+    n_workers: Optional[int] = None,
+) -> Iterator[Tuple[int, int, Any]]:
+    """Apply a function to blocks of frames in parallel with bounded memory
+
+    At most 2 * n_workers blocks are read or processed at any time and
+    the results are yielded as they complete (not necessarily in order).
+
+    Parameters
+    ----------
+    movie : array-like
+        The (n_frames, ...) movie.
+    func : Callable[[np.ndarray, int, int], Any]
+        The function applied to each block. It is called as
+        func(frames, start, stop).
+    block_size : Optional[int]
+        The number of frames per block. If None, it is chosen with
+        choose_block_size().
+    n_workers : Optional[int]
+        The number of worker threads. If None, the number of CPUs is used.
+
+    Yields
+    ------
+    start : int
+        The index of the first frame of the block.
+    stop : int
+        The index after the last frame of the block.
+    result : Any
+        The output of func for the block.
+    """
+    if block_size is None:
+        block_size = choose_block_size(movie)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    def _process_block(start, stop):
+        return start, stop, func(read_frames(movie, start, stop), start, stop)
+
+    blocks = iter_frame_blocks(movie.shape[0], block_size)
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        pending = set()
+        for start, stop in blocks:
+            pending.add(executor.submit(_process_block, start, stop))
+            if len(pending) >= 2 * n_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in pending:
+            yield future.result()
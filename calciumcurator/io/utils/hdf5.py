@@ -0,0 +1,290 @@
+import math
+import os
+from typing import Optional, Tuple
+import weakref
+
+import dask.array as da
+import h5py
+import numpy as np
+
+from ...memory import get_memory_budget
+
+
+# the default maximum size of the HDF5 raw chunk cache
+DEFAULT_CHUNK_CACHE_BYTES = 256 * 1024 ** 2
+
+# the HDF5 default, used when the cache does not need to hold full chunks
+MIN_CHUNK_CACHE_BYTES = 1024 ** 2
+
+# the open HDF5 movies, keyed by the name of their dask arrays
+_open_movies = weakref.WeakValueDictionary()
+
+
+def _next_prime(n: int) -> int:
+    """Get the smallest prime number that is >= n"""
+
+    def _is_prime(k):
+        if k < 2:
+            return False
+        for divisor in range(2, int(math.sqrt(k)) + 1):
+            if k % divisor == 0:
+                return False
+        return True
+
+    while not _is_prime(n):
+        n += 1
+    return n
+
+
+def get_hdf5_layout(dataset: h5py.Dataset) -> dict:
+    """Describe how a dataset is stored on disk
+
+    Parameters
+    ----------
+    dataset : h5py.Dataset
+        The dataset to inspect.
+
+    Returns
+    -------
+    layout : dict
+        The storage layout with keys 'shape', 'dtype', 'chunks' (None for
+        contiguous datasets), 'compression', 'compression_opts' and 'shuffle'.
+    """
+    return {
+        'shape': dataset.shape,
+        'dtype': dataset.dtype,
+        'chunks': dataset.chunks,
+        'compression': dataset.compression,
+        'compression_opts': dataset.compression_opts,
+        'shuffle': dataset.shuffle,
+    }
+
+
+def chunk_cache_settings(
+    layout: dict, memory_budget: int = DEFAULT_CHUNK_CACHE_BYTES
+) -> Tuple[int, int]:
+    """Size the raw chunk cache so each on-disk chunk is decompressed once
+
+    Reading a full frame touches every chunk that spans the frame's time
+    index. The cache is sized to hold all of those chunks so that reading
+    the following frames (which are in the same chunks) hits the cache.
+    HDF5 bypasses the cache for chunks larger than the cache, so the cache
+    is always at least one chunk if the budget allows it.
+
+    Parameters
+    ----------
+    layout : dict
+        The storage layout returned by get_hdf5_layout().
+    memory_budget : int
+        The maximum size of the cache in bytes.
+
+    Returns
+    -------
+    rdcc_nbytes : int
+        The size of the raw chunk cache in bytes.
+    rdcc_nslots : int
+        The number of hash table slots in the cache.
+    """
+    chunks = layout['chunks']
+    if chunks is None:
+        return MIN_CHUNK_CACHE_BYTES, 521
+
+    chunk_nbytes = int(np.prod(chunks)) * layout['dtype'].itemsize
+    n_chunks_per_frame = int(
+        np.prod(
+            [
+                math.ceil(size / chunk_size)
+                for size, chunk_size in zip(layout['shape'][1:], chunks[1:])
+            ]
+        )
+    )
+    frame_chunks_nbytes = n_chunks_per_frame * chunk_nbytes
+    rdcc_nbytes = int(
+        min(max(frame_chunks_nbytes, MIN_CHUNK_CACHE_BYTES), memory_budget)
+    )
+
+    # hdf5 recommends a prime number of slots ~100x the chunks in the cache
+    n_cached_chunks = max(rdcc_nbytes // chunk_nbytes, 1)
+    rdcc_nslots = _next_prime(max(100 * n_cached_chunks, 521))
+
+    return rdcc_nbytes, rdcc_nslots
+
+
+def open_hdf5_movie(
+    filename: str,
+    dataset_name: str,
+    memory_budget: Optional[int] = None,
+    frames_per_chunk: int = 1,
+) -> da.Array:
+    """Lazily open a movie stored in an HDF5 dataset
+
+    The dask chunks are single full frames, so displaying a frame reads
+    only that frame. The raw chunk cache is sized with
+    chunk_cache_settings() and prefers evicting fully read chunks, so
+    sequential playback decompresses each on-disk chunk exactly once.
+    Streaming passes read blocks aligned to the on-disk chunks (see
+    disk_chunk_frames()). The cache is reserved
+    in the shared memory budget (see calciumcurator.memory) until the
+    file is closed with close_hdf5_movie() or the movie is garbage
+    collected.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the HDF5 file.
+    dataset_name : str
+        The path to the movie dataset in the file.
+    memory_budget : Optional[int]
+        The maximum size of the raw chunk cache in bytes. If None, the
+        default size is used, limited to a quarter of the memory left in
+        the shared budget.
+    frames_per_chunk : int
+        The number of frames per dask chunk. The default value is 1.
+
+    Returns
+    -------
+    movie : da.Array
+        The (n_frames, ...) movie.
+    """
+    with h5py.File(filename, "r") as f:
+        layout = get_hdf5_layout(f[dataset_name])
+    budget = get_memory_budget()
+    if memory_budget is None:
+        memory_budget = min(
+            DEFAULT_CHUNK_CACHE_BYTES,
+            max(budget.nbytes_available // 4, MIN_CHUNK_CACHE_BYTES),
+        )
+    rdcc_nbytes, rdcc_nslots = chunk_cache_settings(
+        layout, memory_budget=memory_budget
+    )
+    hdf5_movie = HDF5Movie(
+        filename,
+        dataset_name,
+        rdcc_nbytes=rdcc_nbytes,
+        rdcc_nslots=rdcc_nslots,
+        budget=budget,
+    )
+
+    chunks = (frames_per_chunk,) + hdf5_movie.shape[1:]
+
+    # the file stays open as long as the dask graph is used
+    movie = da.from_array(hdf5_movie, chunks=chunks)
+    _open_movies[movie.name] = hdf5_movie
+
+    return movie
+
+
+def disk_chunk_frames(movie) -> int:
+    """Get the number of frames per on-disk chunk of an HDF5 movie
+
+    Parameters
+    ----------
+    movie : array-like
+        A movie returned by open_hdf5_movie() or a dask array computed
+        from one (e.g., the registered movie).
+
+    Returns
+    -------
+    chunk_frames : int
+        The number of frames per on-disk chunk, or 1 for contiguous
+        datasets and movies that are not read from HDF5.
+    """
+    layers = getattr(getattr(movie, 'dask', None), 'layers', {})
+    for name in layers:
+        hdf5_movie = _open_movies.get(name)
+        if hdf5_movie is not None:
+            return hdf5_movie.chunk_frames
+    return 1
+
+
+def close_hdf5_movie(movie):
+    """Close the file of a movie opened by open_hdf5_movie()
+
+    The chunk cache reservation is released. Movies that are not open
+    HDF5 movies (e.g., memory mapped movies) are ignored, so readers can
+    close their movies whatever their format.
+
+    Parameters
+    ----------
+    movie : array-like
+        The movie returned by open_hdf5_movie().
+    """
+    hdf5_movie = _open_movies.pop(getattr(movie, 'name', None), None)
+    if hdf5_movie is not None:
+        hdf5_movie.close()
+
+
+class HDF5Movie:
+    """A movie dataset of an HDF5 file opened with a reserved chunk cache
+
+    The raw chunk cache is reserved in the memory budget while the file is
+    open. The file is closed and the reservation is released by close(),
+    or when the movie is garbage collected.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the HDF5 file.
+    dataset_name : str
+        The path to the movie dataset in the file.
+    rdcc_nbytes : int
+        The size of the raw chunk cache in bytes.
+    rdcc_nslots : int
+        The number of hash table slots in the cache.
+    budget : calciumcurator.memory.MemoryBudget
+        The budget the cache is reserved in.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        dataset_name: str,
+        rdcc_nbytes: int,
+        rdcc_nslots: int,
+        budget,
+    ):
+        # movies of files with the same name (e.g., the data.h5 of several
+        # sessions) and the same file opened twice are reserved separately
+        reservation_name = (
+            f'hdf5 chunk cache ({os.path.abspath(filename)}, {id(self)})'
+        )
+        budget.reserve(reservation_name, rdcc_nbytes)
+        try:
+            self._file = h5py.File(
+                filename,
+                "r",
+                rdcc_nbytes=rdcc_nbytes,
+                rdcc_nslots=rdcc_nslots,
+                rdcc_w0=1.0,
+            )
+        except BaseException:
+            budget.release(reservation_name)
+            raise
+        self._dataset = self._file[dataset_name]
+        self.shape = tuple(self._dataset.shape)
+        self.dtype = self._dataset.dtype
+        if self._dataset.chunks is None:
+            self.chunk_frames = 1
+        else:
+            self.chunk_frames = self._dataset.chunks[0]
+        self._finalizer = weakref.finalize(
+            self, _close_file, self._file, budget, reservation_name
+        )
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, key) -> np.ndarray:
+        return self._dataset[key]
+
+    def close(self):
+        self._finalizer()
+
+
+def _close_file(f: h5py.File, budget, reservation_name: str):
+    f.close()
+    budget.release(reservation_name)
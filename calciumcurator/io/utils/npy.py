@@ -0,0 +1,56 @@
+from typing import Optional
+
+import numpy as np
+
+from ...memory import MemoryBudget, get_memory_budget
+
+
+def read_npy_header(path: str):
+    """Read the shape, dtype and order of a .npy file without loading it
+
+    Returns
+    -------
+    shape : tuple
+        The shape of the array.
+    fortran_order : bool
+        True if the array is stored in Fortran order.
+    dtype : np.dtype
+        The dtype of the array.
+    """
+    with open(path, 'rb') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            return np.lib.format.read_array_header_1_0(f)
+        return np.lib.format.read_array_header_2_0(f)
+
+
+def load_npy(
+    path: str,
+    allow_pickle: bool = False,
+    budget: Optional[MemoryBudget] = None,
+) -> np.ndarray:
+    """Load a .npy file in memory if it fits the budget, else memory map it
+
+    Parameters
+    ----------
+    path : str
+        The path to the .npy file.
+    allow_pickle : bool
+        Allow loading object arrays, which are always loaded in memory.
+        The default value is False.
+    budget : Optional[MemoryBudget]
+        The memory budget to check. If None, the shared budget is used.
+
+    Returns
+    -------
+    array : np.ndarray
+        The array, or a read-only np.memmap if it is too large.
+    """
+    if budget is None:
+        budget = get_memory_budget()
+    shape, _, dtype = read_npy_header(path)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+
+    if dtype.hasobject or budget.fits_in_memory(nbytes):
+        return np.load(path, allow_pickle=allow_pickle)
+    return np.load(path, mmap_mode='r')
@@ -0,0 +1,274 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+from typing import Optional, Tuple
+
+import dask.array as da
+import numpy as np
+import tifffile
+
+from ...memory import LRUCache
+
+
+# the tifffile compression code of uncompressed pages
+COMPRESSION_NONE = 1
+
+# the file extensions of the movies opened with open_tiff_movie()
+TIFF_EXTENSIONS = ('.tif', '.tiff', '.btf', '.tf8')
+
+
+def _c_strides(shape: Tuple[int, ...], itemsize: int) -> Tuple[int, ...]:
+    strides = [itemsize]
+    for size in shape[:0:-1]:
+        strides.insert(0, strides[0] * size)
+    return tuple(strides)
+
+
+def _page_data_offsets(series) -> Optional[np.ndarray]:
+    """Get the offset of the data of each page of an uncompressed series
+
+    Returns
+    -------
+    offsets : Optional[np.ndarray]
+        (n_pages,) array of the file offsets of the page data, or None if
+        the pages are compressed, tiled or not stored as a single run of
+        bytes.
+    """
+    keyframe = series.keyframe
+    if (
+        keyframe.compression != COMPRESSION_NONE
+        or keyframe.is_tiled
+        or keyframe.predictor not in (None, 1)
+        or keyframe.fillorder != 1
+    ):
+        return None
+
+    page_nbytes = int(np.prod(keyframe.shape)) * keyframe.dtype.itemsize
+    offsets = np.empty(len(series.pages), dtype=np.int64)
+    for page_index, page in enumerate(series.pages):
+        if page is None:
+            return None
+        data_offsets = np.asarray(page.dataoffsets, dtype=np.int64)
+        byte_counts = np.asarray(page.databytecounts, dtype=np.int64)
+        ends = data_offsets + byte_counts
+        if np.any(data_offsets[1:] != ends[:-1]):
+            return None
+        if byte_counts.sum() != page_nbytes:
+            return None
+        offsets[page_index] = data_offsets[0]
+
+    return offsets
+
+
+def _strided_page_view(
+    filename: str, series, byteorder: str
+) -> Optional[np.ndarray]:
+    """View the pages of a series as one strided memory map
+
+    The pages of ScanImage and other files written frame by frame are
+    separated by their metadata, so the file is not a contiguous array,
+    but the page data are evenly spaced. They are viewed in place with a
+    stride along the first axis.
+
+    Returns
+    -------
+    movie : Optional[np.ndarray]
+        The series as a read-only view of the memory mapped file, or
+        None if the pages are not uncompressed and evenly spaced.
+    """
+    offsets = _page_data_offsets(series)
+    if offsets is None or len(offsets) == 0:
+        return None
+    page_strides = np.diff(offsets)
+    if len(page_strides) > 0 and np.any(page_strides != page_strides[0]):
+        return None
+
+    page_shape = tuple(series.keyframe.shape)
+    dtype = np.dtype(series.dtype).newbyteorder(byteorder)
+    if len(page_strides) > 0:
+        page_stride = int(page_strides[0])
+    else:
+        page_stride = int(np.prod(page_shape)) * dtype.itemsize
+
+    file_map = np.memmap(filename, dtype=np.uint8, mode='r')
+    pages = np.ndarray(
+        shape=(len(offsets),) + page_shape,
+        dtype=dtype,
+        buffer=file_map,
+        offset=int(offsets[0]),
+        strides=(page_stride,) + _c_strides(page_shape, dtype.itemsize),
+    )
+    pages.flags.writeable = False
+
+    # splitting the page axis into the series axes keeps the view
+    return pages.reshape(series.shape)
+
+
+class TiffPageArray:
+    """Array-like access to the frames of a TIFF series decoded on demand
+
+    The pages of the requested frames are decoded in parallel and the
+    decoded pages are kept in an LRU cache that counts against the shared
+    memory budget (see calciumcurator.memory). Indexing the first axis
+    with an integer, a slice or an array of indices decodes only the
+    pages of those frames.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the TIFF file.
+    series_index : int
+        The index of the image series in the file. The default value is 0.
+    n_workers : Optional[int]
+        The number of decoding threads. If None, the number of CPUs
+        is used.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        series_index: int = 0,
+        n_workers: Optional[int] = None,
+    ):
+        self.filename = filename
+        self._tif = tifffile.TiffFile(filename)
+        # the pages are read under the file lock and decoded concurrently
+        self._tif.filehandle.lock = True
+        self._series = self._tif.series[series_index]
+        self.shape = tuple(self._series.shape)
+        self.dtype = np.dtype(self._series.dtype)
+
+        page_size = int(np.prod(self._series.keyframe.shape))
+        self._pages_per_frame = max(
+            int(np.prod(self.shape[1:])) // page_size, 1
+        )
+
+        self._pages_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=n_workers)
+        self._cache = LRUCache(f'tiff pages ({os.path.basename(filename)})')
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def _read_page(self, page_index: int) -> np.ndarray:
+        page_data = self._cache.get(page_index)
+        if page_data is None:
+            # parsing the page metadata moves the file position
+            with self._pages_lock:
+                page = self._series.pages[page_index]
+            page_data = page.asarray(maxworkers=1)
+            self._cache.put(page_index, page_data)
+        return page_data
+
+    def read_frames(self, frame_indices) -> np.ndarray:
+        """Decode frames in parallel
+
+        Parameters
+        ----------
+        frame_indices : Sequence[int]
+            The indices of the frames.
+
+        Returns
+        -------
+        frames : np.ndarray
+            (len(frame_indices), ...) array of the frames.
+        """
+        frame_indices = np.asarray(frame_indices, dtype=int)
+        page_indices = (
+            frame_indices[:, np.newaxis] * self._pages_per_frame
+            + np.arange(self._pages_per_frame)
+        ).ravel()
+        frames = np.empty(
+            (len(page_indices),) + tuple(self._series.keyframe.shape),
+            dtype=self.dtype,
+        )
+        for index, page_data in enumerate(
+            self._executor.map(self._read_page, page_indices)
+        ):
+            frames[index] = page_data
+
+        return frames.reshape((len(frame_indices),) + self.shape[1:])
+
+    def __getitem__(self, key) -> np.ndarray:
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) == 0:
+            key = (slice(None),)
+        frame_key, other_key = key[0], key[1:]
+
+        frame_indices = np.arange(self.shape[0])[frame_key]
+        frames = self.read_frames(np.atleast_1d(frame_indices))
+        if np.ndim(frame_indices) == 0:
+            frames = frames[0]
+        else:
+            other_key = (slice(None),) + other_key
+
+        return frames[other_key]
+
+    def __array__(self, dtype=None) -> np.ndarray:
+        frames = self[:]
+        if dtype is not None:
+            frames = frames.astype(dtype)
+        return frames
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self._tif.close()
+
+
+def open_tiff_movie(
+    filename: str,
+    series_index: int = 0,
+    frames_per_chunk: int = 1,
+    n_workers: Optional[int] = None,
+):
+    """Open a multi-page TIFF, BigTIFF or ScanImage movie
+
+    Uncompressed movies are memory mapped, so reading frames is zero-copy:
+    contiguous files with tifffile.memmap() and files whose pages are
+    separated by metadata (e.g., ScanImage) with a strided view of the
+    evenly spaced pages. Other movies are decoded on demand by a
+    TiffPageArray wrapped in a dask array.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the TIFF file.
+    series_index : int
+        The index of the image series in the file. The default value is 0.
+    frames_per_chunk : int
+        The number of frames per dask chunk of decoded movies.
+        The default value is 1.
+    n_workers : Optional[int]
+        The number of decoding threads of decoded movies. If None, the
+        number of CPUs is used.
+
+    Returns
+    -------
+    movie : Union[np.ndarray, da.Array]
+        The (n_frames, ...) movie, a read-only view of the memory mapped
+        file or a lazily decoded dask array.
+    """
+    try:
+        return tifffile.memmap(filename, series=series_index, mode='r')
+    except ValueError:
+        # the pages are compressed or not contiguous
+        pass
+
+    with tifffile.TiffFile(filename) as tif:
+        movie = _strided_page_view(
+            filename, tif.series[series_index], tif.byteorder
+        )
+    if movie is not None:
+        return movie
+
+    pages = TiffPageArray(
+        filename, series_index=series_index, n_workers=n_workers
+    )
+    chunks = (frames_per_chunk,) + pages.shape[1:]
+
+    return da.from_array(pages, chunks=chunks)
@@ -0,0 +1,434 @@
+from collections import OrderedDict
+import itertools
+import os
+import re
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Union
+import weakref
+
+import numpy as np
+
+
+# the environment variable that sets the default memory budget
+MEMORY_BUDGET_ENV = 'CALCIUMCURATOR_MEMORY_BUDGET'
+
+# the budget used when the physical memory cannot be determined
+FALLBACK_MEMORY_BUDGET = 4 * 1024 ** 3
+
+# the fraction of the physical memory used by default
+DEFAULT_MEMORY_FRACTION = 0.5
+
+_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+# the access order of the entries of all caches, used to evict the least
+# recently used entries across caches
+_access_counter = itertools.count()
+
+
+def parse_nbytes(nbytes: Union[int, str]) -> int:
+    """Parse a memory size such as 8589934592, '8G', '512MB' or '1.5 GiB'
+
+    Parameters
+    ----------
+    nbytes : Union[int, str]
+        The size in bytes or a number with a K, M, G or T (binary) unit.
+
+    Returns
+    -------
+    nbytes : int
+        The size in bytes.
+    """
+    if isinstance(nbytes, (int, np.integer)):
+        return int(nbytes)
+
+    match = re.fullmatch(
+        r'\s*([0-9]*\.?[0-9]+)\s*([KMGT]?)(i?B)?\s*', nbytes, re.IGNORECASE
+    )
+    if match is None:
+        raise ValueError(f'{nbytes} is not a recognized memory size')
+    value, unit, _ = match.groups()
+
+    return int(float(value) * _UNITS[unit.upper()])
+
+
+def format_nbytes(nbytes: int) -> str:
+    """Format a memory size with a binary unit (e.g., '1.5 GiB')"""
+    for unit in ['T', 'G', 'M', 'K']:
+        if abs(nbytes) >= _UNITS[unit]:
+            return f'{nbytes / _UNITS[unit]:.1f} {unit}iB'
+    return f'{nbytes} B'
+
+
+def physical_memory() -> Optional[int]:
+    """Get the physical memory of the machine in bytes, None if unknown"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def default_memory_budget() -> int:
+    """Get the default memory budget in bytes
+
+    The budget is read from the CALCIUMCURATOR_MEMORY_BUDGET environment
+    variable if it is set, otherwise it is half of the physical memory.
+    """
+    env_budget = os.environ.get(MEMORY_BUDGET_ENV)
+    if env_budget:
+        return parse_nbytes(env_budget)
+
+    total_memory = physical_memory()
+    if total_memory is None:
+        return FALLBACK_MEMORY_BUDGET
+    return int(total_memory * DEFAULT_MEMORY_FRACTION)
+
+
+def estimate_nbytes(value: Any) -> int:
+    """Estimate the memory held by a value
+
+    Only in-memory numpy arrays are counted, so memory maps and lazy
+    (dask, h5py) arrays are 0. Lists, tuples and dicts are summed.
+    """
+    if isinstance(value, np.memmap):
+        return 0
+    elif isinstance(value, np.ndarray):
+        # views do not own their memory
+        if value.base is not None and isinstance(value.base, np.memmap):
+            return 0
+        return value.nbytes
+    elif isinstance(value, (list, tuple)):
+        return sum(estimate_nbytes(item) for item in value)
+    elif isinstance(value, dict):
+        return sum(estimate_nbytes(item) for item in value.values())
+    return 0
+
+
+class LRUCache:
+    """A least recently used cache whose entries count against a budget
+
+    When an entry is added, the least recently used entries of all the
+    caches registered with the budget are evicted until the entry fits.
+
+    Parameters
+    ----------
+    name : str
+        The name of the cache in the memory usage reports.
+    budget : Optional[MemoryBudget]
+        The budget the cache registers with. If None, the global budget
+        returned by get_memory_budget() is used.
+    max_entries : Optional[int]
+        The maximum number of entries, independently of their size.
+        If None, the number of entries is not limited.
+    on_evict : Optional[Callable[[Hashable, Any], None]]
+        Called with the key and the value of each evicted entry.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        budget: Optional['MemoryBudget'] = None,
+        max_entries: Optional[int] = None,
+        on_evict: Optional[Callable[[Hashable, Any], None]] = None,
+    ):
+        if budget is None:
+            budget = get_memory_budget()
+        self.name = name
+        self.budget = budget
+        self.max_entries = max_entries
+        self.on_evict = on_evict
+
+        # key: (value, nbytes, last access)
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.RLock()
+        budget.register(self)
+
+    @property
+    def nbytes(self) -> int:
+        """The memory used by the entries in bytes"""
+        return self._nbytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get an entry and mark it as the most recently used"""
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value, nbytes, _ = self._entries.pop(key)
+            self._entries[key] = (value, nbytes, next(_access_counter))
+
+        return value
+
+    def put(
+        self, key: Hashable, value: Any, nbytes: Optional[int] = None
+    ) -> bool:
+        """Add an entry, evicting least recently used entries to fit it
+
+        Parameters
+        ----------
+        key : Hashable
+            The key of the entry.
+        value : Any
+            The value of the entry.
+        nbytes : Optional[int]
+            The memory used by the value. If None, it is estimated with
+            estimate_nbytes().
+
+        Returns
+        -------
+        cached : bool
+            False if the value is larger than the budget and was not added.
+        """
+        if nbytes is None:
+            nbytes = estimate_nbytes(value)
+        self.pop(key)
+        if nbytes > self.budget.nbytes:
+            return False
+
+        # the lock of this cache is not held while evicting, since the
+        # budget locks the other caches
+        self.budget.make_room(nbytes)
+
+        evicted = []
+        with self._lock:
+            self._entries[key] = (value, nbytes, next(_access_counter))
+            self._nbytes += nbytes
+            if self.max_entries is not None:
+                while len(self._entries) > self.max_entries:
+                    evicted.append(self._pop_oldest())
+        self._notify_evicted(evicted)
+
+        return True
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove an entry and return its value"""
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value, nbytes, _ = self._entries.pop(key)
+            self._nbytes -= nbytes
+
+        return value
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def oldest_access(self) -> Optional[int]:
+        """The access order of the least recently used entry"""
+        with self._lock:
+            if len(self._entries) == 0:
+                return None
+            _, _, last_access = next(iter(self._entries.values()))
+
+        return last_access
+
+    def evict_oldest(self) -> int:
+        """Evict the least recently used entry
+
+        Returns
+        -------
+        nbytes : int
+            The memory freed in bytes.
+        """
+        with self._lock:
+            if len(self._entries) == 0:
+                return 0
+            key, value, nbytes = self._pop_oldest()
+        self._notify_evicted([(key, value, nbytes)])
+
+        return nbytes
+
+    def _pop_oldest(self):
+        key, (value, nbytes, _) = self._entries.popitem(last=False)
+        self._nbytes -= nbytes
+        return key, value, nbytes
+
+    def _notify_evicted(self, evicted: list):
+        if self.on_evict is None:
+            return
+        for key, value, _ in evicted:
+            self.on_evict(key, value)
+
+
+class MemoryBudget:
+    """A memory limit shared by the caches of a process
+
+    The caches register with the budget and their least recently used
+    entries are evicted when a new entry would exceed it. Memory that is
+    not held by a cache (e.g., the HDF5 chunk caches) can be reserved
+    so that it is counted and reported.
+
+    Parameters
+    ----------
+    nbytes : Optional[Union[int, str]]
+        The budget in bytes or as a string such as '8G'. If None,
+        default_memory_budget() is used.
+    """
+
+    def __init__(self, nbytes: Optional[Union[int, str]] = None):
+        if nbytes is None:
+            nbytes = default_memory_budget()
+        self.nbytes = parse_nbytes(nbytes)
+
+        self._caches = weakref.WeakSet()
+        self._reserved = {}
+        self._lock = threading.RLock()
+
+    def register(self, cache: LRUCache):
+        """Count the entries of a cache against the budget"""
+        with self._lock:
+            self._caches.add(cache)
+
+    def unregister(self, cache: LRUCache):
+        with self._lock:
+            self._caches.discard(cache)
+
+    def reserve(self, name: str, nbytes: int):
+        """Reserve memory that is not held by a cache
+
+        Reserving the same name again replaces the previous reservation.
+        """
+        with self._lock:
+            self._reserved[name] = int(nbytes)
+
+    def release(self, name: str):
+        """Release a reservation made with reserve()"""
+        with self._lock:
+            self._reserved.pop(name, None)
+
+    @property
+    def nbytes_used(self) -> int:
+        """The memory used by the caches and the reservations in bytes"""
+        with self._lock:
+            caches = list(self._caches)
+            reserved = sum(self._reserved.values())
+        return reserved + sum(cache.nbytes for cache in caches)
+
+    @property
+    def nbytes_available(self) -> int:
+        """The memory left in the budget in bytes"""
+        return max(self.nbytes - self.nbytes_used, 0)
+
+    def fits_in_memory(self, nbytes: int, fraction: float = 0.5) -> bool:
+        """Check if data should be loaded in memory rather than mapped
+
+        Parameters
+        ----------
+        nbytes : int
+            The size of the data in bytes.
+        fraction : float
+            The largest fraction of the budget a single array may use.
+            The default value is 0.5.
+
+        Returns
+        -------
+        fits : bool
+            True if the data fits in the fraction of the budget and in the
+            memory left after evicting all cache entries.
+        """
+        with self._lock:
+            reserved = sum(self._reserved.values())
+        return nbytes <= min(fraction * self.nbytes, self.nbytes - reserved)
+
+    def make_room(self, nbytes: int) -> int:
+        """Evict the least recently used cache entries until nbytes fit
+
+        Parameters
+        ----------
+        nbytes : int
+            The memory needed in bytes.
+
+        Returns
+        -------
+        nbytes_freed : int
+            The memory freed by the evictions in bytes.
+        """
+        nbytes_freed = 0
+        with self._lock:
+            while self.nbytes_used + nbytes > self.nbytes:
+                oldest_cache = None
+                oldest_access = None
+                for cache in list(self._caches):
+                    last_access = cache.oldest_access()
+                    if last_access is not None and (
+                        oldest_access is None or last_access < oldest_access
+                    ):
+                        oldest_cache = cache
+                        oldest_access = last_access
+                if oldest_cache is None:
+                    # only reservations are left
+                    break
+                nbytes_freed += oldest_cache.evict_oldest()
+
+        return nbytes_freed
+
+    def usage(self) -> Dict[str, int]:
+        """The memory used by each cache and reservation in bytes"""
+        with self._lock:
+            usage = dict(self._reserved)
+            for cache in list(self._caches):
+                usage[cache.name] = usage.get(cache.name, 0) + cache.nbytes
+
+        return usage
+
+    def report(self) -> str:
+        """Format the memory usage of each cache as a table"""
+        usage = self.usage()
+        name_width = max([len(name) for name in usage] + [5])
+        lines = [
+            f'{name:<{name_width}}  {format_nbytes(nbytes):>10}'
+            for name, nbytes in sorted(
+                usage.items(), key=lambda item: item[1], reverse=True
+            )
+        ]
+        lines.append(
+            f'{"total":<{name_width}}  {format_nbytes(self.nbytes_used):>10}'
+            f' of {format_nbytes(self.nbytes)}'
+        )
+
+        return '\n'.join(lines)
+
+
+_memory_budget = None
+_memory_budget_lock = threading.Lock()
+
+
+def get_memory_budget() -> MemoryBudget:
+    """Get the memory budget shared by the caches of the process"""
+    global _memory_budget
+    with _memory_budget_lock:
+        if _memory_budget is None:
+            _memory_budget = MemoryBudget()
+
+    return _memory_budget
+
+
+def set_memory_budget(nbytes: Union[int, str]) -> MemoryBudget:
+    """Set the size of the shared memory budget
+
+    The caches that are already registered keep their entries until
+    they are evicted to make room for new ones.
+
+    Parameters
+    ----------
+    nbytes : Union[int, str]
+        The budget in bytes or as a string such as '8G'.
+
+    Returns
+    -------
+    budget : MemoryBudget
+        The shared memory budget.
+    """
+    budget = get_memory_budget()
+    budget.nbytes = parse_nbytes(nbytes)
+    budget.make_room(0)
+
+    return budget
@@ -70,12 +70,20 @@ class LinePlotWidget(QWidget):
 
     def plot(self, x, y, events=None):
         self.clear()
-        self._plot.plot(x, y)
+        if np.ndim(y) == 2:
+            # plot each trace when several are displayed
+            for y_trace in y:
+                self._plot.plot(x, y_trace)
+        else:
+            self._plot.plot(x, y)
 
         if events is not None:
             if len(events) > 0 and self._events_plot is not None:
                 self.add_events(events, y)
 
+    def add_curve(self, x, y, color='r'):
+        self._plot.plot(x, y, pen=color)
+
     def clear(self):
         self._plot.clear()
         vline = pg.InfiniteLine(angle=90, movable=False)
@@ -0,0 +1,129 @@
+import math
+from typing import Sequence, Tuple
+
+import numpy as np
+import pyqtgraph as pg
+from qtpy.QtCore import QRectF
+from qtpy.QtWidgets import QComboBox, QHBoxLayout, QLabel, QVBoxLayout, QWidget
+
+
+class RasterWidget(QWidget):
+    """Image plot of a cells x time raster with a sort order selector
+
+    The widget only displays the image it is given. The owner draws the
+    window of the raster that covers the view when view_changed_callbacks
+    are called.
+
+    Parameters
+    ----------
+    sort_keys : Sequence[str]
+        The names of the sort orders shown in the selector.
+    xlabel : str
+        The label of the horizontal (time) axis.
+    ylabel : str
+        The label of the vertical (cell) axis.
+    """
+
+    def __init__(
+        self,
+        sort_keys: Sequence[str] = ('index',),
+        xlabel: str = 'time',
+        ylabel: str = 'cell',
+        parent=None,
+    ):
+        super(RasterWidget, self).__init__(parent)
+        self.vbox = QVBoxLayout()
+
+        self.sort_selector = QComboBox()
+        self.sort_selector.addItems(list(sort_keys))
+        self.sort_layout = QHBoxLayout()
+        self.sort_layout.addWidget(QLabel('sort by:'))
+        self.sort_layout.addWidget(self.sort_selector)
+        self.vbox.addLayout(self.sort_layout)
+
+        self._plot = pg.plot()
+        self._plot.setLabel('bottom', xlabel)
+        self._plot.setLabel('left', ylabel)
+        # the first row is at the top like in a matrix
+        self._plot.plotItem.invertY(True)
+        self._image_item = pg.ImageItem()
+        self._image_item.setLevels((0, 255))
+        self._plot.addItem(self._image_item)
+
+        self._vert_line = pg.InfiniteLine(angle=90, movable=False)
+        self._plot.addItem(self._vert_line)
+        self._row_line = pg.InfiniteLine(angle=0, movable=False, pen='r')
+        self._row_line.setVisible(False)
+        self._plot.addItem(self._row_line)
+        self.vbox.addWidget(self._plot)
+        self.setLayout(self.vbox)
+
+        self.view_changed_callbacks = []
+        self.row_clicked_callbacks = []
+        self.sort_changed_callbacks = []
+
+        # connect events
+        self._plot.plotItem.vb.sigRangeChanged.connect(self._on_view_changed)
+        self._plot.scene().sigMouseClicked.connect(self._on_mouse_clicked)
+        self.sort_selector.currentTextChanged.connect(self._on_sort_changed)
+
+    @property
+    def view_region(self) -> Tuple[Tuple[float, float], Tuple[float, float]]:
+        """The ((first frame, last frame), (first row, last row)) in view"""
+        x_range, y_range = self._plot.plotItem.vb.viewRange()
+        return tuple(x_range), tuple(y_range)
+
+    @property
+    def view_size(self) -> Tuple[int, int]:
+        """The (width, height) of the view in pixels"""
+        rect = self._plot.plotItem.vb.sceneBoundingRect()
+        return max(int(rect.width()), 1), max(int(rect.height()), 1)
+
+    def set_limits(self, n_frames: int, n_rows: int):
+        self._plot.plotItem.vb.setLimits(
+            xMin=0, xMax=n_frames, yMin=0, yMax=n_rows
+        )
+        self._plot.plotItem.vb.setRange(
+            xRange=(0, n_frames), yRange=(0, n_rows), padding=0
+        )
+
+    def set_image(self, image: np.ndarray, rect: Tuple[int, int, int, int]):
+        """Display an image over a region of the raster
+
+        Parameters
+        ----------
+        image : np.ndarray
+            The (n_rows, n_columns) uint8 image.
+        rect : Tuple[int, int, int, int]
+            The (first frame, first row, n_frames, n_rows) region the
+            image covers.
+        """
+        # the image items index the x axis first
+        self._image_item.setImage(image.T, levels=(0, 255), autoLevels=False)
+        self._image_item.setRect(QRectF(*rect))
+
+    def update_vline(self, new_pos):
+        self._vert_line.setValue(new_pos)
+
+    def highlight_row(self, row):
+        if row is None:
+            self._row_line.setVisible(False)
+        else:
+            self._row_line.setValue(row + 0.5)
+            self._row_line.setVisible(True)
+
+    def _on_view_changed(self, *args):
+        for callback in self.view_changed_callbacks:
+            callback()
+
+    def _on_mouse_clicked(self, event):
+        view_box = self._plot.plotItem.vb
+        if not view_box.sceneBoundingRect().contains(event.scenePos()):
+            return
+        row = math.floor(view_box.mapSceneToView(event.scenePos()).y())
+        for callback in self.row_clicked_callbacks:
+            callback(row)
+
+    def _on_sort_changed(self, sort_key: str):
+        for callback in self.sort_changed_callbacks:
+            callback(sort_key)
@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable
+
+from qtpy.QtCore import QObject, Signal
+
+
+class MainThreadDispatcher(QObject):
+    """Run functions on the Qt main thread from worker threads
+
+    The dispatcher must be created on the main thread. Functions passed
+    to call() from any thread are queued on the main thread's event loop,
+    so they can safely update layers and widgets.
+    """
+
+    _call_requested = Signal(object)
+
+    def __init__(self, parent=None):
+        super(MainThreadDispatcher, self).__init__(parent)
+        self._call_requested.connect(self._run)
+
+    def call(self, func: Callable, *args, **kwargs):
+        """Queue func(*args, **kwargs) to run on the main thread"""
+        self._call_requested.emit(partial(func, *args, **kwargs))
+
+    def _run(self, func: Callable):
+        func()
+
+
+class LatestOnlyWorker(QObject):
+    """Run computations in a worker thread and apply only the latest result
+
+    Each submit() supersedes the previous one: a superseded computation
+    that has not started is cancelled and the result of one that is
+    already running is discarded. The result of the latest computation
+    is passed to its callback on the Qt main thread. The worker must be
+    created on the main thread.
+    """
+
+    _finished = Signal(object, object)
+
+    def __init__(self, parent=None):
+        super(LatestOnlyWorker, self).__init__(parent)
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._generation = 0
+        self._future = None
+        self._on_result = None
+        self._pending = False
+        self._finished.connect(self._on_finished)
+
+    @property
+    def pending(self) -> bool:
+        """True if the result of the latest computation is not applied"""
+        return self._pending
+
+    def submit(self, func: Callable, *args, on_result: Callable, **kwargs):
+        """Run func(*args, **kwargs) and pass its result to on_result
+
+        Parameters
+        ----------
+        func : Callable
+            The computation. It runs in the worker thread, so it should
+            not touch Qt objects or napari layers.
+        on_result : Callable
+            Called with the result on the main thread, unless a newer
+            computation is submitted first.
+        """
+        self._generation += 1
+        if self._future is not None:
+            self._future.cancel()
+        self._on_result = on_result
+        self._pending = True
+        self._future = self._executor.submit(
+            self._run, self._generation, partial(func, *args, **kwargs)
+        )
+
+    def _run(self, generation: int, func: Callable):
+        if generation != self._generation:
+            # superseded while queued
+            return
+        try:
+            self._finished.emit(generation, (func(), None))
+        except Exception as error:
+            self._finished.emit(generation, (None, error))
+
+    def _on_finished(self, generation: int, output: tuple):
+        if generation != self._generation:
+            # a newer computation was submitted
+            return
+        self._pending = False
+        result, error = output
+        if error is not None:
+            raise error
+        self._on_result(result)
@@ -0,0 +1,110 @@
+import os
+import threading
+from typing import Optional
+
+import numpy as np
+
+from ..io.utils.frames import choose_block_size, map_frame_blocks
+from ..memory import LRUCache
+
+
+# the number of frames of the traces normalized at once
+DEFAULT_BLOCK_FRAMES = 256
+
+
+class ActivityLookup:
+    """The normalized activity of all cells at each frame
+
+    Each trace is scaled to 0-1 between its min and max. The normalized
+    values are computed for blocks of frames and cached frame-major, so
+    getting the activity of all cells at a frame is a contiguous
+    O(n_cells) read, also when the traces are memory mapped cell-major.
+
+    Parameters
+    ----------
+    traces : array-like
+        The (n_cells, n_frames) traces.
+    block_frames : int
+        The number of frames normalized at once. The default value is 256.
+    n_workers : Optional[int]
+        The number of worker threads used to compute the range of each
+        trace. If None, the number of CPUs is used.
+    """
+
+    def __init__(
+        self,
+        traces,
+        block_frames: int = DEFAULT_BLOCK_FRAMES,
+        n_workers: Optional[int] = None,
+    ):
+        self.traces = traces
+        self.n_cells, self.n_frames = traces.shape
+        self.block_frames = block_frames
+        self.n_workers = n_workers or os.cpu_count() or 1
+
+        self._low = None
+        self._scale = None
+        self._range_lock = threading.Lock()
+        self._blocks = LRUCache('activity blocks')
+
+    def _compute_ranges(self):
+        low = np.empty(self.n_cells, dtype=np.float32)
+        high = np.empty(self.n_cells, dtype=np.float32)
+
+        def _block_range(traces, start, stop):
+            low[start:stop] = traces.min(axis=1)
+            high[start:stop] = traces.max(axis=1)
+
+        block_size = choose_block_size(self.traces, max_frames=self.n_cells)
+        for _ in map_frame_blocks(
+            self.traces,
+            _block_range,
+            block_size=block_size,
+            n_workers=self.n_workers,
+        ):
+            pass
+
+        self._scale = 1 / np.maximum(high - low, 1e-12)
+        self._low = low
+
+    def _get_block(self, block_index: int) -> np.ndarray:
+        block = self._blocks.get(block_index)
+        if block is not None:
+            return block
+
+        with self._range_lock:
+            if self._low is None:
+                self._compute_ranges()
+        start = block_index * self.block_frames
+        stop = min(start + self.block_frames, self.n_frames)
+        traces = np.asarray(self.traces[:, start:stop], dtype=np.float32)
+
+        # (n_frames, n_cells), so each frame is contiguous
+        block = np.ascontiguousarray(
+            (
+                (traces - self._low[:, np.newaxis])
+                * self._scale[:, np.newaxis]
+            ).T
+        )
+        np.clip(block, 0, 1, out=block)
+        self._blocks.put(block_index, block)
+
+        return block
+
+    def values(self, frame: int) -> np.ndarray:
+        """Get the normalized activity of each cell at a frame
+
+        Parameters
+        ----------
+        frame : int
+            The index of the frame.
+
+        Returns
+        -------
+        values : np.ndarray
+            (n_cells,) float32 array of the activity scaled to 0-1.
+        """
+        frame = int(np.clip(frame, 0, self.n_frames - 1))
+        block = self._get_block(frame // self.block_frames)
+
+        return block[frame % self.block_frames]
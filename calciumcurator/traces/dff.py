@@ -0,0 +1,484 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Optional, Sequence
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from scipy.ndimage import percentile_filter
+
+from ..io.utils.cache import sidecar_path
+from ..io.utils.frames import DEFAULT_BLOCK_BYTES
+from ..memory import LRUCache
+from .store import NormalizedTraceStore
+
+
+TRACE_MODES = ('raw', 'neuropil', 'dff')
+
+# the length of the dF/F baseline window, in seconds if the frame rate is
+# known and in frames otherwise
+DEFAULT_BASELINE_SECONDS = 60.0
+DEFAULT_BASELINE_WINDOW = 600
+
+
+def subtract_neuropil(
+    f: np.ndarray, f_neu: np.ndarray, neuropil_coefficient: float = 0.7
+) -> np.ndarray:
+    """Subtract the scaled neuropil traces from the fluorescence traces
+
+    Parameters
+    ----------
+    f : np.ndarray
+        (n_cells, n_frames) array of fluorescence traces.
+    f_neu : np.ndarray
+        (n_cells, n_frames) array of neuropil traces.
+    neuropil_coefficient : float
+        The scale factor applied to f_neu. The default value is 0.7
+        (the suite2p default).
+
+    Returns
+    -------
+    f_corrected : np.ndarray
+        (n_cells, n_frames) float32 array of neuropil corrected traces.
+    """
+    f_corrected = np.asarray(f, dtype=np.float32) - np.float32(
+        neuropil_coefficient
+    ) * np.asarray(f_neu, dtype=np.float32)
+    return f_corrected
+
+
+def baseline_window_frames(
+    frame_rate: Optional[float],
+    seconds: float = DEFAULT_BASELINE_SECONDS,
+    default: int = DEFAULT_BASELINE_WINDOW,
+) -> int:
+    """Get the length in frames of a dF/F baseline window
+
+    Parameters
+    ----------
+    frame_rate : Optional[float]
+        The frame rate of the movie in Hz (e.g., the suite2p ops['fs']).
+    seconds : float
+        The length of the window in seconds. The default value is 60
+        (the suite2p default).
+    default : int
+        The length of the window if the frame rate is unknown. The default
+        value is 600.
+
+    Returns
+    -------
+    window : int
+        The number of frames in the window.
+    """
+    if frame_rate is None or not frame_rate > 0:
+        return default
+    return int(max(round(seconds * frame_rate), 1))
+
+
+def sliding_percentile_baseline(
+    traces: np.ndarray,
+    window: int,
+    percentile: float = 8,
+    step: Optional[int] = None,
+) -> np.ndarray:
+    """Compute the baseline (F0) of traces with a sliding window percentile
+
+    The baseline of a frame is the percentile of the frames in the window
+    centered on it, with the first and last frames repeated past the ends
+    of the traces (as scipy.ndimage.percentile_filter(mode='nearest')).
+    By default, the percentile of the raw frames is computed exactly at
+    every step-th frame and linearly interpolated in between, which is
+    ~step times faster than the running percentile and differs from it
+    only by the change of the baseline within step frames. With step=1,
+    the exact running percentile of every frame is computed.
+
+    Parameters
+    ----------
+    traces : np.ndarray
+        (n_cells, n_frames) array of traces.
+    window : int
+        The length of the sliding window in frames.
+    percentile : float
+        The percentile of the window used as the baseline. The default
+        value is 8.
+    step : Optional[int]
+        The number of frames between the frames where the percentile is
+        computed. If None, window // 20 is used.
+
+    Returns
+    -------
+    baseline : np.ndarray
+        (n_cells, n_frames) float32 array of baselines.
+    """
+    traces = np.asarray(traces, dtype=np.float32)
+    n_cells, n_frames = traces.shape
+    window = int(max(window, 1))
+    if step is None:
+        step = window // 20
+    step = int(max(min(step, n_frames), 1))
+    if step == 1:
+        return percentile_filter(
+            traces, percentile, size=(1, window), mode='nearest'
+        )
+
+    # the windows of the sampled frames, including the last frame so that
+    # every frame is interpolated. percentile_filter() takes the element
+    # of this rank, without interpolating between ranks.
+    frames = np.arange(n_frames)
+    sample_frames = np.union1d(frames[::step], [n_frames - 1])
+    rank = min(int(window * percentile / 100), window - 1)
+    padded = np.pad(
+        traces, ((0, 0), (window // 2, (window - 1) // 2)), mode='edge'
+    )
+    windows = as_strided(
+        padded,
+        shape=(n_cells, n_frames, window),
+        strides=padded.strides + padded.strides[1:],
+        writeable=False,
+    )
+
+    # the windows of a block of cells are copied at once
+    block_cells = int(
+        max(DEFAULT_BLOCK_BYTES // (len(sample_frames) * window * 4), 1)
+    )
+    baseline = np.empty((n_cells, n_frames), dtype=np.float32)
+    for start in range(0, n_cells, block_cells):
+        stop = min(start + block_cells, n_cells)
+        sampled = np.partition(
+            windows[start:stop, sample_frames], rank, axis=2
+        )[:, :, rank]
+        for cell_index, cell_samples in enumerate(sampled, start):
+            baseline[cell_index] = np.interp(
+                frames, sample_frames, cell_samples
+            )
+
+    return baseline
+
+
+def compute_dff(
+    traces: np.ndarray,
+    window: int,
+    percentile: float = 8,
+    step: Optional[int] = None,
+) -> np.ndarray:
+    """Compute dF/F = (F - F0) / F0 with a sliding percentile baseline
+
+    Frames where the baseline is zero are set to zero.
+
+    Parameters
+    ----------
+    traces : np.ndarray
+        (n_cells, n_frames) array of traces.
+    window : int
+        The length of the baseline window in frames.
+    percentile : float
+        The percentile of the window used as the baseline.
+    step : Optional[int]
+        The number of frames between the frames where the baseline
+        percentile is computed (see sliding_percentile_baseline()).
+
+    Returns
+    -------
+    dff : np.ndarray
+        (n_cells, n_frames) float32 array of dF/F traces.
+    """
+    traces = np.asarray(traces, dtype=np.float32)
+    baseline = sliding_percentile_baseline(
+        traces, window=window, percentile=percentile, step=step
+    )
+    dff = np.zeros(traces.shape, dtype=np.float32)
+    np.divide(
+        traces - baseline, np.abs(baseline), out=dff, where=baseline != 0
+    )
+
+    return dff
+
+
+class TraceTransformer:
+    """Compute neuropil corrected and dF/F traces on demand
+
+    Traces requested with get() are computed immediately and stored in a
+    bounded LRU cache. compute_all() computes the traces of all cells in a
+    background thread, after which get() slices the precomputed traces.
+    Both caches count against the shared memory budget (see
+    calciumcurator.memory), so they are evicted under memory pressure.
+
+    Parameters
+    ----------
+    f : np.ndarray
+        (n_cells, n_frames) array of fluorescence traces.
+    f_neu : Optional[np.ndarray]
+        (n_cells, n_frames) array of neuropil traces. If None, the
+        'neuropil' mode returns the raw traces.
+    neuropil_coefficient : float
+        The scale factor applied to f_neu. The default value is 0.7.
+    baseline_window : Optional[int]
+        The length of the dF/F baseline window in frames. If None, it is
+        60 s at frame_rate, or 600 frames if the frame rate is unknown.
+    baseline_percentile : float
+        The percentile of the window used as the baseline. The default
+        value is 8.
+    baseline_step : Optional[int]
+        The number of frames between the frames where the baseline
+        percentile is computed (see sliding_percentile_baseline()). If
+        None, baseline_window // 20 is used. 1 computes the exact running
+        percentile.
+    frame_rate : Optional[float]
+        The frame rate of the movie in Hz.
+    cache_size : int
+        The maximum number of cell traces kept in the cache.
+        The default value is 256.
+    source_path : Optional[str]
+        The path to the file the traces are loaded from. If given, the
+        normalized trace stores (see normalized_store()) are persisted
+        next to it.
+    neuropil_path : Optional[str]
+        The path to the file the neuropil traces are loaded from. The
+        persisted stores of the 'neuropil' and 'dff' modes are rebuilt if
+        it changes.
+    """
+
+    def __init__(
+        self,
+        f: np.ndarray,
+        f_neu: Optional[np.ndarray] = None,
+        neuropil_coefficient: float = 0.7,
+        baseline_window: Optional[int] = None,
+        baseline_percentile: float = 8,
+        baseline_step: Optional[int] = None,
+        frame_rate: Optional[float] = None,
+        cache_size: int = 256,
+        source_path: Optional[str] = None,
+        neuropil_path: Optional[str] = None,
+    ):
+        self.f = f
+        self.f_neu = f_neu
+        self.neuropil_coefficient = neuropil_coefficient
+        if baseline_window is None:
+            baseline_window = baseline_window_frames(frame_rate)
+        self.baseline_window = baseline_window
+        self.baseline_percentile = baseline_percentile
+        if baseline_step is None:
+            baseline_step = max(baseline_window // 20, 1)
+        self.baseline_step = baseline_step
+        self.frame_rate = frame_rate
+        self.cache_size = cache_size
+
+        self._cache = LRUCache('cell traces', max_entries=cache_size)
+        self._all_futures = {}
+        # the future holds the traces too, so it is dropped on eviction
+        self._all_traces = LRUCache(
+            'all cell traces',
+            on_evict=lambda mode, _: self._all_futures.pop(mode, None),
+        )
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+        self.source_path = source_path
+        self.neuropil_path = neuropil_path
+        self._stores = {}
+
+    @property
+    def n_cells(self) -> int:
+        return self.f.shape[0]
+
+    def transform(self, cell_indices: Sequence[int], mode: str) -> np.ndarray:
+        """Compute the traces of cells without using the cache
+
+        Parameters
+        ----------
+        cell_indices : Sequence[int]
+            The indices of the cells to compute the traces for.
+        mode : str
+            'raw', 'neuropil' (neuropil corrected) or 'dff'
+            (dF/F of the neuropil corrected traces).
+
+        Returns
+        -------
+        traces : np.ndarray
+            (len(cell_indices), n_frames) array of traces.
+        """
+        if mode not in TRACE_MODES:
+            raise ValueError(f'{mode} is not a recognized trace mode')
+
+        cell_indices = np.asarray(cell_indices, dtype=int)
+        traces = np.asarray(self.f[cell_indices], dtype=np.float32)
+        if mode == 'raw':
+            return traces
+
+        if self.f_neu is not None:
+            traces = subtract_neuropil(
+                traces,
+                self.f_neu[cell_indices],
+                neuropil_coefficient=self.neuropil_coefficient,
+            )
+        if mode == 'dff':
+            traces = compute_dff(
+                traces,
+                window=self.baseline_window,
+                percentile=self.baseline_percentile,
+                step=self.baseline_step,
+            )
+
+        return traces
+
+    def get(
+        self, cell_indices: Sequence[int], mode: str = 'dff'
+    ) -> np.ndarray:
+        """Get the traces of cells, computing the ones that are not cached
+
+        Parameters
+        ----------
+        cell_indices : Sequence[int]
+            The indices of the cells to get the traces for.
+        mode : str
+            'raw', 'neuropil' or 'dff'.
+
+        Returns
+        -------
+        traces : np.ndarray
+            (len(cell_indices), n_frames) array of traces.
+        """
+        cell_indices = [int(index) for index in cell_indices]
+        if mode == 'raw':
+            return np.asarray(self.f[cell_indices])
+        all_traces = self._all_traces.get(mode)
+        if all_traces is not None:
+            return all_traces[cell_indices]
+
+        missing = [
+            index for index in cell_indices if (mode, index) not in self._cache
+        ]
+        computed = {}
+        if len(missing) > 0:
+            for index, trace in zip(missing, self.transform(missing, mode)):
+                computed[index] = trace
+                self._cache.put((mode, index), trace)
+
+        traces = []
+        for index in cell_indices:
+            trace = computed.get(index)
+            if trace is None:
+                trace = self._cache.get((mode, index))
+            if trace is None:
+                # evicted since the membership test
+                trace = self.transform([index], mode)[0]
+            traces.append(trace)
+
+        return np.stack(traces)
+
+    def compute_all(self, mode: str = 'dff', block_size: int = 512) -> Future:
+        """Compute the traces of all cells in a background thread
+
+        Parameters
+        ----------
+        mode : str
+            'raw', 'neuropil' or 'dff'.
+        block_size : int
+            The number of cells transformed at once.
+
+        Returns
+        -------
+        future : concurrent.futures.Future
+            The future resolves to the (n_cells, n_frames) traces, or to
+            None if they do not fit in the memory budget.
+        """
+        future = self._all_futures.get(mode)
+        if future is not None:
+            return future
+
+        nbytes = self.f.shape[0] * self.f.shape[1] * 4
+        if not self._all_traces.budget.fits_in_memory(nbytes):
+            # get() keeps computing the requested traces on demand
+            future = Future()
+            future.set_result(None)
+            return future
+
+        def _compute_all():
+            all_traces = np.empty(self.f.shape, dtype=np.float32)
+            for start in range(0, self.n_cells, block_size):
+                stop = min(start + block_size, self.n_cells)
+                all_traces[start:stop] = self.transform(
+                    np.arange(start, stop), mode
+                )
+            self._all_traces.put(mode, all_traces)
+            return all_traces
+
+        future = self._executor.submit(_compute_all)
+        self._all_futures[mode] = future
+        return future
+
+    def parameter_suffix(self, mode: str) -> str:
+        """Describe the parameters of a trace mode for cache file names
+
+        Caches of data derived from the traces are invalidated when the
+        parameters change by adding this suffix to their file names.
+
+        Parameters
+        ----------
+        mode : str
+            'raw', 'neuropil' or 'dff'.
+
+        Returns
+        -------
+        suffix : str
+            e.g., 'neuropil0.7_dff600p8s30'.
+        """
+        suffix = 'raw'
+        if mode != 'raw' and self.f_neu is not None:
+            suffix = f'neuropil{self.neuropil_coefficient:g}'
+        if mode == 'dff':
+            suffix += (
+                f'_dff{self.baseline_window}p{self.baseline_percentile:g}'
+                f's{self.baseline_step}'
+            )
+        return suffix
+
+    def _store_suffix(self, mode: str, normalization: str) -> str:
+        # the cached stores are invalidated when the parameters change
+        return f'{normalization}_{self.parameter_suffix(mode)}'
+
+    def normalized_store(
+        self, mode: str = 'raw', normalization: str = 'zscore'
+    ) -> NormalizedTraceStore:
+        """Get the store of the normalized traces of all cells
+
+        The stores are shared by all the views of the traces. Each store
+        is built in the background the first time traces are requested
+        from it.
+
+        Parameters
+        ----------
+        mode : str
+            'raw', 'neuropil' or 'dff'.
+        normalization : str
+            'zscore' or 'minmax'.
+
+        Returns
+        -------
+        store : NormalizedTraceStore
+            The store of the normalized traces.
+        """
+        if mode not in TRACE_MODES:
+            raise ValueError(f'{mode} is not a recognized trace mode')
+        key = (mode, normalization)
+        if key not in self._stores:
+            if self.source_path is None:
+                cache_path = None
+                source_paths = ()
+            else:
+                cache_path = sidecar_path(
+                    self.source_path,
+                    self._store_suffix(mode, normalization),
+                    ext='.npy',
+                )
+                source_paths = [self.source_path]
+                if mode != 'raw' and self.neuropil_path is not None:
+                    source_paths.append(self.neuropil_path)
+            self._stores[key] = NormalizedTraceStore(
+                partial(self.transform, mode=mode),
+                shape=self.f.shape,
+                normalization=normalization,
+                cache_path=cache_path,
+                source_paths=source_paths,
+            )
+
+        return self._stores[key]
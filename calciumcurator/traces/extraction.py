@@ -0,0 +1,308 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from ..images.crops import load_registered_cell_movie
+from ..io.utils.frames import map_frame_blocks
+
+
+def normalize_footprints(footprints: sparse.spmatrix) -> sparse.csr_matrix:
+    """Scale each footprint so its weights sum to 1
+
+    With normalized footprints, the extracted traces are the weighted
+    mean of the pixels in each footprint.
+    """
+    footprints = sparse.csr_matrix(footprints, dtype=np.float32)
+    weight_sums = np.asarray(footprints.sum(axis=1)).ravel()
+    scale = np.zeros(weight_sums.shape, dtype=np.float32)
+    np.divide(1, weight_sums, out=scale, where=weight_sums != 0)
+
+    return sparse.diags(scale).dot(footprints).tocsr()
+
+
+def binarize_footprints(
+    footprints: sparse.spmatrix, threshold: float = 0
+) -> sparse.csr_matrix:
+    """Keep the pixels of each footprint above a fraction of its maximum
+
+    Parameters
+    ----------
+    footprints : sparse.spmatrix
+        (n_cells, n_frame_pixels) matrix of the pixel weights of each cell.
+    threshold : float
+        The fraction of the maximum weight of each cell above which
+        the pixels are kept. The default value is 0, which keeps all the
+        pixels with a positive weight.
+
+    Returns
+    -------
+    binary_footprints : sparse.csr_matrix
+        (n_cells, n_frame_pixels) matrix with 1 for each kept pixel.
+    """
+    footprints = sparse.csr_matrix(footprints, dtype=np.float32)
+    footprints.sum_duplicates()
+    cell_ids = np.repeat(
+        np.arange(footprints.shape[0]), np.diff(footprints.indptr)
+    )
+    cell_max = np.zeros((footprints.shape[0],), dtype=np.float32)
+    np.maximum.at(cell_max, cell_ids, footprints.data)
+    keep = (footprints.data > 0) & (
+        footprints.data >= threshold * cell_max[cell_ids]
+    )
+
+    return sparse.csr_matrix(
+        (
+            np.ones(np.count_nonzero(keep), dtype=np.float32),
+            (cell_ids[keep], footprints.indices[keep]),
+        ),
+        shape=footprints.shape,
+    )
+
+
+def footprints_from_contours(
+    contours: List[np.ndarray], im_shape: Tuple[int, ...]
+) -> sparse.csr_matrix:
+    """Make binary footprints from the pixel coordinates of each cell
+
+    Parameters
+    ----------
+    contours : List[np.ndarray]
+        (n_pixels, n_dims) array of pixel coordinates for each cell, as
+        stored in ContourManager.
+    im_shape : Tuple[int, ...]
+        The shape of a frame.
+
+    Returns
+    -------
+    footprints : sparse.csr_matrix
+        (n_cells, n_frame_pixels) matrix with 1 for each pixel of each cell.
+    """
+    n_pixels = np.array([len(contour) for contour in contours], dtype=int)
+    cell_ids = np.repeat(np.arange(len(contours)), n_pixels)
+    if len(cell_ids) > 0:
+        coordinates = np.round(np.concatenate(contours)).astype(int)
+        pixel_indices = np.ravel_multi_index(tuple(coordinates.T), im_shape)
+    else:
+        pixel_indices = np.zeros((0,), dtype=int)
+
+    footprints = sparse.csr_matrix(
+        (np.ones(len(cell_ids), dtype=np.float32), (cell_ids, pixel_indices)),
+        shape=(len(contours), int(np.prod(im_shape))),
+    )
+    # duplicated pixels are summed by the constructor
+    footprints.data[:] = 1
+
+    return footprints
+
+
+def footprints_from_caiman(
+    A: sparse.spmatrix, dims: Tuple[int, int]
+) -> sparse.csr_matrix:
+    """Make footprints from the CaImAn spatial components
+
+    Parameters
+    ----------
+    A : sparse.spmatrix
+        (n_pixels, n_cells) CaImAn spatial components. The pixels are in
+        Fortran order.
+    dims : Tuple[int, int]
+        The (n_rows, n_cols) shape of a frame.
+
+    Returns
+    -------
+    footprints : sparse.csr_matrix
+        (n_cells, n_frame_pixels) matrix with the pixels in C order.
+    """
+    A = sparse.coo_matrix(A)
+    rows, cols = np.unravel_index(A.row, dims, order='F')
+    pixel_indices = np.ravel_multi_index((rows, cols), dims)
+
+    return sparse.csr_matrix(
+        (A.data.astype(np.float32), (A.col, pixel_indices)),
+        shape=(A.shape[1], int(np.prod(dims))),
+    )
+
+
+def footprints_from_stat(
+    packed_stat, im_shape: Tuple[int, int], allow_overlap: bool = False
+) -> sparse.csr_matrix:
+    """Make footprints from the suite2p pixel weights (lam)
+
+    Parameters
+    ----------
+    packed_stat : PackedStat
+        The packed suite2p stats.
+    im_shape : Tuple[int, int]
+        The (n_rows, n_cols) shape of a frame.
+    allow_overlap : bool
+        whether or not to include overlapping pixels in the footprints
+
+    Returns
+    -------
+    footprints : sparse.csr_matrix
+        (n_cells, n_frame_pixels) matrix of the lam weights.
+    """
+    pixel_indices = np.ravel_multi_index(
+        (packed_stat.ypix, packed_stat.xpix), im_shape
+    )
+    cell_ids = packed_stat.cell_ids
+    weights = packed_stat.lam.astype(np.float32)
+    if not allow_overlap:
+        keep = np.logical_not(packed_stat.overlap)
+        pixel_indices = pixel_indices[keep]
+        cell_ids = cell_ids[keep]
+        weights = weights[keep]
+
+    return sparse.csr_matrix(
+        (weights, (cell_ids, pixel_indices)),
+        shape=(packed_stat.n_cells, int(np.prod(im_shape))),
+    )
+
+
+def _extract_block(
+    frames: np.ndarray, footprints: sparse.csr_matrix
+) -> np.ndarray:
+    frames = frames.reshape(frames.shape[0], -1).astype(np.float32)
+    return np.asarray(footprints.dot(frames.T))
+
+
+class TraceExtractor:
+    """Extract cell traces from a movie with a sparse footprint matrix
+
+    The traces of all cells in a block of frames are computed as a single
+    sparse x dense product. Blocks of frames are streamed from the movie
+    and processed in a thread pool.
+
+    Parameters
+    ----------
+    movie : array-like
+        The (n_frames, ...) movie.
+    footprints : sparse.spmatrix
+        (n_cells, n_frame_pixels) matrix of the pixel weights of each cell.
+    normalize : bool
+        If True, the footprints are scaled so the weights of each cell sum
+        to 1. The default value is True.
+    block_size : Optional[int]
+        The number of frames per block. If None, it is chosen to align
+        with the movie's chunks.
+    n_workers : Optional[int]
+        The number of worker threads. If None, the number of CPUs is used.
+    raw_movie : Optional[array-like]
+        The unregistered movie, if movie is registered as it is read.
+        The cells extracted with extract() are then cropped from the raw
+        movie (see calciumcurator.images.crops.load_registered_cell_movie()).
+    offsets : Optional[np.ndarray]
+        The (n_frames, 2) (row, column) registration offset of each frame
+        of raw_movie.
+    """
+
+    def __init__(
+        self,
+        movie,
+        footprints: sparse.spmatrix,
+        normalize: bool = True,
+        block_size: Optional[int] = None,
+        n_workers: Optional[int] = None,
+        raw_movie=None,
+        offsets: Optional[np.ndarray] = None,
+    ):
+        self.movie = movie
+        self.raw_movie = raw_movie
+        self.offsets = offsets
+        if normalize:
+            self.footprints = normalize_footprints(footprints)
+        else:
+            self.footprints = sparse.csr_matrix(footprints, dtype=np.float32)
+        self.block_size = block_size
+        self.n_workers = n_workers
+
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._all_future = None
+
+    @property
+    def n_frames(self) -> int:
+        return self.movie.shape[0]
+
+    @property
+    def frame_shape(self) -> Tuple[int, ...]:
+        return tuple(self.movie.shape[1:])
+
+    def _stream(self, movie, footprints: sparse.csr_matrix) -> np.ndarray:
+        traces = np.empty((footprints.shape[0], self.n_frames), np.float32)
+        for start, stop, block_traces in map_frame_blocks(
+            movie,
+            lambda frames, start, stop: _extract_block(frames, footprints),
+            block_size=self.block_size,
+            n_workers=self.n_workers,
+        ):
+            traces[:, start:stop] = block_traces
+
+        return traces
+
+    def extract(self, cell_indices: Sequence[int]) -> np.ndarray:
+        """Extract the traces of a few cells
+
+        Only the bounding box of the cells' footprints is read from
+        each frame. If the movie is registered as it is read, the
+        bounding box is read from the raw movie and each frame's shift is
+        applied to the crop, since cropping the registered movie reads
+        the full frames.
+
+        Parameters
+        ----------
+        cell_indices : Sequence[int]
+            The indices of the cells to extract.
+
+        Returns
+        -------
+        traces : np.ndarray
+            (len(cell_indices), n_frames) array of traces.
+        """
+        footprints = self.footprints[np.asarray(cell_indices, dtype=int)]
+        footprints = footprints.tocoo()
+        if footprints.nnz == 0:
+            return np.zeros((footprints.shape[0], self.n_frames), np.float32)
+
+        # crop the frames to the bounding box of the footprints
+        coordinates = np.unravel_index(footprints.col, self.frame_shape)
+        rows = coordinates[-2]
+        cols = coordinates[-1]
+        min_r, max_r = rows.min(), rows.max() + 1
+        min_c, max_c = cols.min(), cols.max() + 1
+        if self.raw_movie is not None and self.offsets is not None:
+            cropped_movie = load_registered_cell_movie(
+                self.raw_movie,
+                self.offsets,
+                slice(min_r, max_r),
+                slice(min_c, max_c),
+                n_workers=self.n_workers,
+            )
+        else:
+            cropped_movie = self.movie[..., min_r:max_r, min_c:max_c]
+
+        crop_shape = self.frame_shape[:-2] + (max_r - min_r, max_c - min_c)
+        crop_indices = np.ravel_multi_index(
+            coordinates[:-2] + (rows - min_r, cols - min_c), crop_shape
+        )
+        crop_footprints = sparse.csr_matrix(
+            (footprints.data, (footprints.row, crop_indices)),
+            shape=(footprints.shape[0], int(np.prod(crop_shape))),
+        )
+
+        return self._stream(cropped_movie, crop_footprints)
+
+    def extract_all(self) -> Future:
+        """Extract the traces of all cells in a background thread
+
+        Returns
+        -------
+        future : concurrent.futures.Future
+            The future resolves to the (n_cells, n_frames) traces.
+        """
+        if self._all_future is None:
+            self._all_future = self._executor.submit(
+                self._stream, self.movie, self.footprints
+            )
+        return self._all_future
@@ -0,0 +1,381 @@
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import math
+import os
+from typing import Optional, Tuple
+import weakref
+
+import numpy as np
+
+from ..io.utils.frames import choose_block_size, map_frame_blocks
+from ..memory import MemoryBudget, get_memory_budget
+
+
+# the stored levels of the pyramid are at most this fraction of the
+# memory budget in total
+DEFAULT_PYRAMID_FRACTION = 0.125
+
+# the windows of the levels that are not stored are computed from the
+# traces if reading them takes at most this many bytes
+DEFAULT_WINDOW_BYTES = 64 * 1024 ** 2
+
+# the coarsest level is at most this many cells or frames
+MIN_LEVEL_SIZE = 16
+
+# numbers the reservations of the pyramids in the memory budget
+_pyramid_ids = itertools.count()
+
+
+def _downsample(image: np.ndarray, axis: int, reduce_max: bool) -> np.ndarray:
+    """Halve an image along an axis with the max or mean of pairs
+
+    An odd last element is kept as it is.
+    """
+    image = np.moveaxis(image, axis, 0)
+    n_pairs = image.shape[0] // 2
+    pairs = image[: 2 * n_pairs].reshape((n_pairs, 2) + image.shape[1:])
+    if reduce_max:
+        halved = pairs.max(axis=1)
+    else:
+        halved = pairs.mean(axis=1, dtype=np.float32)
+        halved = np.rint(halved).astype(image.dtype)
+    if image.shape[0] % 2 == 1:
+        halved = np.concatenate([halved, image[-1:]])
+
+    return np.moveaxis(halved, 0, axis)
+
+
+def _n_levels(size: int) -> int:
+    n_levels = 1
+    while size > MIN_LEVEL_SIZE:
+        size = -(-size // 2)
+        n_levels += 1
+    return n_levels
+
+
+class RasterPyramid:
+    """Multi-resolution cells x time raster of a trace matrix
+
+    Each trace is scaled to 0-255 between its min and max and level
+    (cell_level, time_level) of the pyramid halves the cells cell_level
+    times (with the mean of pairs of rows, in the display order) and the
+    frames time_level times (with the max of pairs of frames, so that
+    short transients stay visible when zoomed out).
+
+    The levels halved over time at least first_stored_level times are
+    computed in one streaming pass over the traces and stored, together
+    with all their cell levels. Sorting the cells only rebuilds the cell
+    levels from the stored levels. The finer levels are computed from the
+    traces for the requested window when it is small enough, i.e., when
+    zoomed in.
+
+    The stored levels are reserved in the shared memory budget (see
+    calciumcurator.memory) until close() is called or the pyramid is
+    garbage collected.
+
+    Parameters
+    ----------
+    traces : array-like
+        The (n_cells, n_frames) traces. Memory mapped and lazy arrays are
+        read in blocks of cells.
+    max_nbytes : Optional[int]
+        The maximum total size of the stored levels. If None, it is
+        DEFAULT_PYRAMID_FRACTION of the memory budget.
+    max_window_nbytes : int
+        The maximum size of the traces read to compute a window of a level
+        that is not stored. The default value is 64 MiB.
+    n_workers : Optional[int]
+        The number of worker threads. If None, the number of CPUs is used.
+    budget : Optional[MemoryBudget]
+        The memory budget the stored levels are reserved in. If None, the
+        shared budget is used.
+    """
+
+    def __init__(
+        self,
+        traces,
+        max_nbytes: Optional[int] = None,
+        max_window_nbytes: int = DEFAULT_WINDOW_BYTES,
+        n_workers: Optional[int] = None,
+        budget: Optional[MemoryBudget] = None,
+    ):
+        self.traces = traces
+        self.n_cells, self.n_frames = traces.shape
+        self.max_window_nbytes = max_window_nbytes
+        self.n_workers = n_workers or os.cpu_count() or 1
+
+        if budget is None:
+            budget = get_memory_budget()
+        if max_nbytes is None:
+            max_nbytes = int(DEFAULT_PYRAMID_FRACTION * budget.nbytes)
+        self.budget = budget
+
+        self.n_cell_levels = _n_levels(self.n_cells)
+        self.n_time_levels = _n_levels(self.n_frames)
+
+        # the stored levels and their cell levels take about 6 times
+        # the size of the finest stored level
+        self.first_stored_level = self.n_time_levels - 1
+        for time_level in range(self.n_time_levels):
+            n_bytes = self.n_cells * self.level_shape(0, time_level)[1]
+            if 6 * n_bytes <= max_nbytes:
+                self.first_stored_level = time_level
+                break
+
+        # the caches make room for the levels before they are built
+        self._reservation = f'raster pyramid {next(_pyramid_ids)}'
+        n_bytes = (
+            self.n_cells * self.level_shape(0, self.first_stored_level)[1]
+        )
+        budget.make_room(6 * n_bytes)
+        budget.reserve(self._reservation, 6 * n_bytes)
+        self._release = weakref.finalize(
+            self, budget.release, self._reservation
+        )
+
+        self.order = np.arange(self.n_cells)
+        self._low = np.zeros(self.n_cells, dtype=np.float32)
+        self._scale = np.ones(self.n_cells, dtype=np.float32)
+        self._time_levels = {}
+        self._levels = {}
+        try:
+            self._build_time_levels()
+            self._levels = self._build_cell_levels(self.order)
+        except BaseException:
+            self.close()
+            raise
+        budget.reserve(self._reservation, self.nbytes)
+
+    def close(self):
+        """Drop the stored levels and release their memory reservation"""
+        self._levels = {}
+        self._time_levels = {}
+        self._release()
+
+    def level_shape(self, cell_level: int, time_level: int) -> Tuple[int, int]:
+        """Get the (n_rows, n_columns) shape of a level"""
+        return (
+            -(-self.n_cells // 2 ** cell_level),
+            -(-self.n_frames // 2 ** time_level),
+        )
+
+    @property
+    def nbytes(self) -> int:
+        """The size of the stored levels"""
+        return sum(level.nbytes for level in self._levels.values()) + sum(
+            level.nbytes for level in self._time_levels.values()
+        )
+
+    def _scale_traces(self, traces: np.ndarray, cells) -> np.ndarray:
+        scaled = (traces - self._low[cells, np.newaxis]) * self._scale[
+            cells, np.newaxis
+        ]
+        np.clip(scaled, 0, 255, out=scaled)
+        return np.rint(scaled).astype(np.uint8)
+
+    def _build_time_levels(self):
+        first_level = self.first_stored_level
+        for time_level in range(first_level, self.n_time_levels):
+            self._time_levels[time_level] = np.empty(
+                self.level_shape(0, time_level), dtype=np.uint8
+            )
+
+        def _build_block(traces, start, stop):
+            traces = traces.astype(np.float32)
+            low = traces.min(axis=1)
+            high = traces.max(axis=1)
+            self._low[start:stop] = low
+            self._scale[start:stop] = 255 / np.maximum(high - low, 1e-12)
+
+            image = self._scale_traces(traces, slice(start, stop))
+            for time_level in range(self.n_time_levels):
+                if time_level > 0:
+                    image = _downsample(image, axis=1, reduce_max=True)
+                if time_level >= first_level:
+                    self._time_levels[time_level][start:stop] = image
+
+        # the block reads are at most half the window size
+        block_size = choose_block_size(
+            self.traces,
+            target_nbytes=self.max_window_nbytes // 2,
+            max_frames=self.n_cells,
+        )
+        for _ in map_frame_blocks(
+            self.traces,
+            _build_block,
+            block_size=block_size,
+            n_workers=self.n_workers,
+        ):
+            pass
+
+    def _build_cell_levels(self, order: np.ndarray) -> dict:
+        def _build_time_level(time_level):
+            image = self._time_levels[time_level][order]
+            levels = {(0, time_level): image}
+            for cell_level in range(1, self.n_cell_levels):
+                image = _downsample(image, axis=0, reduce_max=False)
+                levels[(cell_level, time_level)] = image
+            return levels
+
+        levels = {}
+        with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+            for time_levels in executor.map(
+                _build_time_level, list(self._time_levels)
+            ):
+                levels.update(time_levels)
+
+        return levels
+
+    def set_order(self, order: np.ndarray):
+        """Set the display order of the cells
+
+        Parameters
+        ----------
+        order : np.ndarray
+            (n_cells,) array of the cell indices in display order.
+        """
+        order = np.asarray(order, dtype=int)
+        if not np.array_equal(np.sort(order), np.arange(self.n_cells)):
+            raise ValueError('order must be a permutation of the cells')
+        levels = self._build_cell_levels(order)
+        # the levels are replaced with the order for concurrent reads
+        self._levels, self.order = levels, order
+
+    def choose_levels(
+        self, n_rows: float, n_columns: float, height: int, width: int,
+    ) -> Tuple[int, int]:
+        """Choose the levels to display a region of the raster
+
+        Parameters
+        ----------
+        n_rows : float
+            The number of cells in the displayed region.
+        n_columns : float
+            The number of frames in the displayed region.
+        height : int
+            The height of the display in pixels.
+        width : int
+            The width of the display in pixels.
+
+        Returns
+        -------
+        cell_level : int
+            The coarsest cell level with at least one row per pixel.
+        time_level : int
+            The coarsest time level with at least one column per pixel.
+        """
+
+        def _level(n_values, n_pixels, n_levels):
+            ratio = max(n_values, 1) / max(n_pixels, 1)
+            if ratio <= 1:
+                return 0
+            return min(int(math.floor(math.log2(ratio))), n_levels - 1)
+
+        return (
+            _level(n_rows, height, self.n_cell_levels),
+            _level(n_columns, width, self.n_time_levels),
+        )
+
+    def read(
+        self,
+        cell_level: int,
+        time_level: int,
+        row_range: Tuple[float, float],
+        frame_range: Tuple[float, float],
+    ) -> Tuple[np.ndarray, Tuple[int, int, int, int]]:
+        """Read the window of a level covering a region of the raster
+
+        If the level is not stored and computing the window would read too
+        much of the traces, the finest stored time level is used.
+
+        Parameters
+        ----------
+        cell_level : int
+            The cell level.
+        time_level : int
+            The time level.
+        row_range : Tuple[float, float]
+            The (first, last) displayed rows, in cells.
+        frame_range : Tuple[float, float]
+            The (first, last) displayed frames.
+
+        Returns
+        -------
+        image : np.ndarray
+            The (n_rows, n_columns) uint8 window of the level.
+        rect : Tuple[int, int, int, int]
+            The (first frame, first row, n_frames, n_cells) region of the
+            raster the window covers.
+        """
+        row_start, row_stop, cell_step = self._window(
+            row_range, cell_level, self.n_cells
+        )
+        if time_level < self.first_stored_level:
+            frame_start, frame_stop, frame_step = self._window(
+                frame_range, time_level, self.n_frames
+            )
+            window_nbytes = (
+                (row_stop - row_start)
+                * cell_step
+                * (frame_stop - frame_start)
+                * frame_step
+                * np.dtype(self.traces.dtype).itemsize
+            )
+            if window_nbytes > self.max_window_nbytes:
+                time_level = self.first_stored_level
+
+        frame_start, frame_stop, frame_step = self._window(
+            frame_range, time_level, self.n_frames
+        )
+        if (cell_level, time_level) in self._levels:
+            image = self._levels[(cell_level, time_level)][
+                row_start:row_stop, frame_start:frame_stop
+            ]
+        else:
+            image = self._compute_window(
+                cell_level,
+                time_level,
+                (row_start * cell_step, row_stop * cell_step),
+                (frame_start * frame_step, frame_stop * frame_step),
+            )
+
+        rect = (
+            frame_start * frame_step,
+            row_start * cell_step,
+            image.shape[1] * frame_step,
+            image.shape[0] * cell_step,
+        )
+        return image, rect
+
+    def _window(
+        self, value_range: Tuple[float, float], level: int, size: int
+    ) -> Tuple[int, int, int]:
+        step = 2 ** level
+        n_level = -(-size // step)
+        start = int(max(math.floor(value_range[0] / step), 0))
+        stop = int(min(math.ceil(value_range[1] / step) + 1, n_level))
+        return min(start, n_level), max(stop, min(start, n_level)), step
+
+    def _compute_window(
+        self,
+        cell_level: int,
+        time_level: int,
+        row_range: Tuple[int, int],
+        frame_range: Tuple[int, int],
+    ) -> np.ndarray:
+        cells = self.order[row_range[0] : min(row_range[1], self.n_cells)]
+        frame_stop = min(frame_range[1], self.n_frames)
+        # memory maps and lazy arrays are read in increasing order
+        sorted_cells = np.sort(cells)
+        traces = np.asarray(
+            self.traces[sorted_cells, frame_range[0] : frame_stop]
+        )
+        traces = traces[np.searchsorted(sorted_cells, cells)]
+
+        image = self._scale_traces(traces.astype(np.float32), cells)
+        for _ in range(time_level):
+            image = _downsample(image, axis=1, reduce_max=True)
+        for _ in range(cell_level):
+            image = _downsample(image, axis=0, reduce_max=False)
+
+        return image
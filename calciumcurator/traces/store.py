@@ -0,0 +1,280 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import os
+import threading
+from typing import Callable, Optional, Sequence
+
+import numpy as np
+
+from ..io.utils.cache import is_cache_valid, sidecar_path
+from ..memory import LRUCache
+
+
+NORMALIZATIONS = ('zscore', 'minmax')
+
+# the default number of cells normalized per task
+DEFAULT_CHUNK_CELLS = 256
+
+
+def normalize_traces(traces: np.ndarray, normalization: str) -> np.ndarray:
+    """Normalize each trace
+
+    Parameters
+    ----------
+    traces : np.ndarray
+        (n_cells, n_frames) array of traces.
+    normalization : str
+        'zscore' to subtract the mean and divide by the standard deviation
+        of each trace, or 'minmax' to scale each trace to 0-1 between its
+        min and max. Constant traces are 0.
+
+    Returns
+    -------
+    normalized : np.ndarray
+        (n_cells, n_frames) float32 array of normalized traces.
+    """
+    traces = np.asarray(traces, dtype=np.float32)
+    if normalization == 'zscore':
+        offset = traces.mean(axis=1, keepdims=True)
+        scale = traces.std(axis=1, keepdims=True)
+    elif normalization == 'minmax':
+        offset = traces.min(axis=1, keepdims=True)
+        scale = traces.max(axis=1, keepdims=True) - offset
+    else:
+        raise ValueError(f'{normalization} is not a recognized normalization')
+
+    normalized = np.zeros(traces.shape, dtype=np.float32)
+    np.divide(
+        traces - offset,
+        scale,
+        out=normalized,
+        where=np.broadcast_to(scale > 0, traces.shape),
+    )
+
+    return normalized
+
+
+class NormalizedTraceStore:
+    """Normalized float32 traces of all cells, precomputed in cell chunks
+
+    The traces are stored cell-major, so the trace of a cell is a
+    contiguous row. build() normalizes chunks of cells in parallel and,
+    if a cache path is given, writes them to a .npy file that is memory
+    mapped and reused by later sessions until the source files change.
+    Without a cache path, the store is built in memory if it fits the
+    shared memory budget. Until the store is built (or if it does not
+    fit or is evicted), get() and indexing start building it in the
+    background and normalize only the requested cells.
+
+    Parameters
+    ----------
+    read_traces : Callable[[np.ndarray], np.ndarray]
+        Returns the (len(cell_indices), n_frames) traces of cells, e.g.,
+        the transform() of a TraceTransformer. It is called from several
+        threads.
+    shape : tuple
+        The (n_cells, n_frames) shape of the traces.
+    normalization : str
+        'zscore' or 'minmax' (see normalize_traces()).
+        The default value is 'zscore'.
+    cache_path : Optional[str]
+        The path to the .npy file the store is persisted in.
+        If None, the store is not persisted.
+    source_paths : Sequence[str]
+        The paths to the files the traces are loaded from. The cached
+        store is rebuilt if any of them is newer.
+    chunk_cells : int
+        The number of cells normalized per task. The default value is 256.
+    n_workers : Optional[int]
+        The number of worker threads. If None, the number of CPUs is used.
+    """
+
+    def __init__(
+        self,
+        read_traces: Callable[[np.ndarray], np.ndarray],
+        shape: tuple,
+        normalization: str = 'zscore',
+        cache_path: Optional[str] = None,
+        source_paths: Sequence[str] = (),
+        chunk_cells: int = DEFAULT_CHUNK_CELLS,
+        n_workers: Optional[int] = None,
+    ):
+        if normalization not in NORMALIZATIONS:
+            raise ValueError(
+                f'{normalization} is not a recognized normalization'
+            )
+        self.read_traces = read_traces
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(np.float32)
+        self.normalization = normalization
+        self.cache_path = cache_path
+        self.source_paths = list(source_paths)
+        self.chunk_cells = chunk_cells
+        self.n_workers = n_workers or os.cpu_count() or 1
+
+        self._traces = None
+        self._build_future = None
+        self._build_lock = threading.Lock()
+        # held only to start the build, so get() never waits for it
+        self._future_lock = threading.Lock()
+        # the store built in memory counts against the memory budget. if
+        # it is evicted, the cells are normalized on demand again until
+        # the store is rebuilt.
+        self._memory = LRUCache(
+            f'normalized traces ({normalization})',
+            on_evict=lambda key, value: self._on_evict(),
+        )
+
+        if cache_path is not None and is_cache_valid(
+            cache_path, self.source_paths
+        ):
+            traces = np.load(cache_path, mmap_mode='r')
+            if traces.shape == self.shape:
+                self._traces = traces
+
+    @property
+    def n_cells(self) -> int:
+        return self.shape[0]
+
+    @property
+    def ndim(self) -> int:
+        return 2
+
+    def __len__(self) -> int:
+        return self.n_cells
+
+    @property
+    def is_built(self) -> bool:
+        return self._traces is not None
+
+    def _on_evict(self):
+        self._traces = None
+        with self._future_lock:
+            self._build_future = None
+
+    def _normalize_cells(self, start: int, stop: int) -> np.ndarray:
+        return normalize_traces(
+            self.read_traces(np.arange(start, stop)), self.normalization
+        )
+
+    def _fill(self, out: np.ndarray):
+        chunks = [
+            (start, min(start + self.chunk_cells, self.n_cells))
+            for start in range(0, self.n_cells, self.chunk_cells)
+        ]
+
+        def _fill_chunk(chunk):
+            start, stop = chunk
+            out[start:stop] = self._normalize_cells(start, stop)
+
+        with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+            for _ in executor.map(_fill_chunk, chunks):
+                pass
+
+    def build(self) -> Optional[np.ndarray]:
+        """Normalize the traces of all cells in parallel
+
+        Returns
+        -------
+        traces : Optional[np.ndarray]
+            The (n_cells, n_frames) normalized traces, a read-only memmap
+            if the store is persisted, or None if the store is not
+            persisted and does not fit in the memory budget.
+        """
+        with self._build_lock:
+            if self._traces is not None:
+                return self._traces
+
+            if self.cache_path is not None:
+                traces = self._build_file()
+            else:
+                nbytes = int(np.prod(self.shape)) * self.dtype.itemsize
+                if not self._memory.budget.fits_in_memory(nbytes):
+                    return None
+                traces = np.empty(self.shape, dtype=self.dtype)
+                self._fill(traces)
+            # set before it is added to the budget, which may evict it
+            self._traces = traces
+            if self.cache_path is None:
+                self._memory.put('traces', traces, nbytes=nbytes)
+
+        return traces
+
+    def _build_file(self) -> np.ndarray:
+        partial_path = sidecar_path(self.cache_path, 'partial', ext='.npy')
+        try:
+            out = np.lib.format.open_memmap(
+                partial_path, mode='w+', dtype=self.dtype, shape=self.shape
+            )
+            self._fill(out)
+            out.flush()
+            del out
+            os.replace(partial_path, self.cache_path)
+        except BaseException:
+            if os.path.isfile(partial_path):
+                os.remove(partial_path)
+            raise
+
+        return np.load(self.cache_path, mmap_mode='r')
+
+    def build_async(self) -> Future:
+        """Build the store in a background thread
+
+        Returns
+        -------
+        future : concurrent.futures.Future
+            The future of build().
+        """
+        with self._future_lock:
+            if self._build_future is None:
+                executor = ThreadPoolExecutor(max_workers=1)
+                self._build_future = executor.submit(self.build)
+                executor.shutdown(wait=False)
+
+        return self._build_future
+
+    def get(self, cell_indices: Sequence[int]) -> np.ndarray:
+        """Get the normalized traces of cells
+
+        If the store is not built yet, it is built in the background and
+        the requested cells are normalized on demand.
+
+        Parameters
+        ----------
+        cell_indices : Sequence[int]
+            The indices of the cells.
+
+        Returns
+        -------
+        traces : np.ndarray
+            (len(cell_indices), n_frames) float32 array of traces.
+        """
+        cell_indices = np.asarray(cell_indices, dtype=int)
+        traces = self._traces
+        if traces is not None:
+            return np.asarray(traces[cell_indices])
+
+        self.build_async()
+        return normalize_traces(
+            self.read_traces(cell_indices), self.normalization
+        )
+
+    def __getitem__(self, key) -> np.ndarray:
+        traces = self._traces
+        if traces is not None:
+            return np.asarray(traces[key])
+
+        # only the requested cells are normalized while the store builds
+        cell_indices = np.arange(self.n_cells)[
+            key[0] if isinstance(key, tuple) else key
+        ]
+        frame_key = key[1:] if isinstance(key, tuple) else ()
+        traces = self.get(np.atleast_1d(cell_indices))
+        if np.ndim(cell_indices) == 0:
+            traces = traces[0]
+        return traces[(Ellipsis,) + frame_key]
+
+    def __array__(self, dtype=None) -> np.ndarray:
+        traces = self[:]
+        if dtype is not None:
+            traces = traces.astype(dtype)
+        return traces
@@ -1,12 +1,16 @@
 import argparse
+from functools import partial
 import os
 
 import napari
 from skimage import io
 
 from .calcium_curator import CalciumCurator
+from .images.summary import load_summary_images
 from .io.caiman.caiman_reader import caiman_reader
 from .io.caiman._vendored import load_dict_from_hdf5
+from .io.pipeline import Stage, run_stages
+from .io.utils.cache import sidecar_path
 
 
 def parse_args():
@@ -15,18 +19,30 @@ def parse_args():
     parser.add_argument("--image", default="", type=str, help="options")
     parser.add_argument("--mip", default="", type=str, help="options")
     parser.add_argument("--output", default="", type=str, help="options")
+    parser.add_argument(
+        "--filled-masks",
+        action="store_true",
+        help="draw the filled cell masks instead of their outlines",
+    )
 
     args = parser.parse_args()
     results_file = args.results
     image_path = args.image
     mip_path = args.mip
     output_dir = args.output
+    mask_outlines = not args.filled_masks
 
-    return results_file, image_path, output_dir, mip_path
+    return results_file, image_path, output_dir, mip_path, mask_outlines
 
 
 def view_caiman():
-    results_file, image_path, output_dir, mip_path = parse_args()
+    (
+        results_file,
+        image_path,
+        output_dir,
+        mip_path,
+        mask_outlines,
+    ) = parse_args()
 
     cnm_obj = load_dict_from_hdf5(results_file)
 
@@ -67,7 +83,7 @@ def view_caiman():
         mip = io.imread(mip_path)
 
     with napari.gui_qt():
-        CalciumCurator(
+        curator = CalciumCurator(
             img=im_registered,
             data_range=data_range,
             cell_masks=cell_masks,
@@ -79,4 +95,17 @@ def view_caiman():
             spikes=spikes,
             output=output_dir,
             cells=is_cell,
+            mask_outlines=mask_outlines,
         )
+        # compute the summary images if a MIP isn't provided. they are
+        # computed in the background and added when they are ready.
+        if mip is None:
+            load_summary = partial(
+                load_summary_images,
+                im_registered,
+                cache_path=sidecar_path(image_path, 'summary', ext='.npz'),
+                source_paths=[image_path],
+            )
+            curator.attach_stages(
+                run_stages({"summary_images": Stage(load_summary)})
+            )